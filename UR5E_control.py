@@ -1,233 +1,228 @@
-import rtde_control # For controlling the robot
-import rtde_receive # For receiving data from the robot
-import rtde_io # For robot IO
-
-import time
-import logging
-import numpy as np
-from configuration import*
-
-
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
-
-
-
-
-##########################
-#class for controlling UR robot with UR_RDTE. gives easy way to use the library. 
-# you need to enter the robot ip. us connect() for connecting etc.
-##########################
-class URControl:
-    def __init__(self, robot_ip):
-        self.robot_ip = robot_ip
-
-        self.rtde_ctrl = None
-        self.rtde_rec = None
-        self.rtde_inout = None
-
-
-
-    # Connect to robot with retry logic
-    def connect(self):
-        max_retries = 10
-        retry_delay = 0.5  # Delay in seconds between retries
-
-
-        for attempt in range(1, max_retries + 1):
-            try:
-                self.rtde_ctrl = rtde_control.RTDEControlInterface(self.robot_ip)
-                self.rtde_rec = rtde_receive.RTDEReceiveInterface(self.robot_ip)
-                self.rtde_inout = rtde_io.RTDEIOInterface(self.robot_ip)
-                logging.info(f"Connected to robot: {self.robot_ip} on attempt {attempt}")
-                return  # Exit the method upon successful connection
-            except Exception as e:
-                logging.error(f"Attempt {attempt} failed: {e}")
-                if attempt < max_retries:
-                    time.sleep(retry_delay)  # Wait before retrying
-                else:
-                    logging.error("Max retries reached. Unable to connect to the robot.")
-                    raise
-
-
-    #stop connection to robot
-    def stop_robot_control(self):
-        self.rtde_ctrl.stopScript()
-        logging.info("stopped connection with robot")
-
-
-    #set tool frame (TCP frame)
-    def set_tool_frame(self, tool_frame):
-        try:
-            self.rtde_ctrl.setTcp(tool_frame)
-            #logging.info(f"succesfully setted toolframe: {self.rtde_ctrl.getTCPOffset()}")
-        except Exception as e:
-            logging.error(f"error setting toolframe: {e}")
-
-    def set_tcp(self, tool_frame):
-        self.set_tool_frame(tool_frame)
-
-
-    #set payload (not tested). needs payload(kg), center of gravity (CoGx, CoGy, CoGz)
-    def set_payload(self, payload, cog):
-        try:
-            self.rtde_ctrl.setPayLoad(payload, cog)
-        except Exception as e:
-            logging.error(f"can not set COG or/and payload: {e}")    
-    
-
-    #set digital output
-    def set_digital_output(self, output_id, state):
-        try:
-            self.rtde_inout.setStandardDigitalOut(output_id, state)
-            logging.info(f"digital output {output_id} is {state}")
-        except Exception as e:
-            logging.error(f"Eror setting digital output {output_id}: {e}")
-        
-
-    #pulse digital output. duration in seconds
-    def pulse_digital_output(self, output_id, duration):
-        self.set_digital_output(output_id=output_id, state=True)
-        time.sleep(duration)
-        self.set_digital_output(output_id=output_id, state=False)
-
-
-
-    #move L
-    def move_l(self, pos, speed=0.5, acceleration=0.5):
-        try:
-            self.rtde_ctrl.moveL(pos, speed, acceleration)
-        except Exception as e:
-            logging.error(f"can not move: {e}")
-
-
-    #move L path
-    def move_l_path(self, path):
-        try:
-            self.rtde_ctrl.moveL(path)
-        except Exception as e:
-            logging.error(f"can not move: {e}")
-
-
-    #move j (not tested yet)
-    def move_j(self, pos, speed=0.5, acceleration=0.5):
-        try:
-            self.rtde_ctrl.moveJ(pos, speed, acceleration)
-        except Exception as e:
-            logging.error(f"can not move: {e}")
-
-
-    #move add (relative movement based of current position
-    def move_add_l(self, relative_move, speed=0.5, acceleration=0.5):
-        try:
-            current_tcp_pos = self.get_tcp_pos()
-            new_linear_move = [current_tcp_pos[i] +  relative_move[i] for i in range(6)]
-            self.move_l(new_linear_move, speed, acceleration)
-        except Exception as e:
-            logging.error(f"cannot do relative move: {e}")
-        
-
-    #move add j (relative movement based of current position
-    def move_add_j(self, relative_move, speed=0.5, acceleration=0.5):
-        try:
-            current_tcp_pos = self.get_tcp_pos()
-            new_linear_move = [current_tcp_pos[i] +  relative_move[i] for i in range(6)]
-            self.move_j(new_linear_move, speed, acceleration)
-        except Exception as e:
-            logging.error(f"cannot do relative move: {e}")
-
-
-
-    #help functions for pose_trans
-    def rodrigues_to_rotation_matrix(self,r):
-        """Converteer een rodrigues-vector naar een rotatiematrix."""
-        theta = np.linalg.norm(r)
-        if theta < 1e-6:  # Geen rotatie
-            return np.eye(3)
-        k = r / theta
-        K = np.array([
-            [0, -k[2], k[1]],
-            [k[2], 0, -k[0]],
-            [-k[1], k[0], 0]
-        ])
-        return np.eye(3) + np.sin(theta) * K + (1 - np.cos(theta)) * np.dot(K, K)
-
-    def pose_to_matrix(self,pose):
-        """Converteer een 6D-pose naar een 4x4 transformatie-matrix."""
-        R = self.rodrigues_to_rotation_matrix(pose[3:])  # Rotatie
-        t = np.array(pose[:3])  # Translatie
-        T = np.eye(4)
-        T[:3, :3] = R
-        T[:3, 3] = t
-        return T
-
-    def matrix_to_pose(self,matrix):
-        """Converteer een 4x4 transformatie-matrix terug naar een 6D-pose."""
-        R = matrix[:3, :3]
-        t = matrix[:3, 3]
-        theta = np.arccos((np.trace(R) - 1) / 2)
-        if theta < 1e-6:
-            r = np.zeros(3)
-        else:
-            r = theta / (2 * np.sin(theta)) * np.array([
-                R[2, 1] - R[1, 2],
-                R[0, 2] - R[2, 0],
-                R[1, 0] - R[0, 1]
-            ])
-        return np.concatenate((t, r))
-
-    def pose_trans(self,pose1, pose2):
-        """Combineer twee poses met behulp van matrixvermenigvuldiging."""
-        T1 = self.pose_to_matrix(pose1)
-        T2 = self.pose_to_matrix(pose2)
-        T_result = np.dot(T1, T2)
-        return self.matrix_to_pose(T_result)
-
-
-    #return actual TCP position
-    def get_tcp_pos(self):
-        try:
-            return self.rtde_rec.getActualTCPPose()
-        except Exception as e:
-            logging.error(f"cannot return actual tcp pose: {e}")
-
-
-    #return actual joint pos
-    def get_joint_pos(self):
-        try:
-            return self.rtde_rec.getActualQ()
-        except Exception as e:
-            logging.error(f"cannot return actual joint pose: {e}")
-
-
-    def set_tcp_rotation(self,rx, ry, rz,speed=0.1,acc=0.1):
-        """
-        Sets the rotation of the tool center point (TCP).
-
-        Args:
-            rx (float): Rotation around the X-axis in degrees.
-            ry (float): Rotation around the Y-axis in degrees.
-            rz (float): Rotation around the Z-axis in degrees.
-
-        Returns:
-            None
-        """
-        # Get the current TCP pose
-        current_pose = self.get_tcp_pose()  # Assume this returns [x, y, z, rx, ry, rz]
-
-        # Update the rotation components
-        current_pose[3] = rx  # Set rotation around X-axis
-        current_pose[4] = ry  # Set rotation around Y-axis
-        current_pose[5] = rz  # Set rotation around Z-axis
-
-        # Move the robot to the new rotation
-        self.move_l(current_pose, speed, acc)  # Execute a linear move to the updated pose
-
-
-if __name__ == '__main__':
-    robot = URControl('192.168.0.1')
-    robot.connect()
+from robot_connection import RobotConnection, RobotError, RobotConnectionError, RobotCommandError, CONTROL, RECEIVE, IO
+from robot_state import RobotStateCache
+from io_scheduler import IOScheduler
+
+import time
+import logging
+import numpy as np
+from configuration import*
+
+
+logging.basicConfig(
+    level=logging.DEBUG,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+
+
+
+##########################
+#class for controlling UR robot with UR_RDTE. gives easy way to use the library. 
+# you need to enter the robot ip. us connect() for connecting etc.
+# the interfaces are kept open by RobotConnection. every method raises a RobotError when the robot can not be
+# reached or does not carry out the command, nothing returns None
+# positions are read from the RobotStateCache, that samples the robot state in the background. right after a move
+# the cache has no record of the new pose yet, then the position is read from the receive interface
+##########################
+class URControl:
+    def __init__(self, robot_ip):
+        self.robot_ip = robot_ip
+        self.connection = RobotConnection(robot_ip, health_interval=robot_health_interval, health_timeout=robot_health_timeout,
+                                          retry_delay=robot_retry_delay, retry_max=robot_retry_max, wait_timeout=robot_wait_timeout)
+        self.state_cache = RobotStateCache(self.connection, rate=robot_state_rate, history=robot_state_history)
+        self.io = IOScheduler(self.set_digital_output)     #timed output writes (pulses) on a timer thread
+
+        #seq of the first state record that is sampled after the last move or tcp change. older records can still
+        #have the old pose or tcp
+        self.fresh_seq = 1
+
+        self.motion_time = 0.0  #total time spent in move commands, used for cycle time statistics
+        self.motion_stopped = False     #stop_motion ended the move that runs
+        self.motion_poll = 0.008        #seconds between the checks whether the move is done
+
+
+
+    # Connect to robot, retries with a growing delay and keeps the connection alive in the background
+    def connect(self):
+        if simulate_robot:
+            from fake_rtde import FakeRobot
+            fake = FakeRobot(sim_time_scale)
+            self.connection.openers = (lambda: fake.control, lambda: fake.receive, lambda: fake.io)
+            self.connection.connect(robot_connect_timeout)
+            self.state_cache.start()
+            logging.info("Connected to simulated robot")
+            return
+
+        self.connection.connect(robot_connect_timeout)
+        self.state_cache.start()
+
+
+    #use interfaces that are already open (simulated robot)
+    def attach(self, control, receive, io):
+        self.connection.attach(control, receive, io)
+
+
+    #stop connection to robot
+    def stop_robot_control(self):
+        self.io.stop()
+        self.state_cache.stop()
+        self.connection.close()
+        logging.info("stopped connection with robot")
+
+
+    #set tool frame (TCP frame)
+    def set_tool_frame(self, tool_frame):
+        self.connection.call(CONTROL, 'setTcp', tool_frame)
+        self.state_changed()
+
+    def set_tcp(self, tool_frame):
+        self.set_tool_frame(tool_frame)
+
+
+    #set payload (not tested). needs payload(kg), center of gravity (CoGx, CoGy, CoGz)
+    def set_payload(self, payload, cog):
+        self.connection.call(CONTROL, 'setPayLoad', payload, cog)
+    
+
+    #set digital output
+    def set_digital_output(self, output_id, state):
+        self.connection.call(IO, 'setStandardDigitalOut', output_id, state)
+        self.io.written(output_id, state)
+        logging.info(f"digital output {output_id} is {state}")
+        
+
+    #pulse digital output. duration in seconds. does not wait, returns a future that is done when the output is off again
+    def pulse_digital_output(self, output_id, duration):
+        return self.io.pulse(output_id, duration)
+
+
+    #timed output writes: steps (delay, output_id, state), delay in seconds from now. does not wait, returns a future
+    #that is done after the last write
+    def digital_output_sequence(self, steps):
+        return self.io.sequence(steps)
+
+
+    #runs a move command and waits until the robot finished it. the move is sent asynchronous, so the control
+    #interface is free for stop_motion while the robot moves. raises a RobotCommandError if the robot did not
+    #start or finish the move
+    def move(self, method, *args):
+        start = time.time()
+        self.motion_stopped = False
+        try:
+            if not self.connection.call(CONTROL, method, *args, True):
+                raise RobotCommandError(f"{method} was not carried out by the robot")
+            while self.connection.call(CONTROL, 'getAsyncOperationProgress') >= 0:
+                time.sleep(self.motion_poll)
+            if self.motion_stopped or not self.connection.call(CONTROL, 'isProgramRunning'):
+                raise RobotCommandError(f"{method} was not finished by the robot")
+        finally:
+            self.motion_time += time.time() - start
+            self.state_changed()
+
+
+    #stops the move that is running (decelerates the tool to zero), the move command returns early. called from
+    #another thread than the one that moves
+    def stop_motion(self, deceleration=2.0):
+        self.motion_stopped = True
+        self.connection.call(CONTROL, 'stopL', deceleration)
+        logging.info("robot motion stopped")
+
+
+    #the robot state changed by a command. a record sampled while the command finished can be one robot cycle old,
+    #so the next record that counts is two records later
+    def state_changed(self):
+        self.fresh_seq = self.state_cache.latest_seq() + 2
+
+
+    #newest robot state record sampled after the last command, never waits for the sampler. None if there is no such
+    #record yet, the cache is not running or the connection is down: then the caller reads the receive interface
+    #itself (and gets the connection error)
+    def fresh_state(self):
+        if not self.state_cache.running or not self.connection.connected.is_set():
+            return None
+        record = self.state_cache.latest()
+        if record is None or record['seq'] < self.fresh_seq:
+            return None
+        return record
+
+
+    #waits until the tcp is at pose, see RobotStateCache.wait_for_pose
+    def wait_for_pose(self, pose, tolerance=0.001, rotation_tolerance=0.01, timeout=5.0):
+        return self.state_cache.wait_for_pose(pose, tolerance, rotation_tolerance, timeout)
+
+
+    #move L
+    def move_l(self, pos, speed=0.5, acceleration=0.5):
+        self.move('moveL', pos, speed, acceleration)
+
+
+    #move L path
+    def move_l_path(self, path):
+        self.move('moveL', path)
+
+
+    #move j (not tested yet)
+    def move_j(self, pos, speed=0.5, acceleration=0.5):
+        self.move('moveJ', pos, speed, acceleration)
+
+
+    #move add (relative movement based of current position
+    def move_add_l(self, relative_move, speed=0.5, acceleration=0.5):
+        current_tcp_pos = self.get_tcp_pos()
+        new_linear_move = [current_tcp_pos[i] +  relative_move[i] for i in range(6)]
+        self.move_l(new_linear_move, speed, acceleration)
+        
+
+    #move add j (relative movement based of current position
+    def move_add_j(self, relative_move, speed=0.5, acceleration=0.5):
+        current_tcp_pos = self.get_tcp_pos()
+        new_linear_move = [current_tcp_pos[i] +  relative_move[i] for i in range(6)]
+        self.move_j(new_linear_move, speed, acceleration)
+
+
+
+    #return actual TCP position
+    def get_tcp_pos(self):
+        record = self.fresh_state()
+        if record is not None:
+            return record['tcp_pose'].tolist()
+        return self.connection.call(RECEIVE, 'getActualTCPPose')
+
+
+    #return actual joint pos
+    def get_joint_pos(self):
+        record = self.fresh_state()
+        if record is not None:
+            return record['q'].tolist()
+        return self.connection.call(RECEIVE, 'getActualQ')
+
+
+    def set_tcp_rotation(self,rx, ry, rz,speed=0.1,acc=0.1):
+        """
+        Sets the rotation of the tool center point (TCP).
+
+        Args:
+            rx (float): Rotation around the X-axis in degrees.
+            ry (float): Rotation around the Y-axis in degrees.
+            rz (float): Rotation around the Z-axis in degrees.
+
+        Returns:
+            None
+        """
+        # Get the current TCP pose
+        current_pose = self.get_tcp_pose()  # Assume this returns [x, y, z, rx, ry, rz]
+
+        # Update the rotation components
+        current_pose[3] = rx  # Set rotation around X-axis
+        current_pose[4] = ry  # Set rotation around Y-axis
+        current_pose[5] = rz  # Set rotation around Z-axis
+
+        # Move the robot to the new rotation
+        self.move_l(current_pose, speed, acc)  # Execute a linear move to the updated pose
+
+
+if __name__ == '__main__':
+    robot = URControl('192.168.0.1')
+    robot.connect()
     robot.stop_robot_control()
\ No newline at end of file
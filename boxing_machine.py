@@ -1,7 +1,12 @@
 import logging
-import threading
-from UR5E_control import URControl
+from UR5E_control import URControl, RobotError
 from camera_position import CameraPosition         # used for scanning the belt for detected parts
+from pick_pipeline import PickPipeline             # used for running vision while the robot is placing
+from cycle_stats import CycleStats                 # used for cycle time statistics
+from machine_state import MachineState             # placements, boxes and status for the user interface
+from conveyor import Conveyor                      # runs the belt until enough parts are staged
+from orchestrator import Orchestrator, RunStopped  # runs the main loop as an asyncio task, stop cancels it
+from part_profiles import PART_PROFILES            # tuned values per part type
 from pick_parts import *                           # used for picking parts from belt. needs x and y coordinates
 from place_parts import *                          # used for getting place locations and placing parts in boxes
 from configuration import *
@@ -33,28 +38,66 @@ class BoxingMachine:
         # Initialize vision camera class
         self.camera = CameraPosition(robot=self.robot, boxing_machine=self)
 
-        # Pause control using threading Event
-        self.pause_event = threading.Event()
-        self.pause_event.set()  # Initially not paused
+        # Pipelined mode: vision looks for the next part in the background
+        self.pick_pipeline = PickPipeline(camera=self.camera, boxing_machine=self)
+        if pipelined_mode:
+            self.pick_pipeline.start()
 
         self.current_part_number = 1
-        self.last_part_box_0 = 0
-        self.last_part_box_1 = 0
-        self.total_parts = 0
-        self.placements = 0
-        self.current_box = 0
-        self.boxes_are_full = False
-        self.thread_lock = threading.Lock()
 
-        self.stop_main_loop = False
+        #placements, current box and status. the user interface subscribes to the changes
+        self.state = MachineState()
+
+        self.stats = CycleStats()   #time per stage, used by the replay harness benchmark
+
+        # Conveyor: the camera reports the staged parts, the belt runs while the main loop runs
+        self.conveyor = Conveyor(self.robot, self, output_id=conveyor_output, report_timeout=conveyor_report_timeout,
+                                 max_run_time=conveyor_max_run_time)
+        if conveyor_control:
+            self.camera.conveyor = self.conveyor
+
+        # Main loop as an asyncio task: the stages run in a thread pool, the orchestrator holds the pause and stop state
+        self.orchestrator = Orchestrator(on_cancel=self.run_cancelled)
 
     def pause(self):
         logging.info("Pausing operations...")
-        self.pause_event.clear()
+        self.orchestrator.pause()
 
     def resume(self):
         logging.info("Resuming operations...")
-        self.pause_event.set()
+        self.orchestrator.resume()
+
+    def is_paused(self):
+        return self.orchestrator.paused
+
+    #true after a stop until the next run starts. the stages check it to give up without another move
+    @property
+    def stop_main_loop(self):
+        return self.orchestrator.stopped
+
+    #the machine needs the operator: pause and let the interface show it on the tk thread
+    def pause_for_operator(self, status):
+        self.pause()
+        self.state.machine_paused(status)
+
+    #the machine can not go on: stop the run and let the interface show it on the tk thread
+    def stop_for_operator(self, status):
+        self.stop_run()
+        self.boxes_replaced()
+        self.state.machine_stopped(status)
+
+    #stop button. the main loop ends right away, the robot stops the move it is in
+    def stop_run(self):
+        logging.info("Stopping main loop...")
+        self.orchestrator.stop()
+
+    #the run was cancelled while a stage can still be running in the pool: stop the move it is in, it gives up at
+    #its next wait_if_paused
+    def run_cancelled(self):
+        try:
+            self.robot.stop_motion()
+        except RobotError as e:
+            logging.error(f"can not stop robot motion: {e}")
 
     def packing_mode(self):
         logging.info("move to packing mode")
@@ -72,42 +115,60 @@ class BoxingMachine:
         target_position = [-0.6639046352765678, -0.08494527187802497, 0.529720350746548, 2.222, 2.248, 0.004]
         self.robot.move_l(target_position, 0.3, 0.3)
 
+    #checkpoint inside the stages (pool threads). blocks while paused, raises RunStopped when the run was stopped,
+    #so a stage never starts another move after a stop
     def wait_if_paused(self):
         #logging.info("Waiting if paused...")
         if self.interface.stopped: 
             logging.info("interface stopped, stop main loop")
-            self.stop_main_loop = True
             self.interface.stopped = False
-            return
-        self.pause_event.wait()  # Block if paused
+            self.stop_run()
+        self.orchestrator.checkpoint()
+
+    #checkpoint of the main loop between the stages. waits while paused, a stop cancels the run while it waits
+    async def checkpoint(self):
+        if self.interface.stopped:
+            logging.info("interface stopped, stop main loop")
+            self.interface.stopped = False
+            raise RunStopped("interface stopped")
+        await self.orchestrator.wait_resumed()
 
     def start(self):
         logging.info("Starting Boxing Machine...")
-        self.main_loop()
+        if conveyor_control:
+            self.conveyor.start()
+        try:
+            self.orchestrator.run(self.main_loop)
+        except RunStopped:
+            logging.info("Stopping main loop due to stop signal.")
+        except RobotError as e:
+            #connection lost or command refused. the connection comes back by itself, the run has to be started again
+            logging.error(f"main loop stopped by robot error: {e}")
+            self.state.robot_error(str(e))
+        finally:
+            self.conveyor.stop()
+            self.pick_pipeline.arm_busy()   #main loop left, arm position is unknown
+
+    #the operator replaced the boxes (stop button or boxes full), their orientation has to be scanned again
+    def boxes_replaced(self):
+        self.camera.invalidate_box_orientations()
 
     def stop(self):
         logging.info("Stopping robot control and camera pipeline...")
+        self.pick_pipeline.stop()
+        self.conveyor.stop()
         self.robot.stop_robot_control()
-        self.camera.pipeline.stop()
+        self.camera.stop()
  
  
-    #checks parttype and adjusts part size y 
+    #checks parttype and adjusts the part height (one layer in the box) to the thickness of the part type
     def check_part_type(self, part_type):
-        if part_type == 'Big-Blue':
-            self.part.part_size_z = 0.01260
-            self.pack_box.part_height = self.part.part_size_z
-        elif part_type == 'Green':
-            self.part.part_size_z = 0.009
-            self.pack_box.part_height = self.part.part_size_z
-        elif part_type == 'Holed':
-            self.part.part_size_z = 0.0085 
-            self.pack_box.part_height = self.part.part_size_z
-        elif part_type == 'Rubber':
-            self.part.part_size_z = 0.01055
-            self.pack_box.part_height = self.part.part_size_z
-        elif part_type == 'Small-Blue':
-            self.part.part_size_z = 0.009
-            self.pack_box.part_height = self.part.part_size_z
+        profile = PART_PROFILES.get(part_type)
+        if profile is None:
+            logging.info(f"unknown part type {part_type}, part height not changed")
+            return
+        self.part.part_size_z = profile.thickness
+        self.pack_box.part_height = self.part.part_size_z
 
 
 
@@ -124,17 +185,15 @@ class BoxingMachine:
         logging.info(f"box orientations: {box_orientations}")
 
         #check part type on belt
-        x, y, item_type = self.camera.detect_pickable_parts(slow=False)  # Get actual coordinates from vision
+        x, y, item_type, z = self.camera.detect_pickable_parts(slow=False)  # Get actual coordinates from vision
         self.check_part_type(item_type)
         return item_type, box_orientations
 
   
-    #main loop that fills all available boxes
-    def main_loop(self):
-        self.placements = 0
+    #main loop that fills all available boxes. runs on the orchestrator loop, every blocking stage runs in its pool
+    async def main_loop(self):
+        self.state.reset()
         run_mode = 0        #0 is normal mode, 1 is only packing
-        self.last_part_box_0 = 0
-        self.last_part_box_1 = 0
 
         logging.info("In main loop")
 
@@ -145,7 +204,9 @@ class BoxingMachine:
         }
         if run_mode == 0:
             #pass
-            item_type, box_orientations = self.initialize_main_loop()
+            item_type, box_orientations = await self.orchestrator.stage(self.initialize_main_loop)
+            if pipelined_mode:
+                self.pick_pipeline.arm_at_capture()     #detect_pickable_parts left the arm at the capture position
 
 
         #get packing positions
@@ -153,88 +214,62 @@ class BoxingMachine:
 
 
         #start for loop to go through all packing positions and fill the boxes
-        self.boxes_are_full = False
         box_index = 0
         for box in filled_boxes:
-            if self.stop_main_loop:  # Check if stop signal is set
-                logging.info("Stopping main loop due to stop signal.")
-                self.stop_main_loop = False
-                return  # Exit the function immediately
-
-            with self.thread_lock:
-                self.current_box = box_index
+            self.state.set_box(box_index, total_parts=len(box))
 
 
             for part in box:
                 if box_index >= 0 and part['layer_number'] >= 0:
-                    if self.stop_main_loop:  # Check if stop signal is set
-                        logging.info("Stopping main loop due to stop signal.")
-                        self.stop_main_loop = False
-                        return  # Exit the function immediately
-
                     logging.info(f"Processing part: {part}")
 
-                    with self.thread_lock:
-                        self.current_part_number = part['part_number']
-                        self.total_parts = len(box)
+                    self.current_part_number = part['part_number']
 
-                    
-                    self.wait_if_paused()
-                    if self.stop_main_loop:  # Check after potentially long operations
-                        self.stop_main_loop = False
-                        logging.info("Stopping main loop due to stop signal.")
-                        return
+                    await self.checkpoint()
 
                     #check pickable parts
                     if run_mode == 0:
                         #logging.info("check pickable parts with vision")
-                        x, y, item_type = self.camera.detect_pickable_parts()  # Get actual coordinates from vision
-                        logging.info(f"x: {x}   y: {y}   item_type: {item_type}")
+                        with self.stats.stage('vision'):
+                            if pipelined_mode:
+                                x, y, item_type, z = await self.orchestrator.stage(self.pick_pipeline.next_pick)  # Candidate found by the vision stage
+                            else:
+                                x, y, item_type, z = await self.orchestrator.stage(self.camera.detect_pickable_parts)  # Get actual coordinates from vision
+                        logging.info(f"x: {x}   y: {y}   z: {z}   item_type: {item_type}")
 
-                    
-                    if self.stop_main_loop:  # Check after potentially long operations
-                        self.stop_main_loop = False
-                        logging.info("Stopping main loop due to stop signal.")
-                        return
-                    self.wait_if_paused()
-                    if self.stop_main_loop:  # Check after potentially long operations
-                        self.stop_main_loop = False
-                        logging.info("Stopping main loop due to stop signal.")
-                        return
+                    await self.checkpoint()
 
 
                     #pickup parts
                     if run_mode == 0:
                         #logging.info("pickup part")
                         #pass
-                        self.pick_part.pick_parts(x, y, part_type=item_type)  # Uncomment when ready
+                        if pipelined_mode:
+                            await self.orchestrator.stage(self.pick_pipeline.arm_busy)
+                        with self.stats.stage('pick'):
+                            await self.orchestrator.stage(self.pick_part.pick_parts, x, y, part_type=item_type, part_z=z)
 
 
-                    self.wait_if_paused()
-                    if self.stop_main_loop:  # Check after potentially long operations
-                        self.stop_main_loop = False
-                        logging.info("Stopping main loop due to stop signal.")
-                        return
+                    await self.checkpoint()
 
 
 
                     #place parts
                     #logging.info("Place part")
                     box_orientation = box_orientations.get(f'box_{box_index}')  # Get the orientation for the current box
-                    self.pack_box.place_part(part, part_type=item_type, box_rotation=box_orientation)  # Pass the box orientation
+                    with self.stats.stage('place'):
+                        await self.orchestrator.stage(self.pack_box.place_part, part, part_type=item_type, box_rotation=box_orientation)  # Pass the box orientation
 
-                    with self.thread_lock:
-                        self.placements += 1
-                        if box_index == 0:
-                            self.last_part_box_0 = part
-                        elif box_index == 1:
-                            self.last_part_box_1 = part
+                        #place_part ends above the belt, let the vision stage look for the next part while we finish up
+                        if pipelined_mode and run_mode == 0:
+                            await self.orchestrator.stage(self.camera.capture_position)
+                            self.pick_pipeline.arm_at_capture()
+                    self.stats.placement_done()
+                    self.state.placement_done(box_index, part)
 
                     
 
             box_index += 1
 
-        with self.thread_lock:
-            self.boxes_are_full = True
-            
-        self.stop_main_loop = False
\ No newline at end of file
+        self.state.set_boxes_full()
+        self.boxes_replaced()
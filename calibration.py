@@ -0,0 +1,315 @@
+import argparse
+import json
+import logging
+import math
+import os
+import time
+import types
+import numpy as np
+from pose_math import pose_to_matrix, matrix_to_pose
+from configuration import *
+
+
+##########################
+#camera calibration. the robot moves the camera through a grid of poses around the capture pose while a target
+#(black disc on a white card) lies still on the belt. from the target pixel in every frame two things are fitted:
+# - pixel_to_robot: least squares fit of the belt position seen at the capture pose, xd = a*xp + b*yp + c and
+#   yd = d*xp + e*yp + f. moving the camera by (dx, dy) looks the same as moving the target by (-dx, -dy)
+# - camera_extrinsic: pose of the camera in the capture tcp frame (hand-eye), rigid fit of the deprojected target
+#   points against the target position in the tcp frame of every grid pose
+#the result goes to a versioned json file that CameraPosition loads at startup.
+#
+#on the line pc:   python calibration.py --robot-ip 192.168.0.10 --touch
+#without a cell:   python replay_harness.py calibrate      (simulated robot and camera)
+##########################
+
+#format version of the calibration file
+CALIBRATION_VERSION = 1
+
+#first calibration, fitted by hand. used when there is no calibration file
+DEFAULT_CALIBRATION = {
+    'version': CALIBRATION_VERSION,
+    'revision': 0,
+    'created': None,
+    'pixel_to_robot': [[-0.0010677615453140213, 3.094561948991097e-05, -0.17959680557618776],
+                       [2.482562688915765e-05, 0.0010493343791252749, -0.2507558317896495]],
+    'camera_extrinsic': None,
+    'residuals': None,
+}
+
+
+#calibration_file from the configuration, relative paths are relative to this folder
+def default_calibration_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), calibration_file)
+
+
+def load_calibration(path):
+    calibration = dict(DEFAULT_CALIBRATION)
+    if path is None or not os.path.exists(path):
+        logging.info(f"no calibration file {path}, using the default calibration")
+        return calibration
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"could not read calibration file {path}: {e}, using the default calibration")
+        return calibration
+    if data.get('version', 0) > CALIBRATION_VERSION:
+        logging.error(f"calibration file {path} has version {data.get('version')}, only {CALIBRATION_VERSION} is supported. using the default calibration")
+        return calibration
+    calibration.update({key: data[key] for key in DEFAULT_CALIBRATION if key in data})
+    calibration['version'] = CALIBRATION_VERSION
+    logging.info(f"loaded calibration revision {calibration['revision']} from {calibration['created']}")
+    return calibration
+
+
+#write the calibration with the next revision number. the previous file is kept as name.rev<n>.json
+def save_calibration(path, calibration):
+    revision = 0
+    if os.path.exists(path):
+        previous = load_calibration(path)
+        revision = previous['revision']
+        root, extension = os.path.splitext(path)
+        os.replace(path, f"{root}.rev{revision}{extension}")
+    calibration = dict(calibration, version=CALIBRATION_VERSION, revision=revision + 1,
+                       created=time.strftime("%Y-%m-%d %H:%M:%S"))
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(temporary, path)
+    logging.info(f"saved calibration revision {calibration['revision']} to {path}")
+    return calibration
+
+
+#least squares fit of robot x, y against pixels, (N, 2) and (N, 2) -> (2, 3) fit and the residual per sample in meters
+def fit_pixel_to_robot(pixels, robot_xy):
+    pixels = np.asarray(pixels, dtype=float)
+    robot_xy = np.asarray(robot_xy, dtype=float)
+    A = np.column_stack([pixels, np.ones(len(pixels))])
+    solution = np.linalg.lstsq(A, robot_xy, rcond=None)[0]         #(3, 2)
+    residuals = np.linalg.norm(A @ solution - robot_xy, axis=1)
+    return solution.T, residuals
+
+
+#rigid transform (kabsch) with target = R @ source + t, (N, 3) and (N, 3) -> 4x4 matrix and the residual per sample
+def fit_rigid(source, target):
+    source = np.asarray(source, dtype=float)
+    target = np.asarray(target, dtype=float)
+    source_center = source.mean(axis=0)
+    target_center = target.mean(axis=0)
+    H = (source - source_center).T @ (target - target_center)
+    U, S, Vt = np.linalg.svd(H)
+    d = np.sign(np.linalg.det(Vt.T @ U.T))         #no reflections
+    R = Vt.T @ np.diag([1.0, 1.0, d]) @ U.T
+    T = np.eye(4)
+    T[:3, :3] = R
+    T[:3, 3] = target_center - R @ source_center
+    residuals = np.linalg.norm(source @ R.T + T[:3, 3] - target, axis=1)
+    return T, residuals
+
+
+#camera pose in the tcp frame from target points seen by the camera and the tcp poses they were seen from.
+#the target is fixed, so in the tcp frame of every pose it is at inv(tcp_pose) * target
+def fit_camera_extrinsic(camera_points, tcp_poses, target):
+    tcp_inverse = np.linalg.inv(pose_to_matrix(tcp_poses))                     #(N, 4, 4)
+    target_in_tcp = tcp_inverse[:, :3, :3] @ np.asarray(target, dtype=float) + tcp_inverse[:, :3, 3]
+    T, residuals = fit_rigid(camera_points, target_in_tcp)
+    return matrix_to_pose(T), residuals
+
+
+#center (xp, yp) of the dark disc in a BGR frame and its radius in pixels, or None if there is no single dark blob
+def find_target(color, threshold=60, min_area=30):
+    dark = color.min(axis=2) < threshold
+    ys, xs = np.nonzero(dark)
+    if len(xs) < min_area:
+        return None
+    xp, yp = xs.mean(), ys.mean()
+    radius = math.sqrt(len(xs) / math.pi)
+    #all dark pixels of one filled disc are within its radius, anything else dark in view spoils the center
+    if np.max((xs - xp) ** 2 + (ys - yp) ** 2) > (1.5 * radius) ** 2:
+        return None
+    return xp, yp, radius
+
+
+#median depth in meters inside the middle of the disc, nan without depth
+def target_depth(depth, depth_scale, xp, yp, radius):
+    r = max(int(radius / 2), 1)
+    x, y = int(round(xp)), int(round(yp))
+    patch = depth[max(y - r, 0):y + r + 1, max(x - r, 0):x + r + 1]
+    patch = patch[patch > 0]
+    if not len(patch):
+        return math.nan
+    return float(np.median(patch)) * depth_scale
+
+
+#poses around the center pose: a columns x rows grid in the base x/y plane at every height, same rotation. (N, 6)
+def calibration_grid(center, spacing=0.08, columns=4, rows=3, heights=(0.0, 0.05)):
+    dx = (np.arange(columns) - (columns - 1) / 2) * spacing
+    dy = (np.arange(rows) - (rows - 1) / 2) * spacing
+    dz = np.asarray(heights, dtype=float)
+    offsets = np.stack(np.meshgrid(dx, dy, dz, indexing='ij'), axis=-1).reshape(-1, 3)
+    grid = np.tile(np.asarray(center, dtype=float), (len(offsets), 1))
+    grid[:, :3] += offsets
+    return grid
+
+
+class Calibrator:
+    def __init__(self, robot, grabber, target, settle_time=0.3, center=capture_pose, tcp=capture_tcp):
+        self.robot = robot
+        self.grabber = grabber
+        self.target = np.asarray(target, dtype=float)     #robot x, y, z of the target center
+        self.settle_time = settle_time                      #wait after a move so the camera is not shaking
+        self.center = np.asarray(center, dtype=float)
+        self.tcp = tcp
+
+
+    #move to a pose and find the target in the first frame taken there. (xp, yp, depth) or None
+    def measure(self, pose):
+        self.robot.move_l(list(pose), 0.3, 0.3)
+        time.sleep(self.settle_time)
+        captured = self.grabber.wait_for_frame(self.grabber.latest_seq(), timeout=2.0)
+        if captured is None:
+            logging.error("calibration: no frame from camera")
+            return None
+        found = find_target(captured.color)
+        if found is None:
+            logging.error(f"calibration: target not found at {np.round(pose[:3], 4).tolist()}")
+            return None
+        xp, yp, radius = found
+        depth = target_depth(captured.depth, captured.depth_scale, xp, yp, radius) if captured.depth is not None else math.nan
+        return xp, yp, depth
+
+
+    def run(self, grid=None):
+        if grid is None:
+            grid = calibration_grid(self.center)
+        self.robot.set_tcp(self.tcp)
+        poses, samples = [], []
+        for k, pose in enumerate(grid):
+            sample = self.measure(pose)
+            logging.info(f"calibration: pose {k + 1}/{len(grid)} target {sample}")
+            if sample is not None:
+                poses.append(pose)
+                samples.append(sample)
+        self.robot.move_l(self.center.tolist(), 0.3, 0.3)
+        return self.solve(np.array(poses).reshape(-1, 6), np.array(samples).reshape(-1, 3))
+
+
+    #fits both calibrations from the measured samples (xp, yp, depth) per pose
+    def solve(self, poses, samples):
+        calibration = {}
+        residuals = {}
+
+        #belt fit from the poses at the capture height
+        flat = np.abs(poses[:, 2] - self.center[2]) < 1e-6
+        if np.count_nonzero(flat) < 3:
+            raise RuntimeError(f"calibration: only {np.count_nonzero(flat)} samples at the capture height, need 3")
+        robot_xy = self.target[:2] - (poses[flat, :2] - self.center[:2])
+        fit, errors = fit_pixel_to_robot(samples[flat, :2], robot_xy)
+        calibration['pixel_to_robot'] = fit.tolist()
+        residuals['pixel_to_robot'] = {'rms_mm': float(np.sqrt(np.mean(errors ** 2)) * 1000), 'max_mm': float(np.max(errors) * 1000),
+                                       'samples': int(np.count_nonzero(flat))}
+
+        #hand-eye from all poses with depth
+        with_depth = ~np.isnan(samples[:, 2])
+        intrinsics = self.grabber.intrinsics
+        calibration['camera_extrinsic'] = None
+        if np.count_nonzero(with_depth) >= 3 and intrinsics is not None:
+            xp, yp, z = samples[with_depth].T
+            camera_points = np.stack([(xp - intrinsics.ppx) / intrinsics.fx * z, (yp - intrinsics.ppy) / intrinsics.fy * z, z], axis=-1)
+            extrinsic, errors = fit_camera_extrinsic(camera_points, poses[with_depth], self.target)
+            calibration['camera_extrinsic'] = extrinsic.tolist()
+            residuals['camera_extrinsic'] = {'rms_mm': float(np.sqrt(np.mean(errors ** 2)) * 1000), 'max_mm': float(np.max(errors) * 1000),
+                                             'samples': int(np.count_nonzero(with_depth))}
+        else:
+            logging.error("calibration: not enough samples with depth, camera extrinsic not fitted")
+
+        calibration['residuals'] = residuals
+        for name, result in residuals.items():
+            logging.info(f"calibration {name}: rms {result['rms_mm']:.2f} mm, max {result['max_mm']:.2f} mm, {result['samples']} samples")
+        return calibration
+
+
+##########################
+#frame source for testing the calibration without a cell. renders the target as a black disc on a white belt,
+#seen by a pinhole camera at camera_extrinsic on the simulated robot (fake_rtde). depth is the distance to the belt plane
+##########################
+class SimulatedTargetSource:
+    def __init__(self, robot_state, target, camera_extrinsic, target_radius=0.012, width=640, height=480, fps=30):
+        self.robot_state = robot_state
+        self.target = np.asarray(target, dtype=float)
+        self.camera_extrinsic = pose_to_matrix(camera_extrinsic)
+        self.target_radius = target_radius
+        self.fps = fps
+        self.depth_scale = 0.001
+        self.intrinsics = types.SimpleNamespace(width=width, height=height, fx=615.0, fy=615.0,
+                                                ppx=width / 2, ppy=height / 2, coeffs=[0.0] * 5)
+        self.frame_number = 0
+        self.tcp_matrix = pose_to_matrix(capture_tcp)     #the camera is mounted relative to the capture tcp
+
+        columns, rows = np.meshgrid(np.arange(width), np.arange(height))
+        self.rays = np.stack([(columns - self.intrinsics.ppx) / self.intrinsics.fx,
+                              (rows - self.intrinsics.ppy) / self.intrinsics.fy, np.ones((height, width))], axis=-1)
+
+    def read(self):
+        time.sleep(1 / self.fps)
+        self.frame_number += 1
+        with self.robot_state.lock:
+            camera = self.robot_state.flange @ self.tcp_matrix @ self.camera_extrinsic
+
+        #depth: every pixel ray hits the belt plane at the height of the target
+        directions = self.rays @ camera[:3, :3].T
+        z = (self.target[2] - camera[2, 3]) / directions[..., 2]
+        depth = np.clip(z / self.depth_scale, 0, 65535).astype(np.uint16)
+
+        #color: pixels where the belt point is within the target radius are black
+        hits = camera[:3, 3] + directions * z[..., None]
+        inside = np.sum((hits[..., :2] - self.target[:2]) ** 2, axis=-1) < self.target_radius ** 2
+        color = np.full(self.rays.shape, 255, dtype=np.uint8)
+        color[inside] = 0
+        return color, depth, self.frame_number
+
+    def reconnect(self):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="camera calibration with a target on the belt")
+    parser.add_argument("--robot-ip", default="192.168.0.10")
+    parser.add_argument("--target", type=float, nargs=3, help="robot x y z of the target center")
+    parser.add_argument("--touch", action="store_true", help="jog the pickup tcp to the target center, its position is the target")
+    parser.add_argument("--spacing", type=float, default=0.08, help="grid spacing in meters")
+    parser.add_argument("--columns", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=3)
+    parser.add_argument("--output", default=default_calibration_path())
+    args = parser.parse_args()
+
+    from UR5E_control import URControl
+    from camera_position import CameraPosition
+    from frame_grabber import FrameGrabber, RealSenseSource
+
+    robot = URControl(args.robot_ip)
+    robot.connect()
+    if args.touch:
+        robot.set_tcp(pickup_tcp)
+        input("jog the pickup tcp to the center of the target and press enter")
+        target = robot.get_tcp_pos()[:3]
+    elif args.target is not None:
+        target = args.target
+    else:
+        parser.error("give --target or --touch")
+    logging.info(f"calibration target at {target}")
+
+    #only the camera connection is needed, no model
+    camera = CameraPosition.__new__(CameraPosition)
+    camera.connect_camera()
+    grabber = FrameGrabber(RealSenseSource(camera))
+    grabber.start()
+
+    calibrator = Calibrator(robot, grabber, target)
+    calibration = calibrator.run(calibration_grid(capture_pose, args.spacing, args.columns, args.rows))
+    save_calibration(args.output, calibration)
+
+    grabber.stop()
+    camera.pipeline.stop()
+    robot.stop_robot_control()
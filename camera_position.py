@@ -3,11 +3,17 @@ import pyrealsense2 as rs
 import os
 import logging
 import math
-import torch
 import numpy as np
-from ultralytics import YOLO
 import threading
 import time
+from frame_grabber import FrameGrabber, FrameRing, RealSenseSource, ReplaySource
+from inference_engine import InferenceEngine
+from inference_process import ProcessInferenceEngine
+from model_backend import load_model
+from part_tracker import PartTracker
+from part_localizer import PartLocalizer
+from calibration import load_calibration, default_calibration_path
+from part_profiles import PART_PROFILES
 from configuration import*
 
 
@@ -20,6 +26,23 @@ class YoloLogFilter(logging.Filter):
 yolo_logger = logging.getLogger("yolo_logger")
 yolo_logger.addFilter(YoloLogFilter())
 
+# reach limits of the pick position in meters, parts outside are not picked
+REACH_X = (-0.750, -0.40)
+REACH_Y = (-0.152, 0.090)
+
+# x of the barrier at the end of the belt in mm, the row of parts ends there
+X_BARRIER_CLOSE_BOX = -818.8
+X_BARRIER_AWAY_BOX = -819.8
+
+# size of the camera color frames
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+# part counts on the belt that get the extra vision length for every part type, more in the part profiles
+EXTRA_SMALL_COUNTS = (14, 15)
+EXTRA_BIG_COUNTS = (9, 10)
+MAX_PART_COUNT = 64     # size of the part count lookup tables, larger counts only get the 'always' extra length
+
 # uses camera to run yolo model and get x, y, and z coordinates of the parts
 class CameraPosition:
     def __init__(self, robot, boxing_machine):
@@ -32,22 +55,67 @@ class CameraPosition:
         #self.config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
         #self.pipeline.start(self.config)
         #self.align = rs.align(rs.stream.color)
-        self.connect_camera()
+        #replay_path can point to a recorded directory (replay harness) or a .bag file (played through the realsense pipeline)
+        if replay_path is not None and os.path.isdir(replay_path):
+            self.pipeline = None
+            source = ReplaySource(replay_path)
+        else:
+            self.connect_camera()
+            source = RealSenseSource(self)
         self.labels = self.detector.labels
+        self.setup_label_tables()
 
-        self.last_frame = None                  #last frame storage so interface can show last frame
-        self.frame_lock = threading.Lock()      #threading lock so no reading/writing lastframe at the same time
-        self.display_thread_running = True      #display thread runs as long as this is true
-
+        # pixel to robot fit and camera pose from the calibration file
+        self.calibration = load_calibration(default_calibration_path())
+        self.pixel_to_robot = np.array(self.calibration['pixel_to_robot'])     # xd = a * xp + b * yp + c, yd = d * xp + e * yp + f
+        self.camera_extrinsic = camera_extrinsic if camera_extrinsic is not None else self.calibration['camera_extrinsic']
+        self.setup_belt_roi()
 
-        # Separate states for each row. makes sure parts are stationary when picking up
-        self.previous_coordinates_row1 = None
-        self.previous_coordinates_row2 = None
-        self.last_stable_time_row1 = 0
-        self.last_stable_time_row2 = 0
+        #capture thread that keeps the newest camera frames in a ring buffer
+        self.grabber = FrameGrabber(source)
+        self.grabber.start()
+        self.last_seq = 0                       #seq of the last frame used for detection
 
-        self.row_threshold = 6  # Stability threshold in pixels
-        self.row_gap_threshold = 50  # Distance to separate rows (adjust as necessary)
+        self.display_ring = FrameRing(slots=3)  #frames (with annotations) shown on the interface
+        self.display_thread_running = True      #display thread runs as long as this is true
+        self.box_scan_cache = {}                #box index -> (orientation, annotated frame), see initialize_position
+
+
+        # tracks every part on the belt across frames. makes sure parts are stationary when picking up
+        self.tracker = PartTracker(stable_updates=tracker_stable_updates, max_speed=tracker_max_speed,
+                                   max_gap=tracker_max_gap, max_drift=6)  # max_drift: stability threshold in pixels
+
+        # 3d localization with the depth frame, created with the first frame (needs the camera intrinsics)
+        self.localizer = None
+
+        # conveyor scheduler that gets the number of staged parts of every belt frame, set by the boxing machine
+        self.conveyor = None
+
+
+    # lookup tables indexed by class id, so detections can be filtered with vectorized masks
+    def setup_label_tables(self):
+        class_count = max(self.labels.keys()) + 1
+        self.label_names = np.array([self.labels.get(i, '') for i in range(class_count)])
+        self.bad_classes = np.array(['bad' in name.lower() for name in self.label_names])
+        profiles = [PART_PROFILES.get(name) for name in self.label_names]
+        self.pickable_classes = np.array([profile is not None for profile in profiles])
+        self.small_classes = np.array([profile is not None and not profile.big for profile in profiles])
+        self.big_classes = np.array([profile is not None and profile.big for profile in profiles])
+        self.part_widths = np.array([1.0 if profile is None else profile.pixel_width for profile in profiles])
+
+        # extra vision length per class and part count on the belt: table[class, count]
+        self.extra_small_table = np.zeros((class_count, MAX_PART_COUNT + 1), dtype=bool)
+        self.extra_big_table = np.zeros((class_count, MAX_PART_COUNT + 1), dtype=bool)
+        self.extra_small_table[:, EXTRA_SMALL_COUNTS] = True
+        self.extra_big_table[:, EXTRA_BIG_COUNTS] = True
+        for class_id, profile in enumerate(profiles):
+            if profile is None:
+                continue
+            for table, counts in ((self.extra_small_table, profile.extra_small_counts), (self.extra_big_table, profile.extra_big_counts)):
+                if counts is None:
+                    table[class_id] = True
+                else:
+                    table[class_id, list(counts)] = True
 
 
     def connect_camera(self):
@@ -59,8 +127,10 @@ class CameraPosition:
             try:
                 self.pipeline = rs.pipeline()
                 self.config = rs.config()
-                self.config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-                self.config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
+                if replay_path is not None:
+                    self.config.enable_device_from_file(replay_path, repeat_playback=True)
+                self.config.enable_stream(rs.stream.color, FRAME_WIDTH, FRAME_HEIGHT, rs.format.bgr8, 30)
+                self.config.enable_stream(rs.stream.depth, FRAME_WIDTH, FRAME_HEIGHT, rs.format.z16, 30)
                 self.pipeline.start(self.config)
                 self.align = rs.align(rs.stream.color)
                 logging.info(f"Connected to camera on attempt {attempt}")
@@ -77,29 +147,94 @@ class CameraPosition:
 
     # moves robot to capture position
     def capture_position(self, slow=False):
-        capture_tcp = [-47.5 / 1000, -140 / 1000, 135 / 1000, math.radians(0), math.radians(0), math.radians(0)]
         self.robot.set_tcp(capture_tcp)
 
-        target_position = [-0.6639046352765678, -0.08494527187802497, 0.529720350746548, 2.222, 2.248, 0.004]
+        target_position = capture_pose
         if slow:
             logging.info("check part type, move to camera position")
             self.robot.move_l(target_position, 0.3, 0.3)
         else:
             self.robot.move_l(target_position, speed_fast, acc_fast)
+        self.flush_frames()     #frames taken while moving are useless
 
     # transform camera coordinates to real world (robot) coordinates
     def transform_coordinates(self, xp, yp, zp):
-        a, b, c = -0.0010677615453140213, 3.094561948991097e-05, -0.17959680557618776
-        d, e, f = 2.482562688915765e-05, 0.0010493343791252749, -0.2507558317896495
+        (a, b, c), (d, e, f) = self.pixel_to_robot
 
         xd = a * xp + b * yp + c
         yd = d * xp + e * yp + f
 
         return xd, yd
+
+    # inverse of transform_coordinates: pixel coordinates of a real world (robot) position on the belt
+    def pixel_coordinates(self, xd, yd):
+        xp, yp = np.linalg.solve(self.pixel_to_robot[:, :2], [xd - self.pixel_to_robot[0, 2], yd - self.pixel_to_robot[1, 2]])
+        return float(xp), float(yp)
+
+    # robot coordinates (x, y, z) of the pixels xp, yp of every box from the depth frame, (N, 3).
+    # None if 3d localization is not configured, rows are nan where the depth is missing
+    def locate_parts(self, captured, boxes, xp, yp):
+        if self.camera_extrinsic is None:
+            return None
+        if self.localizer is None:
+            intrinsics = self.grabber.intrinsics
+            if intrinsics is None:
+                return None
+            self.localizer = PartLocalizer(intrinsics, capture_pose, self.camera_extrinsic)
+        return self.localizer.locate(captured, boxes, xp, yp)
+
+    # part of the frame that goes to yolo when looking for parts on the belt, (x1, y1, x2, y2) or None for the full frame.
+    # 'auto' takes every pixel where a pickable part can be: the reach limits and the row of parts up to the barrier,
+    # padded by half the longest part, so a part whose center is at a reach limit is still inside the crop.
+    # yolo runs at the smallest input size that fits the crop, so the parts keep the same size in pixels
+    def setup_belt_roi(self):
+        self.belt_roi = None
+        self.belt_imgsz = None
+        if belt_roi is None:
+            return
+        if belt_roi == 'auto':
+            corners = [self.pixel_coordinates(xd, yd)
+                       for xd in (REACH_X[0], REACH_X[1], X_BARRIER_CLOSE_BOX / 1000, X_BARRIER_AWAY_BOX / 1000)
+                       for yd in REACH_Y]
+            xs = [xp for xp, yp in corners]
+            ys = [yp for xp, yp in corners]
+            pixels_per_meter = np.linalg.norm(np.linalg.inv(self.pixel_to_robot[:, :2]), 2)     #largest scale of any direction
+            half_part = max(profile.pick_length for profile in PART_PROFILES.values()) / 2 * pixels_per_meter
+            margin = math.ceil(half_part) + belt_roi_margin
+            x1 = max(math.floor(min(xs)) - margin, 0)
+            y1 = max(math.floor(min(ys)) - margin, 0)
+            x2 = min(math.ceil(max(xs)) + margin, FRAME_WIDTH)
+            y2 = min(math.ceil(max(ys)) + margin, FRAME_HEIGHT)
+        else:
+            x1, y1, x2, y2 = belt_roi
+        self.belt_roi = (x1, y1, x2, y2)
+        self.belt_imgsz = math.ceil(max(x2 - x1, y2 - y1) / 32) * 32     #yolo input has to be a multiple of the stride
+        logging.info(f"belt detection region {self.belt_roi}, yolo input size {self.belt_imgsz}")
+        self.detector.engine.warmup(shape=(y2 - y1, x2 - x1, 3), imgsz=self.belt_imgsz)
+
+    # mask of the boxes that touch an edge of the belt crop that is not an edge of the frame. the part goes on
+    # outside the crop, so the box is cut off and its length and center are wrong
+    def clipped_by_roi(self, detections, tolerance=2):
+        if self.belt_roi is None:
+            return np.zeros(len(detections), dtype=bool)
+        x1, y1, x2, y2 = self.belt_roi
+        boxes = detections.boxes
+        clipped = np.zeros(len(detections), dtype=bool)
+        if x1 > 0:
+            clipped |= boxes[:, 0] <= x1 + tolerance
+        if y1 > 0:
+            clipped |= boxes[:, 1] <= y1 + tolerance
+        if x2 < FRAME_WIDTH:
+            clipped |= boxes[:, 2] >= x2 - tolerance
+        if y2 < FRAME_HEIGHT:
+            clipped |= boxes[:, 3] >= y2 - tolerance
+        return clipped
     
 
 
-    #function that detects box orientation
+    #function that detects box orientation. the arm already moves to the next box while yolo still runs on the
+    #frames of the previous box. a box orientation is known when box_scan_agree detections agree, it is cached until
+    #invalidate_box_orientations is called (boxes were replaced)
     def initialize_position(self):
         # Define the specific positions to check
         positions = [
@@ -107,113 +242,113 @@ class CameraPosition:
             [0.0457, 0.415, 0.333, -2.195, -2.221, -0.004],  # Position 2
         ]
 
-        orientations = {}
-        not_found = [True, True]
-        frame_0 = None
-        frame_1 = None
-
-        for i, position in enumerate(positions):
-            self.robot.move_l(position, 0.5, 3)
-            time.sleep(0.3)
-
-            while not_found[i]:
-                try:
-                    frames = self.pipeline.wait_for_frames()
-                    aligned_frames = self.align.process(frames)
-                    color_frame = aligned_frames.get_color_frame()
-                    depth_frame = aligned_frames.get_depth_frame()
-                except Exception as e:
-                    logging.error(f"error with camera: {e}")
-                    self.connect_camera()
-                    continue #go back to start
-
-                if not color_frame or not depth_frame:
-                    continue
-
-                frame = np.asanyarray(color_frame.get_data())
-                results = self.detector.detect_objects(frame.copy())
-
-                if results is not None:
-                    highest_confidence = 0
-                    best_bbox = None
-                    best_label = None
-
-                    for result in results:
-                        for box in result.boxes:
-                            bbox = box.xyxy[0].cpu().numpy()
-                            bbox = [int(coord) for coord in bbox[:4]]
-                            label = self.labels[int(box.cls[0])]
-                            confidence = box.conf.item()
-                            logging.info(f"Detected object: {label} with confidence {confidence} at position {i+1}")
-
-                            # Only consider the detection with the highest confidence
-                            if confidence > 0.3 and confidence > highest_confidence:
-                                highest_confidence = confidence
-                                best_bbox = bbox
-                                best_label = label
-
-                    if best_bbox and best_label:
-                        # Assign orientation based on label
-                        found = False
-                        if 'horizontal' in best_label.lower():
-                            orientations[f'box_{i}'] = 'horizontal'
-                            color = (0, 255, 0)
-                            found = True
-                        elif 'vertical' in best_label.lower():
-                            orientations[f'box_{i}'] = 'vertical'
-                            color = (255, 0, 0)
-                            found = True
-                        
-                        else:
-                            self.capture_position(slow=True)
-                            self.boxing_machine.interface.stop_button_pressed()
-                            not_found[0] = False
-                            not_found[1] = False
-                            logging.error("still parts in box!!!!!!!!!!!!")
-                            return 0
-                            
-
-                        if found:
-                            # Annotate the frame with the best detection
-                            cv2.rectangle(frame, (best_bbox[0], best_bbox[1]), (best_bbox[2], best_bbox[3]), color, 2)
-                            annotation = f"Box {i + 1}: {best_label} ({highest_confidence:.2f})"
-                            text_x = best_bbox[0]
-                            text_y = max(best_bbox[1] - 10, 20)  # Ensure text is always visible
-                            cv2.putText(frame, annotation, (text_x, text_y),
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-
-                            # Assign the annotated frame to the correct box
-                            if i == 0:
-                                frame_0 = frame
-                            elif i == 1:
-                                frame_1 = frame
-
-                            not_found[i] = False
+        #take the frames of every box that is not cached, inference runs in the background
+        todo = [i for i in range(len(positions)) if i not in self.box_scan_cache]
+        samples = {}
+        at_box = None
+        for i in todo:
+            self.move_to_box(positions[i])
+            at_box = i
+            samples[i] = self.sample_box(box_scan_agree)
+
+        for i in todo:
+            result = self.agreed_orientation(samples[i])
+            while result is None:
+                #frames did not agree (yet), take more frames at this box
+                if at_box != i:
+                    self.move_to_box(positions[i])
+                    at_box = i
+                samples[i] += self.sample_box(1)
+                result = self.agreed_orientation(samples[i])
+
+            orientation, frame, best_bbox, best_label, highest_confidence = result
+            if orientation is None:
+                self.capture_position(slow=True)
+                self.boxing_machine.stop_for_operator("stopped: replace boxes before starting")
+                logging.error("still parts in box!!!!!!!!!!!!")
+                return 0
+
+            # Annotate the frame with the best detection
+            color = (0, 255, 0) if orientation == 'horizontal' else (255, 0, 0)
+            cv2.rectangle(frame, (best_bbox[0], best_bbox[1]), (best_bbox[2], best_bbox[3]), color, 2)
+            annotation = f"Box {i + 1}: {best_label} ({highest_confidence:.2f})"
+            text_x = best_bbox[0]
+            text_y = max(best_bbox[1] - 10, 20)  # Ensure text is always visible
+            cv2.putText(frame, annotation, (text_x, text_y),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+            self.box_scan_cache[i] = (orientation, frame)
+
+        orientations = {f'box_{i}': self.box_scan_cache[i][0] for i in range(len(positions))}
+        frame_0 = self.box_scan_cache[0][1]
+        frame_1 = self.box_scan_cache[1][1]
 
         # Ensure both frames have the same height for horizontal concatenation
-        h_min = min(frame_0.shape[0], frame_1.shape[0])
-        frame_0_resized = cv2.resize(frame_0, (int(frame_0.shape[1] * h_min / frame_0.shape[0]), h_min))
-        frame_1_resized = cv2.resize(frame_1, (int(frame_1.shape[1] * h_min / frame_1.shape[0]), h_min))
+        if frame_0.shape[0] != frame_1.shape[0]:
+            h_min = min(frame_0.shape[0], frame_1.shape[0])
+            frame_0 = cv2.resize(frame_0, (int(frame_0.shape[1] * h_min / frame_0.shape[0]), h_min))
+            frame_1 = cv2.resize(frame_1, (int(frame_1.shape[1] * h_min / frame_1.shape[0]), h_min))
 
         # Concatenate the frames horizontally
-        combined_frame = cv2.hconcat([frame_1_resized, frame_0_resized])
+        combined_frame = np.hstack([frame_1, frame_0])
 
-        with self.frame_lock:
-            self.last_frame = combined_frame
+        self.show_frame(combined_frame)
 
         logging.info(f"Orientation detection complete: {orientations}")
         return orientations
 
+    # move the camera above a box and skip the frames taken while moving
+    def move_to_box(self, position):
+        self.robot.move_l(position, 0.5, 3)
+        time.sleep(0.3)
+        self.flush_frames()     #only use frames taken at this position
+
+    # takes count new frames and queues them for inference. returns a list of (frame, future)
+    def sample_box(self, count):
+        samples = []
+        while len(samples) < count:
+            captured = self.next_frame()
+            if captured is not None:
+                samples.append((captured.color, self.detector.detect_objects_async(captured.color)))
+        return samples
+
+    # orientation of a box from the detections of its frames, in order. waits for the inference results.
+    # returns (orientation, frame, bbox, label, confidence) of the first box_scan_agree frames that agree,
+    # orientation is None if they agree on a label that is not an orientation (parts in the box). None if they do not agree yet
+    def agreed_orientation(self, samples):
+        votes = {}
+        for frame, future in samples:
+            detections = future.result()
+            # Only consider the detection with the highest confidence
+            confident = detections.filter(detections.confidences > 0.3)
+            if not len(confident):
+                continue
+            best = int(np.argmax(confident.confidences))
+            label = self.labels[int(confident.classes[best])]
+            if 'horizontal' in label.lower():
+                orientation = 'horizontal'
+            elif 'vertical' in label.lower():
+                orientation = 'vertical'
+            else:
+                orientation = None
+            logging.info(f"Detected objects: {list(self.label_names[detections.classes])} with confidences {detections.confidences}")
+            votes.setdefault(orientation, []).append((frame, confident.boxes[best].tolist(), label, float(confident.confidences[best])))
+            if len(votes[orientation]) >= box_scan_agree:
+                return (orientation,) + votes[orientation][0]
+        return None
+
+    # forget the box orientations, call when the boxes were replaced
+    def invalidate_box_orientations(self):
+        self.box_scan_cache = {}
+
 
 
     # main function that detects objects and returns the object locations
     def detect_pickable_parts(self, min_length=170, slow=False):
         self.capture_position(slow)
         time.sleep(1)
-        not_found = True
         logging.info("start capturing frames")
 
-        while not_found:
+        while True:
             #logging.info("not found yet")
             
             self.boxing_machine.wait_if_paused()
@@ -221,264 +356,261 @@ class CameraPosition:
             #logging.info("check if stopped")
             if self.boxing_machine.stop_main_loop:
                 logging.info("camera position: stop main loop")
-                return (0,0,0)
-            
-            try:
-                frames = self.pipeline.wait_for_frames()
-                aligned_frames = self.align.process(frames)
-                color_frame = aligned_frames.get_color_frame()
-                depth_frame = aligned_frames.get_depth_frame()
-            except Exception as e:
-                logging.error(f"error with camera: {e}")
-                self.connect_camera()
-                continue #go back to start
-
+                return (0,0,0,None)
+
+            pick = self.find_pickable_part(min_length)
+            if pick is not None:
+                return pick
+
+
+    # returns the newest frame from the grabber that was not used before. only waits if there is no new frame yet
+    def next_frame(self, timeout=1.0):
+        captured = self.grabber.wait_for_frame(self.last_seq, timeout)
+        if captured is None:
+            logging.error("no new frame from camera")
+            return None
+        self.last_seq = captured.seq
+        return captured
+
+    # skip all frames that are already in the grabber, e.g. frames taken while the robot was moving
+    def flush_frames(self):
+        self.last_seq = self.grabber.latest_seq()
+
+    # show frame on the interface
+    def show_frame(self, frame):
+        self.display_ring.publish(frame)
+
+    # newest frame for the interface, or None. with copy=False the image is a view into the ring,
+    # check display_frame_valid after using it
+    def get_display_frame(self, copy=True):
+        return self.display_ring.latest(copy)
+
+    # seq of the newest frame for the interface, 0 if nothing was shown yet
+    def display_frame_seq(self):
+        return self.display_ring.seq
+
+    # false if a frame from get_display_frame(copy=False) got overwritten while it was used
+    def display_frame_valid(self, frame):
+        return self.display_ring.still_valid(frame)
+
+
+    # checks one camera frame for a stable pickable part. returns (x, y, label, z) or None if no part can be picked from this frame.
+    # z is the measured top of the parts in robot coordinates, None without 3d localization
+    # used by detect_pickable_parts and by the background vision stage of the pick pipeline
+    def find_pickable_part(self, min_length=170):
+        captured = self.next_frame()
+        if captured is None:
+            return None
+
+        frame = captured.color
+        self.show_frame(frame)
+        #only the belt region goes to yolo, the boxes come back in full frame pixels
+        detections = self.detector.detect_objects(frame, roi=self.belt_roi, imgsz=self.belt_imgsz)
+        detections = detections.filter(~self.clipped_by_roi(detections))      #do not trust boxes cut off by the crop
+        track_ids = self.tracker.update(detections, captured.seq, captured.timestamp)     #also with no detections, so old tracks age
+        self.report_staging(detections, min_length)
+        if not len(detections):
+            return None
+
+        #check for bad parts
+        bad_mask = self.bad_classes[detections.classes] & (detections.confidences > 0.6)
+        bad = detections.filter(bad_mask)
+        bad_tracks = track_ids[bad_mask]
+        for k in range(len(bad)):
+            bbox = bad.boxes[k]
+            #only once per bad part, the machine stays paused until the operator fixed it
+            if self.tracker.is_stationary(bad_tracks[k]) and not self.boxing_machine.is_paused():
+                label = self.labels[int(bad.classes[k])]
+                # Draw a thick red bounding box for 'bad' objects
+                cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 0, 255), 4)  # Red color, thickness 4
+                text = f'{label} ({bad.confidences[k]:.2f})'
+                cv2.putText(frame, text, (bbox[0], bbox[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+                self.show_frame(frame)
+
+                self.boxing_machine.pause_for_operator("bad placement on conveyor: please fix and resume")
+
+                logging.info("Bad position detected!")
+                self.robot.pulse_digital_output(2, 5)  # Output 2 on for 5 seconds (gate goes up), does not wait
+
+        #check for pickable parts
+        pickable_mask = self.staged_parts(detections) & (detections.length >= self.required_length(detections, min_length))
+        pickable = detections.filter(pickable_mask)
+        pickable_tracks = track_ids[pickable_mask]
+        if not len(pickable):
+            return None
+
+        points = self.locate_parts(captured, pickable.boxes, pickable.x_left, pickable.y_middle)
+        geometry = self.pick_geometry(pickable, points)
+
+        for k in range(len(pickable)):
+            bbox = pickable.boxes[k]
+            x_left = int(pickable.x_left[k])
+            y_middle = int(pickable.y_middle[k])
+            label = self.labels[int(pickable.classes[k])]
+            #logging.info("part found, checking if stable")
+            if self.tracker.is_stationary(pickable_tracks[k]):
+                #logging.info("stable")
+                logging.info(f"tot parts not rounded: {geometry['tot_parts_raw'][k]}")
+                if geometry['edge_case'][k]:
+                    logging.error(f"edge case retake picture: {geometry['tot_parts_raw'][k] % 1}")
+                    continue
 
-            #we only want colorframe, if no colorframe, go to start
-            if not color_frame or not depth_frame:
+                tot_parts = int(geometry['tot_parts'][k])
+                logging.info(f"vision length: {geometry['vision_length'][k]}  new length: {geometry['new_length'][k]}  tot parts: {tot_parts}")
+                self.boxing_machine.interface.update_status(f"parts on belt: {tot_parts}")
+
+                xd = float(geometry['xd'][k])
+                yd = float(geometry['yd'][k])
+                zd = None if np.isnan(geometry['zd'][k]) else float(geometry['zd'][k])
+                #check if detected object is within reach, after that draw frame and return coordinates
+                if geometry['in_reach'][k]: #maximium x value for safety purposes
+                    depth = captured.get_distance(x_left, y_middle)
+                    # Draw box and label on the frame
+                    cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (255, 0, 0), 2)
+                    cv2.circle(frame, (x_left, y_middle), 5, (0, 0, 255), -1)
+                    text = f'X: {x_left}, Y: {y_middle}, Z: {depth:.2f}m'
+                    cv2.putText(frame, text, (x_left, y_middle - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+                    text = f'{label} ({pickable.confidences[k]:.2f})'
+                    cv2.putText(frame, text, (bbox[0], bbox[1] - 40), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+                    self.show_frame(frame)
+
+                    return (xd, yd, label, zd)
+                else:
+                    logging.error("part out of reach")
+                    self.boxing_machine.interface.update_status("parts are out of reach")
+                    continue
+            else:
+                logging.info("not stable")
+                self.boxing_machine.interface.update_status("parts are still moving/not stable")
                 continue
 
-            frame = np.asanyarray(color_frame.get_data())
-            with self.frame_lock:  # Update last_frame safely
-                self.last_frame = frame
-            results = self.detector.detect_objects(frame.copy())
-
-        
-            if results is not None:
-                for result in results:
-                    for box in result.boxes:
-                        bbox = box.xyxy[0].cpu().numpy()
-                        bbox = [int(coord) for coord in bbox[:4]]
-                        x_left = bbox[0]
-                        y_middle = int((bbox[1] + bbox[3]) / 2)
-                        width = bbox[2] - bbox[0]
-                        height = bbox[3] - bbox[1]
-                        depth = depth_frame.get_distance(x_left, y_middle)
-                        label = self.labels[int(box.cls[0])]
-                        length = max(width, height)
-                        
-                        #logging.info(f"labels: {label}  conf: {box.conf}")
-                        #check for bad parts 
-                        if 'bad' in label.lower() and box.conf > 0.6:
-                            current_coordinates = (x_left, y_middle)
-                            bbox = box.xyxy[0].cpu().numpy()
-                            bbox = [int(coord) for coord in bbox[:4]]
-                            if self.is_stable(current_coordinates):
-                                # Draw a thick red bounding box for 'bad' objects
-                                cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 0, 255), 4)  # Red color, thickness 4
-                                text = f'{label} ({box.conf.item():.2f})'
-                                cv2.putText(frame, text, (bbox[0], bbox[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-                                with self.frame_lock:
-                                    self.last_frame = frame
-
-                                self.boxing_machine.pause()
-                                self.boxing_machine.interface.start_button_pressed()
-                                self.boxing_machine.interface.update_status("bad placement on conveyor: please fix and resume")
-
-                                logging.info("Bad position detected!")
-                                self.robot.set_digital_output(2, True)  # Turn output 2 to True (gate goes up)
-                                time.sleep(5)  # Wait for 5 seconds
-                                self.robot.set_digital_output(2, False)  # Turn output 2 to False (gate goes down)
-                                continue    #go to start of while loop, wait for new parts
-
-
-                        #check for pickable parts
-                        min_length = 170
-                        if label == 'Green' or label == 'Rubber' or label == 'Small-Blue': min_length += 20
-                        #small parts need more parts on belt, otherwise they bukkle up
-
-                        
-                        if box.conf > 0.8 and label in ['Big-Blue', 'Green', 'Holed', 'Rubber', 'Small-Blue'] and length >= min_length and width * height < 75000:
-                            current_coordinates = (x_left, y_middle)
-                            #logging.info("part found, checking if stable")
-                            if self.is_stable(current_coordinates):
-                                #logging.info("stable")
-                                xd, yd = self.transform_coordinates(x_left, y_middle, depth)
-
-                                #new calculation type. for now, only small blue and green.
-                                if label == 'Small-Blue' or label == 'Green' or label == 'Rubber':
-                                    part_width = 14.25    #was 14.25
-                                elif label == 'Big-Blue':
-                                    part_width = 24.4
-                                elif label == 'Holed':
-                                    part_width = 23.75
-
-                                x_barrier_close_box = -818.8
-                                x_barrier_away_box = -819.8
-
-
-                                offset = 0
-                                #vision_length = length - offset
-                                if yd > 0:  #close box
-                                    vision_length = abs(x_barrier_close_box) - abs(xd*1000)
-                                else:   #away box
-                                    vision_length = abs(x_barrier_away_box) - abs(xd*1000) 
-
-
-
-                                #if yd > 0: vision_length += 3
-                                tot_parts = vision_length/part_width
-                                if round(tot_parts) == 14 or round(tot_parts) == 15 or round(tot_parts) == 16 and label == 'Green' or label == 'Small-Blue' or label == 'Rubber':
-                                    if yd > 0: #close to box
-                                        vision_length += 5
-                                    else: vision_length += 9
-
-                                if round(tot_parts) == 9 or round(tot_parts) == 10 or round(tot_parts) == 11 and label == 'Holed' or label == 'Big-Blue':
-                                    vision_length += 5
-
-                                tot_parts = vision_length/part_width
-                                logging.info(f"tot parts not rounded: {tot_parts}")
-                                if 0.40 < (tot_parts % 1) < 0.60:
-                                    logging.error(f"edge case retake picture: {tot_parts % 1}")
-                                    continue
-
-                                
-
-                                tot_parts = round(vision_length/part_width)
-                                new_length = tot_parts * part_width + offset
-                                logging.info(f"vision length: {vision_length}  new length: {new_length}  tot parts: {tot_parts}")
-                                
-                                self.boxing_machine.interface.update_status(f"parts on belt: {tot_parts}")
-
-                                if label == 'Big-Blue' or label == 'Holed':
-                                    offset_close = -1.5
-                                    offset_away = -1.5
-                                elif label == 'Green' or label == 'Small-Blue' or label == 'Rubber':
-                                    offset_close = 2.5
-                                    offset_away =  0
-
-
-                                if yd > 0:  #close box
-                                    xd = x_barrier_close_box + new_length + offset_close
-                                else:       #away box
-                                    xd = x_barrier_away_box + new_length + offset_away
-
-
-                                xd += part_width
-
-                                xd /=1000
-
-
-                                if label == 'Big-Blue' or label == 'Holed': min_parts = 7
-                                else: min_parts = 14
-                                #check if detected object is within reach, after that draw frame and return coordinates
-                                if xd > -0.750 and  xd < -0.40 and yd > -0.152 and yd < 0.090 and tot_parts >= min_parts: #maximium x value for safety purposes
-                                    # Draw box and label on the frame
-                                    cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (255, 0, 0), 2)
-                                    cv2.circle(frame, (x_left, y_middle), 5, (0, 0, 255), -1)
-                                    text = f'X: {x_left}, Y: {y_middle}, Z: {depth:.2f}m'
-                                    cv2.putText(frame, text, (x_left, y_middle - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-                                    text = f'{label} ({box.conf.item():.2f})'
-                                    cv2.putText(frame, text, (bbox[0], bbox[1] - 40), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-
-                                    not_found = False       #parts found, so not_found = false. this will stop the while looop
-
-                                    with self.frame_lock:  # Update last_frame safely
-                                        self.last_frame = frame
-
-                                    return (xd, yd, label)
-                                else:
-                                    logging.error("part out of reach")
-                                    self.boxing_machine.interface.update_status("parts are out of reach")
-                                    continue
-                            else:
-                                logging.info("not stable")
-                                self.boxing_machine.interface.update_status("parts are still moving/not stable")
-                                continue
-
-        return (0, 0, 0)
-
-
-    #checks if parts are stationary. only pick up parts if they are stationary
-    def is_stable(self, current_coordinates):
-        """Check stability separately for two rows."""
-        x, y = current_coordinates
-
-        # Determine which row the point belongs to
-        if self.previous_coordinates_row1 is None or abs(y - self.previous_coordinates_row1[1]) < self.row_gap_threshold:
-            row = "row1"
-            prev_coords = self.previous_coordinates_row1
-            last_time = self.last_stable_time_row1
-        else:
-            row = "row2"
-            prev_coords = self.previous_coordinates_row2
-            last_time = self.last_stable_time_row2
-
-        # Stability check for the chosen row
-        if prev_coords is None:
-            self.update_row_state(row, current_coordinates)
-            return False
-
-        distance = np.linalg.norm(np.array(current_coordinates) - np.array(prev_coords))
-        if distance > self.row_threshold:
-            self.update_row_state(row, current_coordinates)
-            return False
-
-        # Ensure it has been stable for 0.3 seconds
-        if time.time() - last_time >= 0.3:
-            return True
-
-        return False
-
-    def update_row_state(self, row, coordinates):
-        """Update the state for a specific row."""
-        if row == "row1":
-            self.previous_coordinates_row1 = coordinates
-            self.last_stable_time_row1 = time.time()
-        else:
-            self.previous_coordinates_row2 = coordinates
-            self.last_stable_time_row2 = time.time()
+        return None
+
+
+    # detections that are rows of parts on the belt
+    def staged_parts(self, detections):
+        return ((detections.confidences > 0.8)
+                & self.pickable_classes[detections.classes]
+                & (detections.area < 75000))
+
+    # pixel length a row needs before it can be picked. small parts need more parts on belt, otherwise they bukkle up
+    def required_length(self, detections, min_length=170):
+        return np.where(self.small_classes[detections.classes], min_length + 20, min_length)
+
+    # tells the conveyor if the belt frame has enough parts against the barrier for a pick, moving or not.
+    # staged and required are the part count of the longest row and the count it needs
+    def report_staging(self, detections, min_length=170):
+        if self.conveyor is None:
+            return
+        staged_mask = self.staged_parts(detections)
+        if not np.any(staged_mask):
+            self.conveyor.report(False, 0, None)
+            return
+        staged = detections.filter(staged_mask)
+        geometry = self.pick_geometry(staged)
+        ready = (staged.length >= self.required_length(staged, min_length)) & (geometry['tot_parts'] >= geometry['min_parts'])
+        longest = int(np.argmax(staged.length))
+        self.conveyor.report(bool(np.any(ready)), int(geometry['tot_parts'][longest]), int(geometry['min_parts'][longest]))
+
+
+    # computes pick position and part count for all pickable detections at once
+    # returns a dict of arrays with one value per detection. points are the 3d robot coordinates from locate_parts,
+    # detections without a point use the 2d belt fit
+    def pick_geometry(self, pickable, points=None):
+        classes = pickable.classes
+        xd, yd = self.transform_coordinates(pickable.x_left, pickable.y_middle, 0)
+        zd = np.full(len(pickable), np.nan)
+        if points is not None:
+            located = ~np.isnan(points[:, 2])
+            xd = np.where(located, points[:, 0], xd)
+            yd = np.where(located, points[:, 1], yd)
+            zd = points[:, 2]
+        close_box = yd > 0
+
+        #new calculation type. part width depends on the label
+        part_width = self.part_widths[classes]
+        small = self.small_classes[classes]
+        big = self.big_classes[classes]
+
+        x_barrier_close_box = X_BARRIER_CLOSE_BOX
+        x_barrier_away_box = X_BARRIER_AWAY_BOX
+        x_barrier = np.where(close_box, x_barrier_close_box, x_barrier_away_box)
+
+        offset = 0
+        vision_length = np.abs(x_barrier) - np.abs(xd * 1000)
+
+        #if yd > 0: vision_length += 3
+        tot_parts = np.round(vision_length / part_width)
+        #extra length per class and part count, from the part profiles
+        counts = np.clip(np.nan_to_num(tot_parts), 0, MAX_PART_COUNT).astype(np.int64)
+        extra_small = self.extra_small_table[classes, counts]
+        extra_big = self.extra_big_table[classes, counts]
+        vision_length = vision_length + np.where(extra_small, np.where(close_box, 5, 9), 0) + np.where(extra_big, 5, 0)
+
+        tot_parts_raw = vision_length / part_width
+        edge_case = ((tot_parts_raw % 1) > 0.40) & ((tot_parts_raw % 1) < 0.60)
+
+        tot_parts = np.round(vision_length / part_width)
+        new_length = tot_parts * part_width + offset
+
+        offset_close = np.where(big, -1.5, 2.5)
+        offset_away = np.where(big, -1.5, 0)
+        xd = np.where(close_box, x_barrier_close_box + new_length + offset_close, x_barrier_away_box + new_length + offset_away)
+        xd = (xd + part_width) / 1000
+
+        min_parts = np.where(big, 7, 14)
+        in_reach = (xd > REACH_X[0]) & (xd < REACH_X[1]) & (yd > REACH_Y[0]) & (yd < REACH_Y[1]) & (tot_parts >= min_parts)
+
+        return {
+            'xd': xd,
+            'yd': yd,
+            'vision_length': vision_length,
+            'tot_parts_raw': tot_parts_raw,
+            'edge_case': edge_case,
+            'tot_parts': tot_parts,
+            'new_length': new_length,
+            'in_reach': in_reach,
+            'min_parts': min_parts,
+            'zd': zd,
+        }
 
 
     def check_bad_part_placement(self, bad_confidence=0.6):
         time.sleep(0.3)
+        self.flush_frames()     #only use frames taken at the check position
         #try 4 times
         tries = 4
         for i in range(tries):
-            #get frames and check if we have a color frame
-            try:
-                frames = self.pipeline.wait_for_frames()
-                aligned_frames = self.align.process(frames)
-                color_frame = aligned_frames.get_color_frame()
-                #depth_frame = aligned_frames.get_depth_frame()
-            except Exception as e:
-                logging.error(f"error with camera: {e}")
-                self.connect_camera()
-                continue #go back to start
-            if not color_frame:
+            #get newest frame and check if we have a color frame
+            captured = self.next_frame()
+            if captured is None:
                 logging.error("No color frame captured")
                 break
 
             #get frame as np array and get results from yolo model
-            frame = np.asanyarray(color_frame.get_data())
-            results = self.detector.detect_objects(frame)
+            frame = captured.color
+            detections = self.detector.detect_objects(frame)
 
             #update frame on user interface
-            with self.frame_lock:
-                self.last_frame = frame
+            self.show_frame(frame)
 
 
             #process the yolo results
-            if results is not None:
-                for result in results:
-                    for box in result.boxes:
-                        bbox = box.xyxy[0].cpu().numpy()
-                        bbox = [int(coord) for coord in bbox[:4]]
-                        label = self.labels[int(box.cls[0])]
-                        confidence = box.conf.item()
-
-                        if 'bad' in label.lower() and confidence > bad_confidence:
-                            logging.info("Bad position detected!")
-
-                            # Draw a thick red bounding box for 'bad' objects
-                            cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 0, 255), 4)  # Red color, thickness 4
-                            text = f'{label} ({box.conf.item():.2f})'
-                            cv2.putText(frame, text, (bbox[0], bbox[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-                        
-                            #update frame for interface
-                            with self.frame_lock:
-                                self.last_frame = frame
-                            return True  # Bad position detected
+            bad = detections.filter(self.bad_classes[detections.classes] & (detections.confidences > bad_confidence))
+            if len(bad):
+                logging.info("Bad position detected!")
+                bbox = bad.boxes[0]
+                label = self.labels[int(bad.classes[0])]
+
+                # Draw a thick red bounding box for 'bad' objects
+                cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (0, 0, 255), 4)  # Red color, thickness 4
+                text = f'{label} ({bad.confidences[0]:.2f})'
+                cv2.putText(frame, text, (bbox[0], bbox[1] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
+
+                #update frame for interface
+                self.show_frame(frame)
+                return True  # Bad position detected
             return False  # No bad position detected      
 
 
@@ -488,6 +620,13 @@ class CameraPosition:
     def stop_display_thread(self):
         self.display_thread_running = False
 
+    #stop capture thread and camera stream
+    def stop(self):
+        self.grabber.stop()
+        self.detector.stop()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+
 
 
 
@@ -497,11 +636,41 @@ class ObjectDetector:
         '''setup yolo model'''
         current_directory = os.path.dirname(os.path.abspath(__file__))
         model_path = os.path.join(current_directory, "best.pt")
-        self.model = YOLO(model_path).to('cuda' if torch.cuda.is_available() else 'cpu')
-        self.model = YOLO(model_path)
+
+        if inference_process:
+            #yolo runs in its own process, the model is only loaded there
+            self.model = None
+            self.engine = ProcessInferenceEngine(model_path, inference_backend, inference_int8, inference_int8_data,
+                                                 max_batch=inference_max_batch, max_wait=inference_max_wait,
+                                                 slots=inference_slots, slot_bytes=inference_slot_bytes,
+                                                 request_timeout=inference_request_timeout)
+            self.engine.start()     #the process warms up the model before it is ready
+            self.device = self.engine.device
+            self.labels = self.engine.labels
+            return
+
+        #torch, or an onnx / openvino export of best.pt on the cpu
+        self.model, self.device = load_model(model_path, inference_backend, inference_int8, inference_int8_data)
         self.labels = self.model.names
 
-    def detect_objects(self, frame):
-        results = self.model.predict(source=frame, verbose=False, show=False)
-        return results
+        #all frames go through the inference engine, so frames from several threads are batched together
+        self.engine = InferenceEngine(self.model, self.device, max_batch=inference_max_batch, max_wait=inference_max_wait)
+        self.engine.start()
+        self.engine.warmup()
+
+    #blocks until the detections for this frame are ready. with roi (x1, y1, x2, y2) only that part of the frame
+    #is used, the boxes are still in full frame pixels. imgsz is the yolo input size, None = model default
+    def detect_objects(self, frame, roi=None, imgsz=None):
+        detections = self.detect_objects_async(frame, roi, imgsz).result()
+        return detections
+
+    #returns a future, use future.result() to get the detections
+    def detect_objects_async(self, frame, roi=None, imgsz=None):
+        if roi is None:
+            return self.engine.submit(frame, imgsz)
+        x1, y1, x2, y2 = roi
+        return self.engine.submit(frame[y1:y2, x1:x2], imgsz, offset=(x1, y1))     #crop is a view, no copy
+
+    def stop(self):
+        self.engine.stop()
 
@@ -3,10 +3,92 @@
 pickup_tcp = [-47.5/1000,-147/1000,135/1000,0,0,0]          #edge of part (x=centerpart, y=edge)
 rotate_tcp = [-47.5/1000, 42/1000, 135/1000, 0, 0, 0]
 placement_tcp = [-47.5/1000,-49/1000,135/1000,0,0,0]        #center of part (x=center,y=center)
+capture_tcp = [-47.5/1000,-140/1000,135/1000,0,0,0]        #tcp and pose of the arm when the belt pictures are taken
+capture_pose = [-0.6639046352765678, -0.08494527187802497, 0.529720350746548, 2.222, 2.248, 0.004]
 
 speed_fast = 2
 acc_fast = 1.5
 
+#run vision for the next pick in a background thread while the robot is placing
+pipelined_mode = False
+
+#send the whole pick as one blended moveL path instead of four separate moves
+single_path_pick = False
+
+#send every placement segment between camera checks as one blended moveL path with the pickup tcp
+single_path_place = False
+
+#yolo inference engine: max frames per batch and max seconds to wait for a batch to fill up
+inference_max_batch = 4
+inference_max_wait = 0.005
+
+#yolo backend: 'torch' runs best.pt (cuda if available), 'onnx' (onnx runtime) and 'openvino' run an export of
+#best.pt on the cpu. the export is made once and kept next to best.pt. inference_int8 quantizes the openvino export
+#with the images of the dataset yaml inference_int8_data (None = ultralytics default dataset).
+#compare the backends on a recorded session: python replay_harness.py backends sessions/belt_01
+inference_backend = 'torch'
+inference_int8 = False
+inference_int8_data = None
+
+#run yolo in its own process, frames go to it through shared memory. inference_slots frames of at most
+#inference_slot_bytes bytes can be in flight. a frame without result after inference_request_timeout seconds
+#restarts the process
+inference_process = False
+inference_slots = 8
+inference_slot_bytes = 1280 * 720 * 3
+inference_request_timeout = 10.0
+
+#belt detection only sends the belt area of the frame to yolo, at a smaller input size.
+#belt_roi is (x1, y1, x2, y2) in pixels, 'auto' computes it from the reach limits of the pick, None = full frame
+belt_roi = 'auto'
+belt_roi_margin = 40        #pixels added around the reach limits with 'auto'
+
+#part tracker: a part can be picked when it moved less than tracker_max_speed pixels per second
+#in tracker_stable_updates detections in a row. detections more than tracker_max_gap seconds apart start counting again
+tracker_stable_updates = 6
+tracker_max_speed = 30.0
+tracker_max_gap = 2.0
+
+#box orientation scan: number of frames per box that have to agree on the orientation
+box_scan_agree = 3
+
+#3d pick localization with the aligned depth frame. camera_extrinsic is the pose of the camera (color optical frame)
+#in the capture tcp frame (hand-eye calibration). pick_z_from_top is the z of the pickup tcp in step 3 of the pick
+#relative to the measured top of the parts. None = 2d belt fit and a fixed belt z per part type
+camera_extrinsic = None     #overrides the value from the calibration file
+pick_z_from_top = None
+
+#camera calibration written by calibration.py: pixel to robot fit of the belt and the hand-eye camera pose.
+#without the file the fit from the first manual calibration is used
+calibration_file = 'calibration.json'
+
+#conveyor: the belt (digital output conveyor_output) runs until the camera sees enough parts against the barrier.
+#without belt frames (arm away from the capture position) it runs at most conveyor_max_run_time seconds
+conveyor_control = True
+conveyor_output = 0
+conveyor_report_timeout = 1.0
+conveyor_max_run_time = 15.0
+
+#robot connection. the receive timestamp has to advance within robot_health_timeout seconds, otherwise the
+#connection is opened again in the background with a retry delay that doubles from robot_retry_delay to robot_retry_max.
+#robot commands wait robot_wait_timeout seconds for the connection to come back before they fail
+robot_health_interval = 0.05
+robot_health_timeout = 0.5
+robot_retry_delay = 0.05
+robot_retry_max = 1.0
+robot_wait_timeout = 5.0
+robot_connect_timeout = 10.0     #first connection at start up
+
+#robot state cache: the receive interface is sampled at robot_state_rate Hz, the last robot_state_history seconds are kept.
+#more than 125 Hz costs the other threads gil time without a reader that needs it
+robot_state_rate = 125
+robot_state_history = 2.0
+
+#offline replay/benchmark: recorded session (directory or .bag) instead of the live camera, simulated robot instead of RTDE
+replay_path = None
+simulate_robot = False
+sim_time_scale = 1.0        #simulated motion time is multiplied by this before sleeping. 0 = do not sleep
+
 
 
 import logging
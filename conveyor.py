@@ -1,34 +1,100 @@
+import threading
 import time
 import logging
+from robot_connection import RobotError
 from configuration import*
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
 
+##########################
+#conveyor scheduler driven by vision. the camera reports after every belt frame how many parts are staged against the
+#barrier and if that is enough to pick (report()). the belt (digital output) runs while there are not enough parts and
+#stops as soon as there are. the camera only sees the belt while the arm is at the capture position: without a fresh
+#report the belt keeps its state, but never runs longer than max_run_time without a report so it can not overfill
+#the belt. the belt also stops while the machine is paused. changes are published on the machine state.
+##########################
+class Conveyor():
+    def __init__(self, robot, boxing_machine, output_id=0, report_timeout=1.0, max_run_time=15.0):
+        self.robot = robot
+        self.boxing_machine = boxing_machine
+        self.output_id = output_id              #digital output of the belt
+        self.report_timeout = report_timeout    #seconds a report counts as fresh
+        self.max_run_time = max_run_time        #max seconds the belt runs after the last report that asked for parts
 
+        self.lock = threading.Lock()
+        self.new_report = threading.Condition(self.lock)
+        self.report_time = 0.0                  #time of the last report
+        self.enough = True                      #last report: enough parts staged
+        self.staged = 0                         #last report: parts against the barrier
+        self.required = 0                       #last report: parts needed for a pick
+        self.asked_time = 0.0                   #time of the last report that asked for parts
+
+        self.belt_on = False
+        self.running = False
+        self.thread = None
+
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logging.info("conveyor scheduler started")
+
+
+    #cancel the scheduler, the belt stops
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.new_report.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.thread = None
+        self.set_belt(False, "conveyor scheduler stopped")
+
+
+    #called by the camera for every belt frame. enough: a row of parts can be picked, staged: parts in the longest
+    #row against the barrier, required: parts that row needs (7 big, 14 small), None = no row seen
+    def report(self, enough, staged, required):
+        with self.lock:
+            now = time.time()
+            self.report_time = now
+            self.enough = enough
+            self.staged = staged
+            if required is not None:
+                self.required = required
+            if not enough:
+                self.asked_time = now
+            self.new_report.notify_all()
+
+
+    def run(self):
+        while True:
+            with self.lock:
+                self.new_report.wait(0.1)
+                if not self.running:
+                    break
+                now = time.time()
+                fresh = now - self.report_time <= self.report_timeout
+                enough, staged, required, asked_time = self.enough, self.staged, self.required, self.asked_time
+
+            if self.boxing_machine.is_paused():
+                self.set_belt(False, "machine paused")
+            elif fresh:
+                self.set_belt(not enough, f"parts staged: {staged} of {required}")
+            elif self.belt_on and now - asked_time > self.max_run_time:
+                self.set_belt(False, f"no belt frames for {now - asked_time:.0f} s")
 
-class Conveyor():
-    def __init__(self):
-        pass
-        #self.running = False
 
-    def run(self, robot):
+    #switches the belt output if it changed. robot errors are logged, the next loop tries again
+    def set_belt(self, on, reason):
+        if on == self.belt_on:
+            return
         try:
-            output_id = 0
-
-            while True:
-                logging.info("Turning conveyor ON")
-                #self.running = False
-                robot.set_digital_output(output_id, True)
-                time.sleep(15)  # Conveyor ON for 15 seconds
-                
-                logging.info("Turning conveyor OFF")
-                #self.running = False
-                robot.set_digital_output(output_id, False)
-                time.sleep(45)  # Conveyor OFF for 45 seconds
-
-        except Exception as e:
-            logging.error(f"Error controlling conveyor: {e}")
+            self.robot.set_digital_output(self.output_id, on)
+        except RobotError as e:
+            logging.error(f"can not switch conveyor: {e}")
+            return
+        self.belt_on = on
+        logging.info(f"conveyor {'on' if on else 'off'}: {reason}")
+        self.boxing_machine.state.set_conveyor(on, reason)
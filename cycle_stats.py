@@ -0,0 +1,54 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+##########################
+#collects cycle time statistics of the main loop: time per stage (vision, pick, place), placements and
+#robot idle time. the replay harness prints these as the benchmark for performance changes.
+##########################
+class CycleStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.stage_time = {}        #total seconds per stage
+            self.stage_count = {}       #number of times each stage ran
+            self.placements = 0
+
+    #time a stage of the main loop: with stats.stage('vision'): ...
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - start
+            with self.lock:
+                self.stage_time[name] = self.stage_time.get(name, 0.0) + duration
+                self.stage_count[name] = self.stage_count.get(name, 0) + 1
+
+    def placement_done(self):
+        with self.lock:
+            self.placements += 1
+
+    #summary as a dict. motion_time is the time the robot spent moving, the rest of the run time is idle time
+    def report(self, motion_time=None):
+        with self.lock:
+            elapsed = time.time() - self.start_time
+            result = {
+                'elapsed': elapsed,
+                'placements': self.placements,
+                'parts_per_minute': self.placements / elapsed * 60 if elapsed > 0 else 0.0,
+                'stages': {name: {'total': total,
+                                  'count': self.stage_count[name],
+                                  'average': total / self.stage_count[name]}
+                           for name, total in self.stage_time.items()},
+            }
+        if motion_time is not None:
+            result['motion_time'] = motion_time
+            result['idle_time'] = max(elapsed - motion_time, 0.0)
+        return result
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+##########################
+#detections of one frame as contiguous numpy arrays. the yolo result is moved to the host in one transfer,
+#after that all filtering is done with vectorized masks instead of per box python loops.
+#boxes are integer pixel coordinates (x1, y1, x2, y2), same as int() on the yolo box coordinates
+##########################
+class Detections:
+    __slots__ = ("boxes", "confidences", "classes")
+
+    def __init__(self, boxes, confidences, classes):
+        self.boxes = boxes              #(N, 4) int32
+        self.confidences = confidences  #(N,) float32
+        self.classes = classes          #(N,) int32
+
+
+    @classmethod
+    def empty(cls):
+        return cls(np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32))
+
+
+    #convert one ultralytics result. boxes.data holds x1, y1, x2, y2, conf, cls per row
+    @classmethod
+    def from_result(cls, result):
+        if result is None or result.boxes is None or len(result.boxes) == 0:
+            return cls.empty()
+        data = result.boxes.data.cpu().numpy()
+        return cls.from_array(data)
+
+
+    #build from an (N, 6) array with x1, y1, x2, y2, conf, cls per row
+    @classmethod
+    def from_array(cls, data):
+        data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+        boxes = np.ascontiguousarray(data[:, :4]).astype(np.int32)
+        confidences = np.ascontiguousarray(data[:, 4])
+        classes = data[:, 5].astype(np.int32)
+        return cls(boxes, confidences, classes)
+
+
+    #(N, 6) float32 array with x1, y1, x2, y2, conf, cls per row, from_array builds the detections back
+    def to_array(self):
+        return np.column_stack([self.boxes, self.confidences, self.classes]).astype(np.float32)
+
+
+    def __len__(self):
+        return len(self.confidences)
+
+
+    #returns a new Detections with only the rows where mask is True (or the given indices)
+    def filter(self, mask):
+        return Detections(self.boxes[mask], self.confidences[mask], self.classes[mask])
+
+
+    #move all boxes by dx, dy pixels
+    def shift(self, dx, dy):
+        offset = np.array([dx, dy, dx, dy], dtype=np.int32)
+        return Detections(self.boxes + offset, self.confidences, self.classes)
+
+
+    @property
+    def x_left(self):
+        return self.boxes[:, 0]
+
+    @property
+    def y_middle(self):
+        return (self.boxes[:, 1] + self.boxes[:, 3]) // 2
+
+    @property
+    def width(self):
+        return self.boxes[:, 2] - self.boxes[:, 0]
+
+    @property
+    def height(self):
+        return self.boxes[:, 3] - self.boxes[:, 1]
+
+    @property
+    def length(self):
+        return np.maximum(self.width, self.height)
+
+    @property
+    def area(self):
+        return self.width * self.height
@@ -0,0 +1,248 @@
+import threading
+import logging
+import math
+import time
+import numpy as np
+from configuration import *
+from pose_math import pose_to_matrix, matrix_to_pose, rotation_angle
+
+
+##########################
+#simulated robot with the same methods as the ur_rtde control, receive and io interfaces that URControl uses.
+#moveL/moveJ do not move anything, they compute how long the real robot would take and sleep for that time
+#(multiplied by sim_time_scale). used by the replay harness to run the BoxingMachine loop without a robot.
+##########################
+
+#distance in meters that counts the same as one radian of tool rotation when computing moveL durations
+ROTATION_RADIUS = 0.15
+
+
+#time for one linear segment with a trapezoid speed profile. v_in/v_out are the speeds at the start and end
+def segment_time(distance, speed, acc, v_in=0.0, v_out=0.0):
+    if distance <= 1e-9:
+        return 0.0
+    speed = max(speed, 1e-6)
+    acc = max(acc, 1e-6)
+    v_in = min(v_in, speed)
+    v_out = min(v_out, speed)
+    d_acc = (speed ** 2 - v_in ** 2) / (2 * acc)
+    d_dec = (speed ** 2 - v_out ** 2) / (2 * acc)
+    if d_acc + d_dec <= distance:
+        return (speed - v_in) / acc + (speed - v_out) / acc + (distance - d_acc - d_dec) / speed
+    #no constant speed part, speed peaks somewhere in the segment
+    v_peak = math.sqrt(acc * distance + (v_in ** 2 + v_out ** 2) / 2)
+    if v_peak < max(v_in, v_out):
+        return distance / max(v_in, v_out)
+    return (v_peak - v_in) / acc + (v_peak - v_out) / acc
+
+
+#distance between two tcp poses used for the moveL duration
+def pose_distance(pose1, pose2):
+    linear = np.linalg.norm(np.asarray(pose2[:3]) - np.asarray(pose1[:3]))
+    angle = rotation_angle(pose1[:6], pose2[:6])
+    return max(linear, angle * ROTATION_RADIUS)
+
+
+#total time of a moveL path. rows are [x, y, z, rx, ry, rz, speed, acc, blend]
+#with a blend radius the robot does not stop at the waypoint and the corner gets cut by the blend radius
+def path_time(start_pose, path):
+    total = 0.0
+    previous = list(start_pose)
+    v_in = 0.0
+    for k, row in enumerate(path):
+        pose, speed, acc, blend = list(row[:6]), row[6], row[7], row[8]
+        distance = pose_distance(previous, pose)
+        if k > 0 and path[k - 1][8] > 0:
+            distance -= min(path[k - 1][8], distance / 2)
+        if k < len(path) - 1 and blend > 0:
+            distance -= min(blend, distance / 2)
+            v_out = min(speed, path[k + 1][6])
+        else:
+            v_out = 0.0
+        total += segment_time(distance, speed, acc, v_in, v_out)
+        v_in = v_out
+        previous = pose
+    return total
+
+
+class FakeRobotState:
+    def __init__(self, time_scale=1.0):
+        self.time_scale = time_scale
+        self.lock = threading.Lock()
+        #start at the camera capture position with the capture tcp
+        self.tcp_offset = list(capture_tcp)
+        capture = pose_to_matrix(capture_pose)
+        self.flange = capture @ np.linalg.inv(pose_to_matrix(self.tcp_offset))
+        self.q = [0.0, -1.57, 1.57, -1.57, -1.57, 0.0]
+        self.digital_out = [False] * 8
+        self.motion_time = 0.0      #total simulated motion time
+        self.moves = 0
+        self.start_time = time.time()
+        self.protective_stop = False    #see trigger_protective_stop
+        self.program_running = True
+        self.stop_motion = threading.Event()    #set by stopL, ends the running move early
+        self.async_move = None                  #thread of the asynchronous move that runs
+
+    def tcp_pose(self):
+        return matrix_to_pose(self.flange @ pose_to_matrix(self.tcp_offset)).tolist()
+
+    def set_tcp_pose(self, pose):
+        self.flange = pose_to_matrix(pose) @ np.linalg.inv(pose_to_matrix(self.tcp_offset))
+
+    #protective stop: the controller stops the control script until the stop is released and the script uploaded again
+    def trigger_protective_stop(self):
+        self.protective_stop = True
+        self.program_running = False
+
+    def release_protective_stop(self):
+        self.protective_stop = False
+
+    #account for a move and sleep for the (scaled) simulated time. returns False if stopL ended the move early
+    def run_motion(self, duration):
+        with self.lock:
+            self.motion_time += duration
+            self.moves += 1
+        if self.time_scale > 0:
+            return not self.stop_motion.wait(duration * self.time_scale)
+        return True
+
+
+class FakeRTDEControl:
+    def __init__(self, state):
+        self.state = state
+
+    def setTcp(self, tool_frame):
+        self.state.tcp_offset = list(tool_frame)
+
+    def getTCPOffset(self):
+        return list(self.state.tcp_offset)
+
+    def setPayload(self, payload, cog):
+        pass
+
+    setPayLoad = setPayload
+
+    #asynchronous: the move runs in a thread and the call returns right away, getAsyncOperationProgress tells when it ends
+    def run(self, move, asynchronous):
+        if not self.state.program_running:
+            return False
+        self.state.stop_motion.clear()
+        if not asynchronous:
+            return move()
+        self.state.async_move = threading.Thread(target=move, daemon=True)
+        self.state.async_move.start()
+        return True
+
+    #-1 when no asynchronous move runs
+    def getAsyncOperationProgress(self):
+        move = self.state.async_move
+        return 0 if move is not None and move.is_alive() else -1
+
+    #moveL(pose, speed, acc) or moveL(path) with rows [x, y, z, rx, ry, rz, speed, acc, blend]
+    def moveL(self, pose_or_path, speed=0.25, acceleration=1.2, asynchronous=False):
+        if np.ndim(pose_or_path) == 2:
+            rows = [list(row) for row in pose_or_path]
+            asynchronous = speed if isinstance(speed, bool) else asynchronous     #moveL(path, asynchronous)
+        else:
+            rows = [list(pose_or_path[:6]) + [speed, acceleration, 0.0]]
+
+        def move():
+            start = self.state.tcp_pose()
+            if not self.state.run_motion(path_time(start, rows)):
+                return False
+            self.state.set_tcp_pose(rows[-1][:6])
+            return True
+        return self.run(move, asynchronous)
+
+    def moveJ(self, q, speed=1.05, acceleration=1.4, asynchronous=False):
+        def move():
+            distance = float(np.max(np.abs(np.asarray(q) - np.asarray(self.state.q))))
+            if not self.state.run_motion(segment_time(distance, speed, acceleration)):
+                return False
+            self.state.q = list(q)
+            return True
+        return self.run(move, asynchronous)
+
+    def stopL(self, acceleration=10.0, asynchronous=False):
+        self.state.stop_motion.set()
+
+    stopJ = stopL
+
+    def stopScript(self):
+        self.state.program_running = False
+
+    def isProgramRunning(self):
+        return self.state.program_running
+
+    def reuploadScript(self):
+        if self.state.protective_stop:
+            return False
+        self.state.program_running = True
+        return True
+
+    def isConnected(self):
+        return True
+
+    def disconnect(self):
+        pass
+
+
+class FakeRTDEReceive:
+    def __init__(self, state):
+        self.state = state
+
+    def getActualTCPPose(self):
+        return self.state.tcp_pose()
+
+    def getActualQ(self):
+        return list(self.state.q)
+
+    def getActualTCPSpeed(self):
+        return [0.0] * 6
+
+    def getActualQd(self):
+        return [0.0] * 6
+
+    def getActualDigitalOutputBits(self):
+        return sum(1 << i for i, state in enumerate(self.state.digital_out) if state)
+
+    def getDigitalOutState(self, output_id):
+        return self.state.digital_out[output_id]
+
+    def getTimestamp(self):
+        return time.time() - self.state.start_time
+
+    def isProtectiveStopped(self):
+        return self.state.protective_stop
+
+    #robot status bits: 1 power on, 2 program running
+    def getRobotStatus(self):
+        return 1 | (2 if self.state.program_running else 0)
+
+    def isConnected(self):
+        return True
+
+    def disconnect(self):
+        pass
+
+
+class FakeRTDEIO:
+    def __init__(self, state):
+        self.state = state
+
+    def setStandardDigitalOut(self, output_id, state):
+        self.state.digital_out[output_id] = state
+        return True
+
+    def disconnect(self):
+        pass
+
+
+#creates the three fake interfaces that share one robot state
+class FakeRobot:
+    def __init__(self, time_scale=1.0):
+        self.state = FakeRobotState(time_scale)
+        self.control = FakeRTDEControl(self.state)
+        self.receive = FakeRTDEReceive(self.state)
+        self.io = FakeRTDEIO(self.state)
+        logging.info(f"simulated robot started (time scale {time_scale})")
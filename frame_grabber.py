@@ -0,0 +1,310 @@
+import threading
+import logging
+import time
+import os
+import glob
+import json
+import types
+import cv2
+import numpy as np
+from configuration import *
+
+
+##########################
+#frame from the ring buffer. color is a BGR image, depth is the raw z16 image aligned to color (or None)
+##########################
+class Frame:
+    __slots__ = ("color", "depth", "timestamp", "frame_number", "seq", "depth_scale")
+
+    def __init__(self, color, depth, timestamp, frame_number, seq, depth_scale):
+        self.color = color
+        self.depth = depth
+        self.timestamp = timestamp          #time.time() when the frame arrived
+        self.frame_number = frame_number    #frame number from the camera
+        self.seq = seq                      #sequence number in the ring buffer, increases with every frame
+        self.depth_scale = depth_scale      #meters per depth unit
+
+    #same as depth_frame.get_distance from pyrealsense2: distance in meters at pixel x, y
+    def get_distance(self, x, y):
+        if self.depth is None:
+            return 0.0
+        return float(self.depth[y, x]) * self.depth_scale
+
+
+##########################
+#small ring buffer with preallocated numpy arrays. one writer at a time, readers never block.
+#the writer fills the next slot and publishes it by updating seq. readers check the slot seq
+#before and after copying, so a slot that got overwritten while reading is detected and read again.
+##########################
+class FrameRing:
+    def __init__(self, slots=4):
+        self.slots = slots
+        self.color_buffers = None
+        self.depth_buffers = None
+        self.slot_info = [(0, 0.0, 0)] * slots     #(seq, timestamp, frame_number) per slot
+        self.seq = 0                                #seq of the newest published frame, 0 = nothing published yet
+        self.depth_scale = 0.001
+        self.write_lock = threading.Lock()          #only writers take this lock
+
+    #allocate buffers for the given frame shape. only happens on the first frame or if the shape changes
+    def allocate(self, color, depth):
+        self.color_buffers = [np.empty_like(color) for _ in range(self.slots)]
+        self.depth_buffers = [np.empty_like(depth) for _ in range(self.slots)] if depth is not None else None
+
+    def needs_allocate(self, color, depth):
+        if self.color_buffers is None:
+            return True
+        if self.color_buffers[0].shape != color.shape or self.color_buffers[0].dtype != color.dtype:
+            return True
+        if (depth is None) != (self.depth_buffers is None):
+            return True
+        if depth is not None and self.depth_buffers[0].shape != depth.shape:
+            return True
+        return False
+
+    #copy a frame into the next slot and publish it
+    def publish(self, color, depth=None, timestamp=None, frame_number=0):
+        if timestamp is None:
+            timestamp = time.time()
+        with self.write_lock:
+            seq = self.seq + 1
+            index = seq % self.slots
+            if self.needs_allocate(color, depth):
+                self.allocate(color, depth)
+            self.slot_info[index] = (-1, 0.0, 0)   #mark slot as being written
+            np.copyto(self.color_buffers[index], color)
+            if depth is not None:
+                np.copyto(self.depth_buffers[index], depth)
+            self.slot_info[index] = (seq, timestamp, frame_number)
+            self.seq = seq
+        return seq
+
+    #returns the newest frame or None. with copy=False the arrays are views into the ring and can be overwritten later
+    def latest(self, copy=True):
+        while True:
+            seq = self.seq
+            if seq == 0:
+                return None
+            index = seq % self.slots
+            color_buffers = self.color_buffers
+            depth_buffers = self.depth_buffers
+            info = self.slot_info[index]
+            if info[0] != seq:
+                continue    #writer is already busy with this slot, take the newer one
+            color = color_buffers[index]
+            depth = depth_buffers[index] if depth_buffers is not None else None
+            if copy:
+                color = color.copy()
+                depth = depth.copy() if depth is not None else None
+                if self.slot_info[index][0] != seq:
+                    continue    #slot got overwritten while copying
+            return Frame(color, depth, info[1], info[2], seq, self.depth_scale)
+
+    #true as long as the slot of a frame from latest(copy=False) has not been overwritten
+    def still_valid(self, frame):
+        return self.slot_info[frame.seq % self.slots][0] == frame.seq
+
+
+##########################
+#frame source for the realsense camera (live or .bag playback). read() blocks until the next aligned frame pair
+#and returns (color, depth, frame_number), or None if the camera did not deliver both frames.
+#the replay harness has a source with the same interface that reads recorded frames from disk.
+##########################
+class RealSenseSource:
+    def __init__(self, camera):
+        self.camera = camera        #CameraPosition, owns pipeline and align
+        self.depth_scale = None     #meters per depth unit, filled in with the first frame
+        self.intrinsics = None      #color stream intrinsics, filled in with the first frame
+
+    def read(self):
+        frames = self.camera.pipeline.wait_for_frames()
+        aligned_frames = self.camera.align.process(frames)
+        color_frame = aligned_frames.get_color_frame()
+        depth_frame = aligned_frames.get_depth_frame()
+        if not color_frame or not depth_frame:
+            return None
+
+        if self.intrinsics is None:
+            self.intrinsics = color_frame.profile.as_video_stream_profile().intrinsics
+            self.depth_scale = depth_frame.get_units()
+        return np.asanyarray(color_frame.get_data()), np.asanyarray(depth_frame.get_data()), color_frame.get_frame_number()
+
+    def reconnect(self):
+        self.intrinsics = None
+        self.camera.connect_camera()
+
+
+##########################
+#frame source that replays a recorded session from a directory instead of the camera.
+#the directory holds color_00000.png (or .npy) and depth_00000.npy (or 16 bit .png) per frame and an optional
+#meta.json with depth_scale and the color intrinsics (width, height, fx, fy, ppx, ppy).
+#frames are played at fps and the session loops when it reaches the end.
+##########################
+class ReplaySource:
+    def __init__(self, path, fps=30):
+        self.path = path
+        self.fps = fps
+        self.color_files = sorted(glob.glob(os.path.join(path, "color_*.png")) + glob.glob(os.path.join(path, "color_*.npy")))
+        if not self.color_files:
+            raise FileNotFoundError(f"no recorded frames in {path}")
+
+        self.depth_scale = 0.001
+        self.intrinsics = None
+        meta_file = os.path.join(path, "meta.json")
+        if os.path.exists(meta_file):
+            with open(meta_file) as f:
+                meta = json.load(f)
+            self.depth_scale = meta.get("depth_scale", self.depth_scale)
+            if "intrinsics" in meta:
+                self.intrinsics = types.SimpleNamespace(coeffs=[0.0] * 5, **meta["intrinsics"])
+
+        self.index = 0
+        self.next_time = time.time()
+        logging.info(f"replaying {len(self.color_files)} frames from {path}")
+
+    @staticmethod
+    def load(file, flags=cv2.IMREAD_COLOR):
+        if file.endswith(".npy"):
+            return np.load(file)
+        return cv2.imread(file, flags)
+
+    #find the depth file that belongs to a color file
+    @staticmethod
+    def depth_file(color_file):
+        folder, name = os.path.split(color_file)
+        number = os.path.splitext(name)[0][len("color_"):]
+        for extension in (".npy", ".png"):
+            file = os.path.join(folder, f"depth_{number}{extension}")
+            if os.path.exists(file):
+                return file
+        return None
+
+    def read(self):
+        #play at the recorded frame rate
+        delay = self.next_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_time = max(self.next_time, time.time() - 1 / self.fps) + 1 / self.fps
+
+        frame_number = self.index
+        color_file = self.color_files[self.index % len(self.color_files)]
+        self.index += 1
+
+        color = self.load(color_file)
+        depth_file = self.depth_file(color_file)
+        if depth_file is not None:
+            depth = self.load(depth_file, cv2.IMREAD_UNCHANGED)
+        else:
+            depth = np.zeros(color.shape[:2], dtype=np.uint16)
+        if self.intrinsics is None:
+            height, width = color.shape[:2]
+            self.intrinsics = types.SimpleNamespace(width=width, height=height, fx=615.0, fy=615.0,
+                                                    ppx=width / 2, ppy=height / 2, coeffs=[0.0] * 5)
+        return color, depth, frame_number
+
+    def reconnect(self):
+        pass
+
+
+#write the newest frames of a grabber to a directory that ReplaySource can play back
+def record_session(grabber, path, count=300):
+    os.makedirs(path, exist_ok=True)
+    last_seq = 0
+    for index in range(count):
+        captured = grabber.wait_for_frame(last_seq, timeout=2.0)
+        if captured is None:
+            logging.error("recording stopped, no frames from camera")
+            break
+        last_seq = captured.seq
+        cv2.imwrite(os.path.join(path, f"color_{index:05d}.png"), captured.color)
+        np.save(os.path.join(path, f"depth_{index:05d}.npy"), captured.depth)
+
+    meta = {"depth_scale": grabber.ring.depth_scale}
+    intrinsics = grabber.intrinsics
+    if intrinsics is not None:
+        meta["intrinsics"] = {name: getattr(intrinsics, name) for name in ("width", "height", "fx", "fy", "ppx", "ppy")}
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    logging.info(f"recorded {index + 1} frames to {path}")
+
+
+##########################
+#capture thread that continuously pulls aligned color and depth frames from a frame source
+#into a ring buffer. consumers get the newest frame without waiting for the camera.
+##########################
+class FrameGrabber:
+    def __init__(self, source, slots=4):
+        self.source = source        #RealSenseSource or replay source
+        self.ring = FrameRing(slots)
+        self.new_frame = threading.Condition()
+
+        self.running = False
+        self.capture_thread = None
+
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.capture_thread = threading.Thread(target=self.capture_loop, daemon=True)
+        self.capture_thread.start()
+        logging.info("frame grabber started")
+
+
+    def stop(self):
+        self.running = False
+        if self.capture_thread is not None:
+            self.capture_thread.join(timeout=2)
+        self.capture_thread = None
+        logging.info("frame grabber stopped")
+
+
+    #capture thread
+    def capture_loop(self):
+        while self.running:
+            try:
+                captured = self.source.read()
+            except Exception as e:
+                if not self.running:
+                    break
+                logging.error(f"error with camera: {e}")
+                try:
+                    self.source.reconnect()
+                except Exception as e:
+                    logging.error(f"frame grabber could not reconnect camera: {e}")
+                    time.sleep(1)
+                continue
+
+            if captured is None:
+                continue
+
+            color, depth, frame_number = captured
+            self.ring.depth_scale = self.source.depth_scale
+            self.ring.publish(color, depth, time.time(), frame_number)
+            with self.new_frame:
+                self.new_frame.notify_all()
+
+
+    #color stream intrinsics of the source (None until the first frame arrived)
+    @property
+    def intrinsics(self):
+        return self.source.intrinsics
+
+
+    #newest frame or None, never blocks
+    def latest(self, copy=True):
+        return self.ring.latest(copy)
+
+
+    #seq of the newest frame
+    def latest_seq(self):
+        return self.ring.seq
+
+
+    #returns a frame newer than after_seq. only waits if the ring has no newer frame yet. None on timeout
+    def wait_for_frame(self, after_seq=0, timeout=1.0):
+        if self.ring.seq <= after_seq:
+            with self.new_frame:
+                if not self.new_frame.wait_for(lambda: self.ring.seq > after_seq, timeout):
+                    return None
+        return self.ring.latest()
@@ -0,0 +1,134 @@
+import threading
+import queue
+import logging
+import time
+import numpy as np
+from concurrent.futures import Future
+from detections import Detections
+from configuration import *
+
+
+##########################
+#inference engine for the yolo model. frames from several threads are put in a request queue,
+#a worker thread groups them into micro batches and runs them in one predict call.
+#every request gets a future with the detections for that frame.
+#a request can have its own input size (imgsz) and a pixel offset, for frames that are cropped to a region of interest.
+#requests with a different imgsz are run in separate predict calls, the offset is added to the boxes of the result.
+##########################
+class InferenceEngine:
+    def __init__(self, model, device='cpu', max_batch=4, max_wait=0.005):
+        self.model = model
+        self.device = device
+        self.max_batch = max_batch      #max frames per predict call
+        self.max_wait = max_wait        #seconds to wait for more frames after the first one arrived
+
+        self.requests = queue.Queue()
+        self.running = False
+        self.worker_thread = None
+        self.warmed_up = False
+
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.worker_thread = threading.Thread(target=self.worker, daemon=True)
+        self.worker_thread.start()
+        logging.info(f"inference engine started on {self.device}")
+
+
+    def stop(self):
+        self.running = False
+        self.requests.put(None)     #wake up worker
+        if self.worker_thread is not None:
+            self.worker_thread.join(timeout=2)
+        self.worker_thread = None
+
+
+    #run one dummy frame so the first real frame does not pay for lazy initialization of the model
+    def warmup(self, shape=(480, 640, 3), imgsz=None):
+        start = time.time()
+        dummy = np.zeros(shape, dtype=np.uint8)
+        self.predict([dummy], imgsz)
+        self.warmed_up = True
+        logging.info(f"inference engine warm-up for {shape[1]}x{shape[0]} done in {time.time() - start:.2f}s")
+
+
+    #queue a frame for inference. returns a future, future.result() gives the Detections for this frame.
+    #imgsz is the model input size (None = model default), offset (dx, dy) is added to every box
+    def submit(self, frame, imgsz=None, offset=None):
+        if not self.running:
+            raise RuntimeError("inference engine is not running")
+        future = Future()
+        self.requests.put((frame, future, imgsz, offset))
+        return future
+
+
+    #run the model on a list of frames, returns one result per frame
+    def predict(self, frames, imgsz=None):
+        if imgsz is None:
+            return self.model.predict(source=frames, verbose=False, show=False, device=self.device)
+        return self.model.predict(source=frames, verbose=False, show=False, device=self.device, imgsz=imgsz)
+
+
+    #collect a micro batch: block for the first request, then take what arrives within max_wait
+    def next_batch(self):
+        request = self.requests.get()
+        if request is None:
+            return []
+        batch = [request]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                request = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.running = False
+                break
+            batch.append(request)
+        return batch
+
+
+    #run one predict call for requests with the same imgsz and resolve their futures
+    def run_group(self, group, imgsz):
+        frames = [request[0] for request in group]
+        try:
+            results = self.predict(frames, imgsz)
+        except Exception as e:
+            logging.error(f"inference engine error: {e}")
+            for request in group:
+                request[1].set_exception(e)
+            return
+
+        for (frame, future, size, offset), result in zip(group, results):
+            detections = Detections.from_result(result)
+            if offset is not None:
+                detections = detections.shift(*offset)
+            future.set_result(detections)
+
+
+    #worker thread
+    def worker(self):
+        while self.running:
+            batch = self.next_batch()
+            batch = [request for request in batch if request[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            #one predict call per input size
+            groups = {}
+            for request in batch:
+                groups.setdefault(request[2], []).append(request)
+            for imgsz, group in groups.items():
+                self.run_group(group, imgsz)
+
+        #fail requests that are still waiting
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None and request[1].set_running_or_notify_cancel():
+                request[1].set_exception(RuntimeError("inference engine stopped"))
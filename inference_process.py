@@ -0,0 +1,336 @@
+import multiprocessing
+import threading
+import logging
+import queue
+import time
+from collections import deque
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import Future
+from detections import Detections
+from model_backend import model_file
+
+
+##########################
+#yolo inference in its own process, so the pre and post processing of the model do not hold the gil of the vision,
+#ui and robot threads. frames go to the process through shared memory slots (one copy into a slot, no pickling),
+#the process sends back the detections as compact (N, 6) arrays. inside the process an InferenceEngine batches the
+#frames as before. same methods as InferenceEngine: start, stop, warmup, submit.
+#a receiver thread resolves the futures and watches the process. when the process died or a frame takes longer than
+#request_timeout, the process is started again with a retry delay that doubles up to retry_max. the frames that are
+#not done are sent again one at a time (their slots still hold them), so a frame that crashes the process does not
+#take the frames of its batch with it: a frame that was sent twice without result fails.
+#an onnx / openvino export of the weights is made in this process before the inference process starts, so a long
+#export (int8 calibration) does not run into start_timeout and is not made again on every restart.
+##########################
+
+#runs in the inference process. loads the model file (see model_backend.model_file), then runs the requests
+#(request_id, slot, shape, imgsz) until None
+def inference_worker(model_path, backend, max_batch, max_wait, slot_names, requests, results):
+    try:
+        from model_backend import open_model
+        from inference_engine import InferenceEngine
+        slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+        model, device = open_model(model_path, backend)
+        engine = InferenceEngine(model, device, max_batch=max_batch, max_wait=max_wait)
+        engine.start()
+        engine.warmup()
+    except Exception as e:
+        results.put(('failed', str(e)))
+        return
+    results.put(('ready', dict(model.names), device))
+
+    def send(request_id, future):
+        try:
+            results.put(('result', request_id, future.result().to_array()))
+        except Exception as e:
+            results.put(('error', request_id, str(e)))
+
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        request_id, slot, shape, imgsz = request
+        frame = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)     #no copy, the slot is ours until the result is sent
+        future = engine.submit(frame, imgsz)
+        future.add_done_callback(lambda future, request_id=request_id: send(request_id, future))
+    engine.stop()
+
+
+#frame that was submitted and has no result yet
+class PendingFrame:
+    __slots__ = ("future", "slot", "shape", "imgsz", "offset", "sent", "attempts")
+
+    def __init__(self, future, slot, shape, imgsz, offset):
+        self.future = future
+        self.slot = slot            #shared memory slot that holds the frame
+        self.shape = shape
+        self.imgsz = imgsz
+        self.offset = offset        #(dx, dy) added to the boxes, None = no offset
+        self.sent = None            #time.monotonic() when it was sent to the process, None = not sent yet
+        self.attempts = 0
+
+
+class ProcessInferenceEngine:
+    def __init__(self, model_path, backend='torch', int8=False, int8_data=None, max_batch=4, max_wait=0.005, slots=8,
+                 slot_bytes=1280 * 720 * 3, start_timeout=120.0, request_timeout=10.0, retry_delay=1.0, retry_max=30.0):
+        self.model_path = model_path
+        self.backend = backend              #see model_backend
+        self.int8 = int8
+        self.int8_data = int8_data
+        self.device = None                  #chosen by the process
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.slot_count = slots             #frames that can be in flight, submit blocks when all slots are used
+        self.slot_bytes = slot_bytes        #max size of one frame
+        self.start_timeout = start_timeout  #seconds for loading the model in the process, the export is made before
+        self.model_file = None              #(path, backend) that the process loads
+        self.request_timeout = request_timeout
+        self.retry_delay = retry_delay
+        self.retry_max = retry_max
+
+        #spawn: a forked child would inherit the threads and the cuda state of this process
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = threading.Lock()        #protects pending, next_id, waiting and sending
+        self.slots = []                     #SharedMemory blocks
+        self.free_slots = queue.Queue()
+        self.pending = {}                   #request_id -> PendingFrame
+        self.next_id = 0
+        self.waiting = deque()              #after a restart: request ids that are sent one at a time
+        self.isolated = None                #request id that is in the process alone
+
+        self.process = None
+        self.requests = None
+        self.results = None
+        self.ready = threading.Event()      #set while the process takes requests
+        self.labels = None                  #class names of the model, sent by the process
+        self.restarts = 0
+
+        self.running = False
+        self.receiver_thread = None
+        self.warmed_up = False
+
+
+    #creates the slots and starts the process, blocks until the model is loaded. raises RuntimeError if it does not start
+    def start(self):
+        if self.running:
+            return
+        if self.model_file is None:
+            self.model_file = model_file(self.model_path, self.backend, self.int8, self.int8_data)
+        for k in range(self.slot_count):
+            self.slots.append(shared_memory.SharedMemory(create=True, size=self.slot_bytes))
+            self.free_slots.put(k)
+        self.running = True
+        try:
+            self.launch()
+        except RuntimeError:
+            self.running = False
+            self.release_slots()
+            raise
+        self.receiver_thread = threading.Thread(target=self.receiver, daemon=True)
+        self.receiver_thread.start()
+
+
+    def stop(self):
+        self.running = False
+        if self.receiver_thread is not None:
+            self.receiver_thread.join(timeout=2)
+        self.receiver_thread = None
+        if self.process is not None and self.process.is_alive():
+            self.requests.put(None)
+            self.process.join(timeout=5)
+        self.kill()
+
+        with self.lock:
+            pending = list(self.pending.values())
+            self.pending = {}
+        for frame in pending:
+            if frame.future.set_running_or_notify_cancel():
+                frame.future.set_exception(RuntimeError("inference engine stopped"))
+        self.release_slots()
+
+
+    def release_slots(self):
+        for slot in self.slots:
+            slot.close()
+            slot.unlink()
+        self.slots = []
+        self.free_slots = queue.Queue()
+
+
+    #starts the process and waits until it loaded the model, then sends the frames that are not done
+    def launch(self):
+        self.requests = self.context.Queue()
+        self.results = self.context.Queue()
+        self.process = self.context.Process(target=inference_worker, daemon=True,
+                                            args=(*self.model_file, self.max_batch, self.max_wait,
+                                                  [slot.name for slot in self.slots], self.requests, self.results))
+        self.process.start()
+
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            try:
+                message = self.results.get(timeout=0.5)
+            except queue.Empty:
+                if not self.process.is_alive() or time.monotonic() > deadline:
+                    self.kill()
+                    raise RuntimeError("inference process did not start")
+                continue
+            if message[0] == 'failed':
+                self.kill()
+                raise RuntimeError(f"inference process did not start: {message[1]}")
+            if message[0] == 'ready':
+                break
+        self.labels = message[1]
+        self.device = message[2]
+
+        with self.lock:
+            self.waiting = deque()
+            self.isolated = None
+            for request_id in sorted(self.pending):
+                frame = self.pending[request_id]
+                frame.sent = None
+                if frame.attempts >= 2:
+                    del self.pending[request_id]
+                    self.fail(frame, RuntimeError("inference process failed twice on this frame"))
+                else:
+                    self.waiting.append(request_id)
+            self.ready.set()
+            self.send_next()
+        logging.info(f"inference process {self.process.pid} started on {self.device}")
+
+
+    #ends the process, also when it hangs
+    def kill(self):
+        self.ready.clear()
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=2)
+        self.requests.cancel_join_thread()     #do not wait for requests the process will never read
+        self.process = None
+
+
+    #run one dummy frame so the first real frame of this size does not pay for lazy initialization of the model
+    def warmup(self, shape=(480, 640, 3), imgsz=None):
+        start = time.time()
+        self.submit(np.zeros(shape, dtype=np.uint8), imgsz).result()
+        self.warmed_up = True
+        logging.info(f"inference process warm-up for {shape[1]}x{shape[0]} done in {time.time() - start:.2f}s")
+
+
+    #copies the frame (uint8) into a free slot and queues it. returns a future, future.result() gives the Detections.
+    #imgsz is the model input size (None = model default), offset (dx, dy) is added to every box
+    def submit(self, frame, imgsz=None, offset=None):
+        if not self.running:
+            raise RuntimeError("inference engine is not running")
+        frame = np.asarray(frame)
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_bytes:
+            raise ValueError(f"frame {frame.shape} {frame.dtype} does not fit in an inference slot of {self.slot_bytes} bytes")
+
+        slot = self.free_slots.get()    #blocks while all slots are in flight
+        np.copyto(np.ndarray(frame.shape, dtype=np.uint8, buffer=self.slots[slot].buf), frame)
+        future = Future()
+        with self.lock:
+            request_id = self.next_id
+            self.next_id += 1
+            pending = PendingFrame(future, slot, frame.shape, imgsz, offset)
+            self.pending[request_id] = pending
+            if self.ready.is_set() and not self.waiting and self.isolated is None:
+                self.send(request_id, pending)
+            else:
+                self.waiting.append(request_id)
+        return future
+
+
+    #call with the lock held
+    def send(self, request_id, frame):
+        frame.sent = time.monotonic()
+        frame.attempts += 1
+        self.requests.put((request_id, frame.slot, frame.shape, frame.imgsz))
+
+
+    #sends the next waiting frame once the frame before it has its result. call with the lock held
+    def send_next(self):
+        while self.waiting and self.isolated is None:
+            request_id = self.waiting.popleft()
+            frame = self.pending.get(request_id)
+            if frame is not None:
+                self.isolated = request_id
+                self.send(request_id, frame)
+
+
+    def fail(self, frame, error):
+        self.free_slots.put(frame.slot)
+        if frame.future.set_running_or_notify_cancel():
+            frame.future.set_exception(error)
+
+
+    #receiver thread: resolves the futures, restarts the process when it is not healthy
+    def receiver(self):
+        while self.running:
+            try:
+                message = self.results.get(timeout=0.5)
+            except (queue.Empty, EOFError, OSError):
+                message = None
+            if message is not None:
+                self.handle(message)
+            problem = self.check_health()
+            if problem is not None and self.running:
+                self.restart(problem)
+
+
+    def handle(self, message):
+        kind = message[0]
+        if kind not in ('result', 'error'):
+            return
+        with self.lock:
+            frame = self.pending.pop(message[1], None)
+            if message[1] == self.isolated:
+                self.isolated = None
+                self.send_next()
+        if frame is None:
+            return
+        if kind == 'error':
+            self.fail(frame, RuntimeError(f"inference error: {message[2]}"))
+            return
+
+        self.free_slots.put(frame.slot)
+        if not frame.future.set_running_or_notify_cancel():
+            return
+        detections = Detections.from_array(message[2])
+        if frame.offset is not None:
+            detections = detections.shift(*frame.offset)
+        frame.future.set_result(detections)
+
+
+    #None if the process is fine, otherwise the reason it has to be started again
+    def check_health(self):
+        if self.process is None or not self.process.is_alive():
+            exitcode = None if self.process is None else self.process.exitcode
+            return f"process exited with code {exitcode}"
+        now = time.monotonic()
+        with self.lock:
+            sent = [frame.sent for frame in self.pending.values() if frame.sent is not None]
+        if sent and now - min(sent) > self.request_timeout:
+            return f"no detections for {now - min(sent):.1f} s"
+        return None
+
+
+    def restart(self, reason):
+        logging.error(f"inference process: {reason}, starting it again")
+        self.kill()
+        delay = self.retry_delay
+        while self.running:
+            try:
+                self.launch()
+                self.restarts += 1
+                return
+            except RuntimeError as e:
+                logging.error(f"{e}, next attempt in {delay:.1f} s")
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
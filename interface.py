@@ -1,16 +1,17 @@
 import customtkinter
 import tkinter as tk
-from PIL import Image
+from PIL import Image, ImageTk
 from functools import partial
 import time
 from boxing_machine import BoxingMachine
 import threading
+import queue
 import logging
 import numpy as np
-from conveyor import Conveyor
 import cv2
 import subprocess
 from configuration import*
+from machine_state import STATUS, BOXES_FULL, ROBOT_ERROR, CONVEYOR, MACHINE_PAUSED, MACHINE_STOPPED
 
 
 logging.basicConfig(
@@ -54,12 +55,6 @@ class UserInterface:
         robot_ip = "192.168.0.1"  #Define ip
         self.machine = BoxingMachine(robot_ip, interface=self) #Create and start BoxingMachine
 
-        '''start conveyer'''
-        self.conveyor = Conveyor()
-       # conveyer_start = threading.Thread(target=self.conveyor.run, args=(self.machine.robot,),daemon=True)
-        #conveyer_start.start()
-
-
         self.setup_ui() #setup UI
 
 
@@ -67,14 +62,17 @@ class UserInterface:
         self.stopped = False
 
 
-        '''start display thread to start showing images'''
-        #start display thread
-        self.display_thread = threading.Thread(target=self.update_live_feed, args=(self.machine.camera,), daemon=True) 
-        self.display_thread.start() 
+        '''start showing images'''
+        #live feed runs on the tk event loop, only new frames are drawn
+        self.feed_interval = 50     #ms between checks for a new frame (~20 FPS max)
+        self.feed_seq = 0           #seq of the frame that is shown
+        self.root.after(self.feed_interval, self.update_live_feed)
 
-        #start update placementes thread. looks for updates regarding the placing of parts
-        self.update_placements_thread = threading.Thread(target=self.update_placements, daemon=True)
-        self.update_placements_thread.start()
+        #placements, boxes and status come as events from the machine state, handled on the tk thread
+        self.shown = {}             #last value shown per widget
+        self.event_interval = 50    #ms between checks for new events
+        self.machine_events = self.machine.state.subscribe()
+        self.root.after(self.event_interval, self.process_machine_events)
 
 
 
@@ -112,27 +110,38 @@ class UserInterface:
 
             #pause boxing machine. pausing for now instead of stopping
             self.machine.pause()
+            self.show_paused()
 
-            self.hoisting_mode.configure(state="disabled")
-            self.running_mode.configure(state="disabled")
 
-            self.start_button_msg = "start/resume"
-            self.start_button_color = '#106A43'
-            self.start_but.configure(text=self.start_button_msg, fg_color=self.start_button_color, hover_color=self.start_button_color)
+    #buttons and status light of a paused machine. also used when the machine paused itself
+    def show_paused(self):
+        self.hoisting_mode.configure(state="disabled")
+        self.running_mode.configure(state="disabled")
 
-            self.state_color = "red"
+        self.start_button_msg = "start/resume"
+        self.start_button_color = '#106A43'
+        self.start_but.configure(text=self.start_button_msg, fg_color=self.start_button_color, hover_color=self.start_button_color)
 
-            # Update the color of the statuslight
-            self.statuslight.configure(fg_color=self.state_color)
+        self.state_color = "red"
 
-            self.start_button = True
+        # Update the color of the statuslight
+        self.statuslight.configure(fg_color=self.state_color)
+
+        self.start_button = True
 
 
     #check if stop button pressed
     def stop_button_pressed(self):
         self.update_status("Stopped")
+        self.show_stopped()
 
+        self.update_status("stopped: replace boxes before starting")
+        self.machine.stop_run()
+        self.machine.boxes_replaced()
 
+
+    #buttons and status light of a stopped machine, start begins a new run. also used when the machine stopped itself
+    def show_stopped(self):
         #change pause button
         self.hoisting_mode.configure(state="enabled")
         self.running_mode.configure(state="enabled")
@@ -144,11 +153,7 @@ class UserInterface:
 
        # Update the color of the statuslight
         self.statuslight.configure(fg_color=self.state_color)
-
-
-        self.update_status("stopped: replace boxes before starting")
         self.started_before = False
-        self.stopped = True
 
     def restart_button_pressed(self):
         logging.error("restart button pressed")
@@ -163,89 +168,110 @@ class UserInterface:
             print(f"Een onverwachte fout is opgetreden: {e}")
 
     '''update placementes of parts on the display'''
-    def update_placements(self):
+    #handles the events of the machine state on the tk thread. widgets are only touched if a value changed
+    def process_machine_events(self):
+        placements_changed = False
         while True:
-        # Reset alle labels eerst, zodat ze niet over elkaar heen staan
-            #placements,box_no,boxes_full = 0,0,0
-            with self.machine.thread_lock:
-                boxes_full = self.machine.boxes_are_full
-                totalplacements = self.machine.total_parts
-                placements = self.machine.placements
-                #logging.info(f"placements: {placements}")
-            if boxes_full:
-                 self.started_before = False
-                 logging.info("boxes are full")
-                 self.start_button_msg = "start"
-                 self.start_button_color = '#106A43'
-                 self.start_but.configure(text=self.start_button_msg, fg_color=self.start_button_color, hover_color=self.start_button_color)
-                 with self.machine.thread_lock:
-                    self.machine.boxes_are_full = False
-                 self.stopped = True
-
-            with self.machine.thread_lock:
-                box_no = self.machine.current_box
-        
-                part_box_0 = self.machine.last_part_box_0
-                part_box_1 = self.machine.last_part_box_1
-            
-
-            if placements == 0: progress = 0
+            try:
+                event, data = self.machine_events.get_nowait()
+            except queue.Empty:
+                break
+
+            if event == STATUS:
+                self.set_label(self.status_text, data)
+            elif event == BOXES_FULL:
+                self.started_before = False
+                logging.info("boxes are full")
+                self.start_button_msg = "start"
+                self.start_button_color = '#106A43'
+                self.start_but.configure(text=self.start_button_msg, fg_color=self.start_button_color, hover_color=self.start_button_color)
+                self.stopped = True
+                placements_changed = True
+            elif event == CONVEYOR:
+                continue    #belt changes are only logged, no widget for the belt
+            elif event == MACHINE_PAUSED:
+                #the machine paused itself and waits for the operator, same as the pause button
+                self.show_paused()
+                self.set_label(self.status_text, data)
+            elif event == MACHINE_STOPPED:
+                #the machine stopped the run itself, same as the stop button
+                self.show_stopped()
+                self.set_label(self.status_text, data)
+            elif event == ROBOT_ERROR:
+                #main loop stopped, start begins a new run once the robot is back
+                self.set_label(self.status_text, data)
+                self.started_before = False
+                self.hoisting_mode.configure(state="enabled")
+                self.running_mode.configure(state="enabled")
+                self.start_button_msg = "start"
+                self.start_button_color = '#106A43'
+                self.start_but.configure(text=self.start_button_msg, fg_color=self.start_button_color, hover_color=self.start_button_color)
+                self.start_button = True
+                self.state_color = "red"
+                self.statuslight.configure(fg_color=self.state_color)
             else:
-                progress = placements / totalplacements
-
-            if part_box_0 == 0:
-                part_box_0 =  {"box_number": 0,
-                    "part_number": 0,
-                    "layer_number": 1,
-                    "partcount": 0}
-            if part_box_1 == 0:
-                part_box_1 =  {"box_number": 0,
-                    "part_number": 0,
-                    "layer_number": 1,
-                    "partcount": 0}
-                
+                placements_changed = True
+
+        if placements_changed:
+            self.show_placements(self.machine.state.snapshot())
+        self.root.after(self.event_interval, self.process_machine_events)
+
+
+    #progress bar and box labels from a machine state snapshot
+    def show_placements(self, state):
+        if state['placements'] == 0: progress = 0
+        else:
+            progress = state['placements'] / state['total_parts']
+
+        empty_box = {"box_number": 0,
+            "part_number": 0,
+            "layer_number": 1,
+            "partcount": 0}
+        part_box_0 = state['last_parts'].get(0, empty_box)
+        part_box_1 = state['last_parts'].get(1, empty_box)
+
+        if progress != self.shown.get('progress'):
+            self.shown['progress'] = progress
             self.progressbar.set(progress)
             self.percentage_value = int(progress*100)
-            self.percentage.configure(text=f"{self.percentage_value}%")
-            #logging.info(f"placements: {placements}  totalplacementes: {totalplacements}")
-
-            if box_no == 0:
-                box1state = "filling" #other states should be: empty, full or error
-                box1partnr = part_box_0['partcount']
-                box1layernr = part_box_0['layer_number']
-                self.boxstate_text1.configure(text=(f"box 1:\n status: {box1state}\n parts: {box1partnr}\n layer: {box1layernr}"))
-                
-            if box_no == 1:
-                box2state = "filling" #other states should be: empty, full or error
-                box1state = "full"
-                box2partnr = part_box_1['partcount']
-                box2layernr = part_box_1['layer_number']
-                self.boxstate_text1.configure(text=(f"box 1:\n status: {box1state}\n parts: {box1partnr}\n layer: {box1layernr}"))
-                self.boxstate_text2.configure(text=(f"box 2:\n status: {box2state}\n parts: {box2partnr}\n layer: {box2layernr}"))
-            
-            if boxes_full:
-                box2state = "full"
-                self.boxstate_text2.configure(text=(f"box 2:\n status: {box2state}\n parts: {box2partnr}\n layer: {box2layernr}"))
-                time.sleep(0.5)
-
-
-
-    #updates images on the interface that have been taking by the camera 
-    def update_live_feed(self, camera_position):
-        logging.info("Starting display thread...")
-        numpy_image = None
-        while camera_position.display_thread_running:
-            with camera_position.frame_lock:  # Access the frame safely
-                if camera_position.last_frame is not None:
-                    numpy_image = camera_position.last_frame.copy()
-            if numpy_image is not None:
-                rgb_image = cv2.cvtColor(numpy_image, cv2.COLOR_BGR2RGB)
-                pil_image = Image.fromarray(rgb_image)
-                self.my_image = customtkinter.CTkImage(light_image=pil_image, size=(640/self.camscale, 420/self.camscale))
-                self.image_label.configure(image=self.my_image)
-                self.image_label.image = self.my_image  # Houd een referentie vast
-            time.sleep(0.05)  # Limit display thread to ~30 FPS
-        logging.info("Stopping display thread...")
+            self.set_label(self.percentage, f"{self.percentage_value}%")
+
+        box_no = state['current_box']
+        box1state = "filling" if box_no == 0 else "full"  #other states should be: empty, full or error
+        box2state = "full" if state['boxes_full'] else "filling"
+        self.set_label(self.boxstate_text1, f"box 1:\n status: {box1state}\n parts: {part_box_0['partcount']}\n layer: {part_box_0['layer_number']}")
+        if box_no == 1:
+            self.set_label(self.boxstate_text2, f"box 2:\n status: {box2state}\n parts: {part_box_1['partcount']}\n layer: {part_box_1['layer_number']}")
+
+
+    #configure the text of a label, only if it is different from what is shown
+    def set_label(self, label, text):
+        if self.shown.get(label) != text:
+            self.shown[label] = text
+            label.configure(text=text)
+
+
+
+    #updates images on the interface that have been taking by the camera. runs on the tk event loop.
+    #frames that are already shown are skipped. the frame is read without a copy, resized and converted to rgb
+    #in feed_buffer and pasted into the PhotoImage, so no images or buffers are created per frame
+    def update_live_feed(self):
+        camera_position = self.machine.camera
+        if not camera_position.display_thread_running:
+            logging.info("Stopping live feed...")
+            return
+
+        if camera_position.display_frame_seq() != self.feed_seq:
+            displayed = camera_position.get_display_frame(copy=False)   # never blocks the camera or vision threads
+            if displayed is not None:
+                cv2.resize(displayed.color, self.feed_size, dst=self.feed_buffer, interpolation=cv2.INTER_AREA)
+                #the frame is a view into the ring, only show it if it was not overwritten while resizing
+                if camera_position.display_frame_valid(displayed):
+                    cv2.cvtColor(self.feed_buffer, cv2.COLOR_BGR2RGB, dst=self.feed_buffer)
+                    self.feed_image.paste(Image.frombuffer("RGB", self.feed_size, self.feed_buffer, "raw", "RGB", 0, 1))
+                    self.feed_seq = displayed.seq
+
+        self.root.after(self.feed_interval, self.update_live_feed)
 
 
 
@@ -391,11 +417,14 @@ class UserInterface:
         # Camera View Section
         self.camview = customtkinter.CTkFrame(master=self.root, corner_radius=0, fg_color=self.background_color)
         self.camview.grid(row=0, column=1, padx=(20,0), pady=(30,0), sticky="")
-        self.light_image = Image.open("Regal_Rexnord_Corporation_logo.jpg")  
-        self.my_image = customtkinter.CTkImage(light_image=self.light_image, size=(640 / self.camscale, 420 / self.camscale))
-
-        self.image_label = customtkinter.CTkLabel(self.camview, image=self.my_image, text="")
-        self.image_label.image = self.my_image
+        #one PhotoImage for the live feed, new frames are pasted into it. starts with the logo
+        self.feed_size = (int(640 / self.camscale), int(420 / self.camscale))
+        self.feed_buffer = np.empty((self.feed_size[1], self.feed_size[0], 3), dtype=np.uint8)     #resized rgb frame
+        self.light_image = Image.open("Regal_Rexnord_Corporation_logo.jpg").convert("RGB").resize(self.feed_size)
+        self.feed_image = ImageTk.PhotoImage(self.light_image)
+
+        self.image_label = tk.Label(self.camview, image=self.feed_image, borderwidth=0, highlightthickness=0)
+        self.image_label.image = self.feed_image
         self.image_label.grid(row=0, column=0, padx=(20, 0), sticky="")
 
         self.boxstate = customtkinter.CTkLabel(self.camview, text="", fg_color="transparent")
@@ -444,15 +473,14 @@ class UserInterface:
         #stop threads, stop robot control, stop camera stream etc
         self.machine.camera.stop_display_thread()
         self.machine.stop()
-        self.display_thread.join()
         self.root.quit()
 
 
 
-    #update status text
+    #update status text. can be called from any thread, the label is updated on the tk thread
     def update_status(self, new_status):
         """Update the status text displayed at the top center."""
-        self.status_text.configure(text=new_status)
+        self.machine.state.set_status(new_status)
 
 
 
@@ -0,0 +1,157 @@
+import threading
+import heapq
+import logging
+import time
+from concurrent.futures import Future
+
+
+##########################
+#timed digital output writes on a timer thread, so vision and motion threads never sleep for io timing.
+#pulse() and sequence() queue writes with a due time and return a future that is done when the last write is done
+#(or has the RobotError of a failed write). writes are coalesced: a write of the state an output already has is
+#skipped, and a pulse on an output that is already pulsing only moves the end of the running pulse.
+##########################
+
+#queued write of one output. cancelled writes stay in the heap and are skipped
+class ScheduledWrite:
+    __slots__ = ("due", "order", "output_id", "state", "futures", "cancelled")
+
+    def __init__(self, due, order, output_id, state, futures):
+        self.due = due                  #time.monotonic() when the write is due
+        self.order = order              #writes with the same due time go in the order they were queued
+        self.output_id = output_id
+        self.state = state
+        self.futures = futures          #futures that are done after this write
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.due, self.order) < (other.due, other.order)
+
+
+class IOScheduler:
+    def __init__(self, write):
+        self.write = write                  #write(output_id, state), raises RobotError
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.queue = []                     #heap of ScheduledWrite
+        self.order = 0
+        self.outputs = {}                   #output_id -> last written state
+        self.pulse_ends = {}                #output_id -> write that ends the running pulse
+        self.running = False
+        self.thread = None
+
+
+    def start(self):
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+
+    #stops the timer thread. running pulses are ended right away so no output stays on, the other queued writes
+    #are dropped and their futures cancelled
+    def stop(self):
+        with self.lock:
+            self.running = False
+            pulse_ends = [write for write in self.pulse_ends.values() if not write.cancelled]
+            dropped = [write for write in self.queue if not write.cancelled and write not in pulse_ends]
+            self.queue = []
+            self.pulse_ends = {}
+            self.wakeup.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        self.thread = None
+        for write in dropped:
+            for future in write.futures:
+                future.cancel()
+        for write in pulse_ends:
+            self.execute(write)
+
+
+    #call after the output was written outside the scheduler, so coalescing knows the state
+    def written(self, output_id, state):
+        with self.lock:
+            self.outputs[output_id] = state
+
+
+    def add(self, delay, output_id, state, futures):
+        write = ScheduledWrite(time.monotonic() + delay, self.order, output_id, state, futures)
+        self.order += 1
+        heapq.heappush(self.queue, write)
+        return write
+
+
+    #output on now and off after duration seconds. a pulse on an output that is already pulsing ends at the
+    #later of both ends, the output is not switched in between
+    def pulse(self, output_id, duration):
+        self.start()
+        future = Future()
+        with self.lock:
+            running = self.pulse_ends.get(output_id)
+            end = time.monotonic() + duration
+            if running is not None and not running.cancelled:
+                if running.due >= end:
+                    running.futures.append(future)
+                    return future
+                running.cancelled = True
+                futures = running.futures + [future]
+            else:
+                self.add(0, output_id, True, [])
+                futures = [future]
+            self.pulse_ends[output_id] = self.add(duration, output_id, False, futures)
+            self.wakeup.notify_all()
+        return future
+
+
+    #writes (delay, output_id, state), delay in seconds from now. returns a future that is done after the last write
+    def sequence(self, steps):
+        self.start()
+        future = Future()
+        with self.lock:
+            steps = sorted(steps, key=lambda step: step[0])
+            for k, (delay, output_id, state) in enumerate(steps):
+                self.add(delay, output_id, state, [future] if k == len(steps) - 1 else [])
+            self.wakeup.notify_all()
+        if not steps:
+            future.set_result(None)
+        return future
+
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.running and (not self.queue or self.queue[0].due > time.monotonic()):
+                    timeout = self.queue[0].due - time.monotonic() if self.queue else None
+                    self.wakeup.wait(timeout)
+                if not self.running:
+                    return
+                write = heapq.heappop(self.queue)
+                if write.cancelled:
+                    continue
+                if self.pulse_ends.get(write.output_id) is write:
+                    del self.pulse_ends[write.output_id]
+            self.execute(write)
+
+
+    #writes one queued write unless the output already has that state, and completes its futures
+    def execute(self, write):
+        with self.lock:
+            skip = self.outputs.get(write.output_id) == write.state
+            self.outputs[write.output_id] = write.state     #already now, later writes coalesce against this one
+
+        error = None
+        if not skip:
+            try:
+                self.write(write.output_id, write.state)
+            except Exception as e:
+                logging.error(f"io scheduler: can not write output {write.output_id}: {e}")
+                error = e
+                with self.lock:
+                    self.outputs.pop(write.output_id, None)     #state unknown, the next write goes out
+        for future in write.futures:
+            if error is None:
+                future.set_result(write.state)
+            else:
+                future.set_exception(error)
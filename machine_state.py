@@ -0,0 +1,136 @@
+import queue
+import threading
+
+
+##########################
+#observable state of the boxing machine. the machine thread changes the state with the methods below and every
+#change is published as an event (name, data) to all subscribers. every subscriber has its own queue, so the machine
+#never waits for a subscriber. the user interface empties its queue on the tk thread with root.after.
+##########################
+
+#events
+RUN_STARTED = 'run started'         #data: snapshot of the state at the start of the run
+PLACEMENT_DONE = 'placement done'   #data: snapshot of the state after the placement
+BOX_CHANGED = 'box changed'         #data: index of the box that is being filled
+BOXES_FULL = 'boxes full'           #data: None
+STATUS = 'status'                   #data: status text
+ROBOT_ERROR = 'robot error'         #data: error text, the run stopped
+CONVEYOR = 'conveyor'               #data: (belt on, reason)
+MACHINE_PAUSED = 'machine paused'   #data: status text, the machine paused itself until the operator resumes
+MACHINE_STOPPED = 'machine stopped' #data: status text, the machine stopped the run itself
+
+
+class MachineState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = []
+        self.status = ""
+        self.reset()
+
+
+    #start of a new run, nothing placed yet
+    def reset(self):
+        with self.lock:
+            self.placements = 0         #placements since the start of the run
+            self.total_parts = 0        #parts per box
+            self.current_box = 0
+            self.last_parts = {}        #box index -> last placed part (dict from get_pack_pos)
+            self.boxes_full = False
+            self.conveyor_on = False
+            self.publish(RUN_STARTED, self.snapshot_locked())
+
+
+    #returns a queue that receives every event from now on
+    def subscribe(self):
+        events = queue.SimpleQueue()
+        with self.lock:
+            self.subscribers.append(events)
+        return events
+
+
+    def unsubscribe(self, events):
+        with self.lock:
+            if events in self.subscribers:
+                self.subscribers.remove(events)
+
+
+    #call with the lock held
+    def publish(self, event, data=None):
+        for events in self.subscribers:
+            events.put((event, data))
+
+
+    #copy of the state that can be read without the lock
+    def snapshot(self):
+        with self.lock:
+            return self.snapshot_locked()
+
+
+    def snapshot_locked(self):
+        return {
+            'placements': self.placements,
+            'total_parts': self.total_parts,
+            'current_box': self.current_box,
+            'last_parts': dict(self.last_parts),
+            'boxes_full': self.boxes_full,
+            'conveyor_on': self.conveyor_on,
+            'status': self.status,
+        }
+
+
+    def set_box(self, box_index, total_parts):
+        with self.lock:
+            self.total_parts = total_parts
+            if box_index != self.current_box:
+                self.current_box = box_index
+                self.publish(BOX_CHANGED, box_index)
+
+
+    def placement_done(self, box_index, part):
+        with self.lock:
+            self.placements += 1
+            self.last_parts[box_index] = part
+            self.publish(PLACEMENT_DONE, self.snapshot_locked())
+
+
+    def set_boxes_full(self):
+        with self.lock:
+            self.boxes_full = True
+            self.publish(BOXES_FULL)
+
+
+    #the conveyor scheduler switched the belt
+    def set_conveyor(self, on, reason):
+        with self.lock:
+            self.conveyor_on = on
+            self.publish(CONVEYOR, (on, reason))
+
+
+    #the run stopped on a robot error
+    def robot_error(self, message):
+        with self.lock:
+            self.status = f"robot error: {message}"
+            self.publish(ROBOT_ERROR, self.status)
+
+
+    #the machine paused itself (bad part, bad placement). the interface shows the pause, the operator resumes
+    def machine_paused(self, status):
+        with self.lock:
+            self.status = status
+            self.publish(MACHINE_PAUSED, status)
+
+
+    #the machine stopped the run itself (parts left in a box). the interface shows the stop
+    def machine_stopped(self, status):
+        with self.lock:
+            self.status = status
+            self.publish(MACHINE_STOPPED, status)
+
+
+    #status text. only published if it changed
+    def set_status(self, status):
+        with self.lock:
+            if status == self.status:
+                return
+            self.status = status
+            self.publish(STATUS, status)
@@ -1,8 +1,10 @@
 import tkinter as tk
 import interface
 
-root = tk.Tk()
-ui = interface.UserInterface(root)   
-                     
-root.mainloop()                
+#guarded: the inference process (spawn) imports this module again
+if __name__ == '__main__':
+    root = tk.Tk()
+    ui = interface.UserInterface(root)   
+                         
+    root.mainloop()                
                                                                                                 
\ No newline at end of file
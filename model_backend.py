@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import logging
+import torch
+from ultralytics import YOLO
+
+
+##########################
+#backends for the yolo model. 'torch' runs best.pt with pytorch (cuda if available), 'onnx' (onnx runtime) and
+#'openvino' (optionally int8 quantized) run an export of best.pt on the cpu. the export is made once with the
+#ultralytics exporter and cached next to the weights, it is made again when the weights are newer than the export.
+#the exporter writes into a temporary directory and the export is renamed into place when it is complete, so an
+#export that was interrupted is never taken for the cached one.
+#ultralytics loads an export with the same YOLO class, so predict() returns the same results for every backend and
+#the Detections do not change. the export has dynamic input shapes, for the micro batches and the belt input size
+##########################
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+#path of the cached export of the weights for a backend
+def export_path(weights_path, backend, int8=False):
+    base = os.path.splitext(weights_path)[0]
+    if backend == 'onnx':
+        return base + '.onnx'
+    if backend == 'openvino':
+        return base + ('_int8' if int8 else '') + '_openvino_model'
+    return weights_path
+
+
+#exports the weights for a backend unless the cached export is up to date. returns the path of the export.
+#int8_data is the dataset yaml with the calibration images of the int8 quantization, None = ultralytics default
+def export_model(weights_path, backend, int8=False, int8_data=None):
+    path = export_path(weights_path, backend, int8)
+    if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(weights_path):
+        return path
+
+    logging.info(f"exporting {weights_path} for {backend}{' int8' if int8 else ''}, this is only done once")
+    arguments = dict(format=backend, dynamic=True)
+    if backend == 'openvino' and int8:
+        arguments['int8'] = True
+        if int8_data is not None:
+            arguments['data'] = int8_data
+
+    #the exporter writes next to the weights it gets: export a copy in a temporary directory on the same disk
+    work_dir = tempfile.mkdtemp(prefix='.export_', dir=os.path.dirname(os.path.abspath(weights_path)))
+    try:
+        weights_copy = os.path.join(work_dir, os.path.basename(weights_path))
+        shutil.copy2(weights_path, weights_copy)
+        exported = os.path.normpath(str(YOLO(weights_copy).export(**arguments)))
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(exported, path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return path
+
+
+#(path, backend) of the model file to load: the export for the backend, made now if needed. an export that fails
+#is logged and the weights are run with torch. call this where a long export can not run into a timeout
+def model_file(weights_path, backend='torch', int8=False, int8_data=None):
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown inference backend {backend!r}, use one of {BACKENDS}")
+    if backend == 'torch':
+        return weights_path, 'torch'
+    try:
+        return export_model(weights_path, backend, int8, int8_data), backend
+    except Exception as e:
+        logging.error(f"can not export {weights_path} for {backend}: {e}, using torch")
+        return weights_path, 'torch'
+
+
+#returns (model, device) for a path from model_file
+def open_model(path, backend):
+    if backend == 'torch':
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        return YOLO(path).to(device), device
+    logging.info(f"yolo backend {backend}: {path}")
+    return YOLO(path, task='detect'), 'cpu'
+
+
+#returns (model, device), exports the weights first if the backend needs it
+def load_model(weights_path, backend='torch', int8=False, int8_data=None):
+    return open_model(*model_file(weights_path, backend, int8, int8_data))
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+
+##########################
+#asyncio orchestration of a machine run. the run is a coroutine on an event loop in a daemon thread. blocking stages
+#(rtde moves, camera frames, yolo) run in a thread pool and are awaited with stage(). the orchestrator owns the pause
+#and stop state of the run: the run awaits wait_resumed() between the stages, the stages call checkpoint() between
+#their moves, both wake up on resume and on stop without polling. stop marks the run as stopped and cancels the run
+#task: the run ends right away, the stage that is still running in the pool gives up at its next checkpoint and
+#on_cancel stops the robot. the next run waits until that stage and on_cancel are done, so nothing of a stopped run
+#drives the robot during the next one.
+#the frame grabber, inference worker, conveyor, io scheduler and robot state cache keep their own threads, the run
+#awaits their futures and events inside the stages
+##########################
+
+#the run was stopped (stop button, interface flag or a stage that noticed the stop)
+class RunStopped(Exception):
+    pass
+
+
+class Orchestrator:
+    def __init__(self, on_cancel=None, workers=2):
+        self.on_cancel = on_cancel      #called in a pool thread when a run is cancelled
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stage')
+        self.cancel_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cancel')  #the stage pool can be busy with the stage that has to give up
+        self.pending = set()            #stage and on_cancel futures that are still running, only used on the loop
+        self.run_task = None
+
+        #pause and stop state for the stages in the pool threads
+        self.condition = threading.Condition()
+        self.paused = False
+        self.stopped = False            #the run was stopped, reset when the next run starts
+
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.run_loop, daemon=True)
+        self.loop_thread.start()
+        self.resumed = asyncio.run_coroutine_threadsafe(self.create_resumed(), self.loop).result()   #set while not paused
+
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+    async def create_resumed(self):
+        resumed = asyncio.Event()
+        resumed.set()
+        return resumed
+
+
+    #runs coroutine_function(*args) as the run task and blocks until it ends. raises RunStopped when the run was
+    #stopped, other exceptions of the run are raised as they are
+    def run(self, coroutine_function, *args):
+        future = asyncio.run_coroutine_threadsafe(self.supervise(coroutine_function, *args), self.loop)
+        try:
+            return future.result()
+        except CancelledError:
+            raise RunStopped("run cancelled")
+
+
+    async def supervise(self, coroutine_function, *args):
+        #a stopped run can still be ending, and a stage of it can still be giving up in the pool
+        if self.run_task is not None:
+            await asyncio.wait([self.run_task])
+        if self.pending:
+            waiting = [asyncio.wrap_future(future) for future in self.pending]
+            await asyncio.wait(waiting)
+            for future in waiting:
+                if not future.cancelled():
+                    future.exception()      #the stage gave up with RunStopped, nobody awaits it anymore
+        with self.condition:
+            self.stopped = False
+        self.run_task = asyncio.current_task()
+        try:
+            return await coroutine_function(*args)
+        finally:
+            self.run_task = None
+
+
+    #stops the run, does not wait. safe to call from any thread, also from a stage: its next checkpoint raises
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.loop.call_soon_threadsafe(self.cancel_run)
+
+
+    def cancel_run(self):
+        if self.run_task is None or self.run_task.done():
+            return
+        logging.info("orchestrator: run cancelled")
+        self.run_task.cancel()
+        if self.on_cancel is not None:
+            future = self.cancel_executor.submit(self.cancelled)
+            self.pending.add(future)
+            future.add_done_callback(self.stage_done)
+
+
+    def cancelled(self):
+        try:
+            self.on_cancel()
+        except Exception as e:
+            logging.error(f"orchestrator: error while cancelling the run: {e}")
+
+
+    def pause(self):
+        with self.condition:
+            self.paused = True
+        self.loop.call_soon_threadsafe(self.resumed.clear)
+
+
+    def resume(self):
+        with self.condition:
+            self.paused = False
+            self.condition.notify_all()
+        self.loop.call_soon_threadsafe(self.resumed.set)
+
+
+    #returns right away while not paused
+    async def wait_resumed(self):
+        await self.resumed.wait()
+
+
+    #checkpoint of a stage (pool thread). blocks while paused, raises RunStopped when the run was stopped
+    def checkpoint(self):
+        with self.condition:
+            self.condition.wait_for(lambda: self.stopped or not self.paused)
+            if self.stopped:
+                raise RunStopped("run stopped")
+
+
+    #runs function in the pool and waits for it. when the run is cancelled meanwhile, the run does not wait: the
+    #function keeps running until it notices the stop
+    async def stage(self, function, *args, **kwargs):
+        future = self.executor.submit(function, *args, **kwargs)
+        self.pending.add(future)
+        future.add_done_callback(self.stage_done)
+        return await asyncio.wrap_future(future)
+
+
+    #called in the pool thread
+    def stage_done(self, future):
+        self.loop.call_soon_threadsafe(self.pending.discard, future)
@@ -0,0 +1,113 @@
+import logging
+from functools import lru_cache
+from math import floor
+import numpy as np
+from part_profiles import get_profile
+
+
+##########################
+#packing plan: the place position of every part in every box, as one structured numpy array with shape
+#(boxes, layers, 4 slots). a part is a record with the same fields as the old dicts (part['position'], part['rotation'],
+#...), so the main loop and place_part use it the same way. the offsets per box and slot come from the tables below
+#and the part profile. plans are cached per part type and geometry, plan.part(box, layer, slot) is a plain index into the array.
+##########################
+
+PLAN_DTYPE = np.dtype([
+    ('box_number', np.int32),
+    ('part_number', np.int32),      #1, 2, ... per box
+    ('layer_number', np.int32),     #1, 2, ... from the bottom
+    ('slot', np.int32),             #0 top left, 1 top right, 2 bottom left, 3 bottom right
+    ('position', np.float64, 3),    #x, y, z of the part center
+    ('rotation', np.int32),         #degrees
+    ('partcount', np.int32),        #parts in the box after this placement
+    ('top_layer', np.bool_),
+])
+
+SLOTS = 4
+
+#rotation per slot
+SLOT_ROTATIONS = np.array([0, -90, 90, 180])
+
+#side of the box per slot, sign of the x and y direction from the box center
+SLOT_SIDES = np.array([[-1, -1], [1, -1], [-1, 1], [1, 1]])
+
+#the long side of the part lies along x in slots 0 and 3 and along y in slots 1 and 2
+SLOT_LONG_SIDE_X = np.array([True, False, False, True])
+
+#direction of place_extra_offset per slot, away from the side the part is placed from
+SLOT_EXTRA = np.array([[1, 0], [0, 1], [0, -1], [-1, 0]])
+
+#distance in meters from the box wall per box and slot (x, y), tuned on the cell
+WALL_OFFSETS = np.array([
+    [[0.010, 0.009], [0.013, 0.004], [0.013, 0.010], [0.013, 0.015]],  #box 0
+    [[0.006, 0.015], [0.009, 0.013], [0.006, 0.007], [0.008, 0.006]],  #box 1
+])
+
+
+class PackingPlan:
+    def __init__(self, parts):
+        self.parts = parts          #(boxes, layers, slots) array of PLAN_DTYPE, read only
+
+    def __len__(self):
+        return self.parts.size
+
+    #parts per box in placing order, list of 1d views into the plan
+    @property
+    def boxes(self):
+        return [box.reshape(-1) for box in self.parts]
+
+    #part at box index, layer number (from 1) and slot
+    def part(self, box, layer, slot):
+        return self.parts[box, layer - 1, slot]
+
+    #part with part number (from 1) in a box, for resuming in the middle of a box
+    def part_number(self, box, part_number):
+        return self.parts[box].reshape(-1)[part_number - 1]
+
+
+def get_packing_plan(item_type, box_centers, box_size, part_size):
+    return build_packing_plan(item_type, tuple(tuple(float(v) for v in center) for center in box_centers),
+                              tuple(float(v) for v in box_size), tuple(float(v) for v in part_size))
+
+
+@lru_cache(maxsize=32)
+def build_packing_plan(item_type, box_centers, box_size, part_size):
+    box_length, box_width, box_height = box_size
+    part_length, part_width, part_height = part_size
+    boxes = len(box_centers)
+    if boxes > len(WALL_OFFSETS):
+        raise ValueError(f"packing plan has wall offsets for {len(WALL_OFFSETS)} boxes, not {boxes}")
+    layers = floor(box_height / part_height)
+    logging.info(f"packing plan for {item_type}: {boxes} boxes, {layers} layers of {SLOTS} parts")
+
+    profile = get_profile(item_type)
+    place_extra_offset = profile.place_extra_offset
+    first_layer, other_layers = profile.z_offsets_mm
+
+    #x, y per box and slot, (boxes, slots, 2)
+    centers = np.array(box_centers)
+    half_part = np.where(SLOT_LONG_SIDE_X[:, None], [part_length / 2, part_width / 2], [part_width / 2, part_length / 2])
+    from_wall = np.array([box_length / 2, box_width / 2]) - half_part - WALL_OFFSETS[:boxes]
+    xy = centers[:, None, :2] + SLOT_SIDES * from_wall + SLOT_EXTRA * place_extra_offset
+    for (box, slot), shift in profile.part_shifts:
+        if box < boxes:
+            xy[box, slot] += shift
+
+    #z per box, layer and slot, (boxes, layers, slots)
+    layer_index = np.arange(layers)
+    z_offsets = np.where((layer_index == 0)[:, None], first_layer, other_layers) / 1000
+    z = centers[:, 2, None, None] + layer_index[None, :, None] * part_height + z_offsets[None]
+
+    parts = np.zeros((boxes, layers, SLOTS), dtype=PLAN_DTYPE)
+    part_numbers = np.arange(1, layers * SLOTS + 1).reshape(layers, SLOTS)
+    parts['box_number'] = np.arange(boxes)[:, None, None]
+    parts['part_number'] = part_numbers
+    parts['layer_number'] = layer_index[:, None] + 1
+    parts['slot'] = np.arange(SLOTS)
+    parts['position'][..., :2] = xy[:, None]
+    parts['position'][..., 2] = z
+    parts['rotation'] = SLOT_ROTATIONS
+    parts['partcount'] = part_numbers * profile.parts_per_layer
+    parts['top_layer'] = (layer_index == layers - 1)[:, None]
+    parts.flags.writeable = False
+    return PackingPlan(parts)
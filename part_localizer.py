@@ -0,0 +1,55 @@
+import numpy as np
+from pose_math import pose_to_matrix
+
+
+##########################
+#3d localization of detections with the aligned depth frame. the depth of a part is the median of a small patch just
+#inside the edge of its box (zeros are missing depth and are skipped), so one bad pixel or the belt behind the edge
+#does not matter. the pixel is deprojected through the color intrinsics (pinhole, same as rs2_deproject_pixel_to_point
+#without distortion, the color stream of the d4xx has none) and moved to robot coordinates with the camera pose:
+#robot_T_camera = capture pose (tcp) * camera_extrinsic (camera in the tcp frame, from the hand-eye calibration)
+##########################
+class PartLocalizer:
+    def __init__(self, intrinsics, tcp_pose, camera_extrinsic, patch_rows=9, patch_columns=6, inset=3, min_valid=0.3):
+        self.fx, self.fy = intrinsics.fx, intrinsics.fy
+        self.ppx, self.ppy = intrinsics.ppx, intrinsics.ppy
+        self.camera_pose = pose_to_matrix(tcp_pose) @ pose_to_matrix(camera_extrinsic)     #camera in robot coordinates
+        self.patch_rows = patch_rows        #rows sampled over the middle half of the box height
+        self.patch_columns = patch_columns  #columns next to the edge
+        self.inset = inset                  #pixels between the box edge and the patch, boxes are a bit loose
+        self.min_valid = min_valid          #part of the patch that needs a depth value
+
+
+    #median depth in meters of the patch along the left edge of every box, (N, 4) -> (N,). nan without enough depth
+    def patch_depth(self, depth, depth_scale, boxes):
+        boxes = np.asarray(boxes)
+        height, width = depth.shape
+        fractions = np.linspace(0.25, 0.75, self.patch_rows)
+        rows = boxes[:, 1, None] + (boxes[:, 3] - boxes[:, 1])[:, None] * fractions            #(N, rows)
+        columns = boxes[:, 0, None] + self.inset + np.arange(self.patch_columns)               #(N, columns)
+        rows = np.clip(rows.astype(np.int64), 0, height - 1)
+        columns = np.clip(columns, 0, width - 1)
+        patch = depth[rows[:, :, None], columns[:, None, :]].reshape(len(boxes), -1).astype(float)
+        valid = patch > 0
+        patch[~valid] = np.nan
+        enough = valid.mean(axis=1) >= self.min_valid
+        result = np.full(len(boxes), np.nan)
+        if np.any(enough):
+            result[enough] = np.nanmedian(patch[enough], axis=1) * depth_scale
+        return result
+
+
+    #pixels with depth to points in the camera frame, (N,) x3 -> (N, 3)
+    def deproject(self, xp, yp, z):
+        xp = np.asarray(xp, dtype=float)
+        yp = np.asarray(yp, dtype=float)
+        return np.stack([(xp - self.ppx) / self.fx * z, (yp - self.ppy) / self.fy * z, z], axis=-1)
+
+
+    #robot coordinates of the pixels xp, yp of every box, (N, 3). rows without depth are nan
+    def locate(self, frame, boxes, xp, yp):
+        if frame.depth is None or not len(boxes):
+            return np.full((len(boxes), 3), np.nan)
+        z = self.patch_depth(frame.depth, frame.depth_scale, boxes)
+        points = self.deproject(xp, yp, z)
+        return points @ self.camera_pose[:3, :3].T + self.camera_pose[:3, 3]
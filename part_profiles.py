@@ -0,0 +1,83 @@
+from collections import namedtuple
+
+
+##########################
+#part type profiles: every tuned value that depends on the part type, one immutable record per part type. the vision,
+#pick, packing plan and placement code look the profile up once and read the values from it, so a new part type is
+#a new entry in PART_PROFILES. the keys are the class names of the detection model.
+#lengths in meters unless the name says mm, angles in degrees
+##########################
+PartProfile = namedtuple('PartProfile', [
+    'name',
+    'big',                      #big parts (Big-Blue, Holed) or small parts (Green, Rubber, Small-Blue)
+    'thickness',                #height of one part in the box, one layer
+
+    #vision
+    'pixel_width',              #width of one part on the belt in the camera image, pixels
+    'extra_small_counts',       #part counts on the belt (besides 14 and 15) that get the small extra length, None = always
+    'extra_big_counts',         #part counts on the belt (besides 9 and 10) that get the big extra length, None = always
+
+    #pick
+    'belt_z',                   #z of the pickup tcp at the belt
+    'pick_length',              #length of the row of parts, the gripper slides this far under the parts
+    'pick_rotate',              #rotation about x of the tool before going down to the belt
+    'pick_speed',               #(speed, acc) of the slow pick movements
+    'pickup_speed',             #(speed, acc) while sliding under the parts
+    'pick_z_up_mm',             #z up while rotating back after the pickup
+    'pick_x_back_mm',           #x back after rotating back
+
+    #packing plan
+    'parts_per_layer',          #parts in a box per layer of 4 places, for the part count
+    'place_extra_offset',       #distance from the wall side the part is placed from
+    'z_offsets_mm',             #z offset per slot because the box is not level: (first layer, other layers)
+    'part_shifts',              #extra (x, y) per (box, slot): ((box, slot), (x, y)) pairs
+
+    #placement
+    'place_speed',              #(speed, acc) of the placing movements
+    'place_tilt',               #rotation about x before going down into the box: (other layers, top layer)
+    'place_z_mm',               #z above the place position: (low side of the box, angled side)
+    'place_rotate_x',           #rotation about x while sliding the parts into place
+    'place_rotate_y',           #rotation about y towards the high side of the box: (layers below 7, layers from 7)
+    'place_side_offset_mm',     #sideways offset while sliding in when rotated about y
+    'place_z_up_mm',            #z up while sliding towards the high side: (layers below 7, layers from 7)
+    'place_rotate_last',        #rotation about x for the last placing movement
+    'check_rotated',            #check the placement with the camera after a 180 degree placement
+])
+
+
+#values shared by the big and the small parts, tuned on the cell
+BIG = dict(big=True, extra_small_counts=(), extra_big_counts=(),
+           pick_rotate=-23, pick_speed=(1, 0.8), pickup_speed=(2, 1.5), pick_z_up_mm=2, pick_x_back_mm=4,
+           parts_per_layer=7, place_extra_offset=6/1000, part_shifts=(),
+           place_speed=(2, 1.5), place_tilt=(-8, -4), place_z_mm=(3, 6), place_rotate_x=-23, place_rotate_y=(5, 3),
+           place_side_offset_mm=0, place_z_up_mm=(5, 4), place_rotate_last=-10, check_rotated=True)
+
+SMALL = dict(big=False, pixel_width=14.25, extra_small_counts=(), extra_big_counts=(),
+             belt_z=-123.5/1000, pick_length=0.1794 + 5.5/1000,
+             pick_rotate=-14, pick_speed=(1, 0.8), pickup_speed=(0.08, 0.1), pick_z_up_mm=7, pick_x_back_mm=12,
+             parts_per_layer=12, place_extra_offset=6/1000, z_offsets_mm=([-1, -1, -5, -2], [-2, -2, -5, -2]), part_shifts=(),
+             place_speed=(0.6, 0.6), place_tilt=(-2, -2), place_z_mm=(-3, -1), place_rotate_x=-18, place_rotate_y=(2, 1),
+             place_side_offset_mm=5, place_z_up_mm=(6, 6), place_rotate_last=-15, check_rotated=False)
+
+
+PART_PROFILES = {profile.name: profile for profile in [
+    PartProfile(**{**BIG, 'name': 'Big-Blue', 'thickness': 0.01260, 'pixel_width': 24.4, 'extra_big_counts': None,
+                   'belt_z': -119/1000, 'pick_length': 0.184, 'pick_speed': (1.5, 1), 'place_extra_offset': 4/1000,
+                   'z_offsets_mm': ([-4, -4, -4, -4], [-4, -4, -4, -4]),
+                   'pick_z_up_mm': 7}),      #runs with the small part value on the cell
+    PartProfile(**{**BIG, 'name': 'Holed', 'thickness': 0.0085, 'pixel_width': 23.75, 'extra_big_counts': (11,),
+                   'belt_z': -122/1000, 'pick_length': 0.174,
+                   'z_offsets_mm': ([-6, -6, -6, -6], [-6, -6, -6, -6])}),
+    PartProfile(**{**SMALL, 'name': 'Green', 'thickness': 0.009, 'extra_small_counts': (16,)}),
+    PartProfile(**{**SMALL, 'name': 'Rubber', 'thickness': 0.01055, 'extra_small_counts': None}),
+    PartProfile(**{**SMALL, 'name': 'Small-Blue', 'thickness': 0.009, 'extra_small_counts': None,
+                   'part_shifts': (((0, 1), (-0.003, 0)), ((1, 1), (-0.004, 0)), ((1, 2), (0.009, 0))),
+                   'place_rotate_y': (5, 3), 'place_side_offset_mm': 0}),      #runs with the big part values on the cell
+]}
+
+
+def get_profile(part_type):
+    profile = PART_PROFILES.get(part_type)
+    if profile is None:
+        raise ValueError(f"no part profile for part type {part_type!r}")
+    return profile
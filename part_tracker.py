@@ -0,0 +1,130 @@
+import numpy as np
+
+
+##########################
+#tracks detections across camera frames. every new frame is matched to the existing tracks by box overlap (iou),
+#greedy with the best overlap first. every track has its own velocity and counts the updates it stood still, so two
+#parts in the same row never share state. the speed is measured over the capture time between two updates, so it
+#does not depend on how many camera frames the detection skipped (slow cpu inference skips many): a part is stationary
+#when it moved less than max_speed pixels per second in stable_updates tracker updates in a row and did not drift
+#more than max_drift pixels in that time. updates more than max_gap seconds apart start counting again.
+##########################
+class Track:
+    __slots__ = ("track_id", "box", "point", "velocity", "anchor", "still_updates", "seq", "timestamp", "missed", "class_id")
+
+    def __init__(self, track_id, box, point, seq, timestamp, class_id):
+        self.track_id = track_id
+        self.box = box                  #last box (x1, y1, x2, y2)
+        self.point = point              #last pick point (x_left, y_middle)
+        self.velocity = np.zeros(2)     #pixels per second, smoothed. only for display, stability uses the raw motion
+        self.anchor = point             #point where the part stopped moving
+        self.still_updates = 0          #updates in a row without motion
+        self.seq = seq                  #frame seq of the last update
+        self.timestamp = timestamp      #capture time of the frame of the last update
+        self.missed = 0                 #updates in a row without a matching detection
+        self.class_id = class_id
+
+
+#overlap of every box in a with every box in b, (N, 4) and (M, 4) -> (N, M)
+def box_iou(a, b):
+    a = np.asarray(a, dtype=np.float32)[:, None, :]
+    b = np.asarray(b, dtype=np.float32)[None, :, :]
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = width * height
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-6)
+
+
+class PartTracker:
+    def __init__(self, stable_updates=3, max_speed=30.0, max_drift=6, min_iou=0.3, max_missed=5, max_gap=2.0, smoothing=0.5):
+        self.stable_updates = stable_updates    #updates without motion before a part counts as stationary
+        self.max_speed = max_speed          #pixels per second that still count as not moving
+        self.max_drift = max_drift          #pixels a stationary part may move away from where it stopped
+        self.min_iou = min_iou              #minimum overlap to match a detection to a track
+        self.max_missed = max_missed        #tracks are dropped after this many updates without a detection
+        self.max_gap = max_gap              #more seconds than this between updates: start counting again
+        self.smoothing = smoothing          #weight of the newest velocity measurement
+        self.tracks = []
+        self.next_id = 1
+
+
+    def reset(self):
+        self.tracks = []
+
+
+    #match the detections of one frame to the tracks. timestamp is the capture time of the frame in seconds.
+    #returns an array with the track id of every detection
+    def update(self, detections, seq, timestamp):
+        points = np.stack([detections.x_left, detections.y_middle], axis=-1).astype(float)
+        track_ids = np.zeros(len(detections), dtype=np.int64)
+        matched = np.zeros(len(self.tracks), dtype=bool)
+
+        if len(self.tracks) and len(detections):
+            iou = box_iou(detections.boxes, [track.box for track in self.tracks])
+            #greedy assignment, best overlap first
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                k, t = np.unravel_index(flat, iou.shape)
+                if iou[k, t] < self.min_iou:
+                    break
+                if track_ids[k] or matched[t]:
+                    continue
+                self.update_track(self.tracks[t], detections.boxes[k], points[k], seq, timestamp, int(detections.classes[k]))
+                track_ids[k] = self.tracks[t].track_id
+                matched[t] = True
+
+        #tracks without a detection in this frame
+        for t, track in enumerate(self.tracks):
+            if not matched[t]:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        #new tracks for detections that did not match
+        for k in np.flatnonzero(track_ids == 0):
+            track = Track(self.next_id, detections.boxes[k], points[k], seq, timestamp, int(detections.classes[k]))
+            self.next_id += 1
+            self.tracks.append(track)
+            track_ids[k] = track.track_id
+        return track_ids
+
+
+    def update_track(self, track, box, point, seq, timestamp, class_id):
+        elapsed = timestamp - track.timestamp
+        if seq == track.seq:
+            #same frame again, nothing new about the motion
+            pass
+        elif elapsed <= 0 or elapsed > self.max_gap:
+            #too long ago to say anything about the motion in between
+            track.velocity = np.zeros(2)
+            track.anchor = point
+            track.still_updates = 0
+        else:
+            measured = (point - track.point) / elapsed
+            track.velocity = self.smoothing * measured + (1 - self.smoothing) * track.velocity
+            moving = np.linalg.norm(measured) > self.max_speed
+            drifted = np.linalg.norm(point - track.anchor) > self.max_drift
+            if moving or drifted:
+                track.anchor = point
+                track.still_updates = 0
+            else:
+                track.still_updates += 1
+        track.box = box
+        track.point = point
+        track.seq = seq
+        track.timestamp = timestamp
+        track.missed = 0
+        track.class_id = class_id
+
+
+    def get(self, track_id):
+        for track in self.tracks:
+            if track.track_id == track_id:
+                return track
+        return None
+
+
+    #true if the part of this track did not move for stable_updates tracker updates
+    def is_stationary(self, track_id):
+        track = self.get(track_id)
+        return track is not None and track.still_updates >= self.stable_updates
@@ -1,4 +1,6 @@
 from UR5E_control import URControl
+from pose_math import pose_trans, tcp_change
+from part_profiles import get_profile
 import math
 import logging
 import numpy as np
@@ -10,30 +12,152 @@ class Pick_parts():
         self.robot = robot  #robot class
         self.boxing_machine = boxing_machine
 
+        #compiled pick path per part type. the path is affine in part_x and part_y, so it is stored as
+        #base + part_x * gain_x + part_y * gain_y (all (10, 9) arrays)
+        self.templates = {}
+
+        #waypoints (rows of the pick path) that may be blended in single path mode: end of step 7, step 8 and step 9.
+        #steps 1 till 6 stay exact, that is where the gripper goes down to the belt and slides under the parts
+        self.blend_safe_steps = (6, 7, 8)
+        self.max_blend = 0.05       #max blend radius in meters
+        self.blend_fraction = 0.4   #blend radius as part of the shortest neighbouring segment, < 0.5 so blends never overlap
+        self.single_path = single_path_pick
+
+        #planned pose of the pickup tcp at the end of the last pick, the placement starts from here.
+        #None if the pick did not finish
+        self.end_pose = None
+
+        #a measured pick z further than this from the fixed belt z of the part type is not trusted
+        self.max_z_correction = 10/1000
+
 
     #picks parts from given x and y coordinate. y = center of part along y axis. x = edge of part closest to the robot
-    def pick_parts(self, part_x, part_y,part_type='Green'):
-        self.robot.set_tool_frame(pickup_tcp)
+    #part_z = measured top of the parts from the 3d localization, None = fixed belt z of the part type
+    def pick_parts(self, part_x, part_y,part_type='Green', part_z=None):
+        self.end_pose = None
+        pick_z = self.get_pick_z(part_type, part_z)
+        if self.single_path:
+            #whole pick in one blended path, the robot does not stop between the old segments
+            path = self.get_single_pick_path(part_x, part_y, part_type, pick_z)
+            self.boxing_machine.wait_if_paused()
+            self.robot.set_tcp(pickup_tcp)
+            self.robot.move_l_path(path=path.tolist())
+            self.end_pose = list(path[-1, :6])
+            return
+
+        path = self.get_pick_path(part_x, part_y, part_type, pick_z)
+
+        self.boxing_machine.wait_if_paused()
+
+        #move path 1 till 3 with pickup tcp
+        self.robot.set_tcp(pickup_tcp)
+        self.robot.move_l_path(path=path[0:3].tolist())
 
+        #move path 4 till 6 with pickup tcp
+        self.robot.move_l_path(path=path[3:6].tolist())
+
+        '''rotate tcp'''
+        #step 7
+        #rotate back. pose is computed, no need to read the robot position
+        self.robot.set_tcp(rotate_tcp)
+        logging.info('perform step 7')
+        step_7 = path[6]
+        self.robot.move_l(step_7[:6].tolist(), step_7[6], step_7[7])
+        '''end rotate tcp'''
+
+        '''start pickup tcp'''
+        self.robot.set_tcp(pickup_tcp)
+        if self.boxing_machine.stop_main_loop:
+            return 
+        self.boxing_machine.wait_if_paused()
+        self.robot.move_l_path(path=path[7:10].tolist())
+        self.end_pose = list(path[-1, :6])
+        '''end pickup tcp'''
+
+
+    #z of the pickup tcp in step 3 (gripper at the belt). from the measured top of the parts if there is one
+    def get_pick_z(self, part_type, part_z=None):
+        belt_z = self.belt_z(part_type)
+        if part_z is None or pick_z_from_top is None:
+            return belt_z
+        pick_z = part_z + pick_z_from_top
+        if abs(pick_z - belt_z) > self.max_z_correction:
+            logging.error(f"measured pick z {pick_z:.4f} too far from belt z {belt_z:.4f}, using belt z")
+            return belt_z
+        return pick_z
+
+
+    #fixed belt z location per part type, for some parts the gripper needs to be a little bit higher or lower
+    def belt_z(self, part_type):
+        return get_profile(part_type).belt_z
+
+
+    #returns the (10, 9) pick path for a part at part_x, part_y: rows [x, y, z, rx, ry, rz, speed, acc, blend]
+    #rows 0-5 and 7-9 are poses of the pickup tcp, row 6 (step 7) is a pose of the rotate tcp
+    def get_pick_path(self, part_x, part_y, part_type, pick_z=None):
+        if pick_z is None:
+            pick_z = self.belt_z(part_type)
+        template = self.templates.get(part_type)
+        if template is None:
+            template = self.compile_template(part_type)
+            self.templates[part_type] = template
+        base, gain_x, gain_y, gain_z = template
+        return base + part_x * gain_x + part_y * gain_y + pick_z * gain_z
+
+
+    #same path as get_pick_path, but every row is a pose of the pickup tcp so the pick can be sent as one path.
+    #step 7 used to rotate about the rotate tcp; with the pickup tcp the end pose is the same, the path in between
+    #differs by less than half a millimeter for the 7 degree rotation
+    def get_single_pick_path(self, part_x, part_y, part_type, pick_z=None):
+        path = self.get_pick_path(part_x, part_y, part_type, pick_z)
+        path[6, :6] = pose_trans(path[6, :6], tcp_change(rotate_tcp, pickup_tcp), constant=True)
+        path[:, 8] = self.auto_blend(path)
+        return path
+
+
+    #blend radius per waypoint from the segment lengths. only waypoints in blend_safe_steps get blended,
+    #pure rotations (no tcp travel) can not be blended. the last waypoint always stops
+    def auto_blend(self, path):
+        lengths = np.linalg.norm(np.diff(path[:, :3], axis=0), axis=1)     #lengths[k]: row k to row k+1
+        blends = path[:, 8].copy()
+        for k in self.blend_safe_steps:
+            if 0 < k < len(path) - 1:
+                blend = min(self.max_blend, self.blend_fraction * min(lengths[k - 1], lengths[k]))
+                blends[k] = blend if blend >= 0.001 else 0.0
+        blends[-1] = 0.0
+        return blends
+
+
+    #all rotations in the pick path are constant and all translations follow part_x/part_y/pick_z linearly,
+    #so the template is found by planning the path at four points (in one pass)
+    def compile_template(self, part_type):
+        base, at_x, at_y, at_z = self.plan_pick_path(np.array([0.0, 1.0, 0.0, 0.0]), np.array([0.0, 0.0, 1.0, 0.0]),
+                                                     part_type, np.array([0.0, 0.0, 0.0, 1.0]))
+        gain_x = at_x - base
+        gain_y = at_y - base
+        gain_z = at_z - base
+        logging.info(f"compiled pick path template for {part_type}")
+        return base, gain_x, gain_y, gain_z
+
+
+    #plans the complete pick path without any robot communication. used to compile the templates.
+    #part_x, part_y and pick_z can be arrays, then the paths of all positions are returned as an (N, 10, 9) array
+    def plan_pick_path(self, part_x, part_y, part_type, pick_z=None):
         #start rotation, this is aligned to the belt
         start_rotation = [2.211, 2.228, 0.013]
 
+        #tuned values of the part type
+        profile = get_profile(part_type)
+
         #fast and slow speeds and accelerations. fast for general movements, slow for special movements. 
         speed_middle = 1
         acc_middle = 1
 
-        if part_type == 'Big-Blue':
-            speed_slow = 1.5
-            acc_slow = 1
-        else:
-            speed_slow = 1
-            acc_slow = 0.8            
+        speed_slow, acc_slow = profile.pick_speed
 
 
         #part length, some parts are a bit shorter so robot has to move less
-        if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': part_length = 0.1794 + 5.5/1000
-        elif part_type == 'Big-Blue': part_length = 0.184
-        else: part_length = 0.174
+        part_length = profile.pick_length
 
 
 
@@ -45,18 +169,14 @@ class Pick_parts():
 
         '''STEP 2 ROTATION'''
         #rotation about x of tool, for narrow parts the rotation needs to be a bit more
-        if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': 
-            rotate = -14
-        else: rotate = -23
+        rotate = profile.pick_rotate
         rotate_x = [0,0,0,math.radians(rotate),math.radians(0.5),math.radians(0)]   
 
 
         '''STEP 3 Z LOCATION'''
-        #belt z location, for some parts the gripper needs to be a little bit higher or lower
-        if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': belt_z = [0,0,-123.5/1000,0,0,0]
-        elif part_type == 'Big-Blue': belt_z = [0,0,-119/1000,0,0,0]
-        elif part_type == 'Holed': belt_z = [0,0,-122/1000,0,0,0]   
-        logging.info(f"belt z: {belt_z} {part_type}") 
+        #belt z location, fixed per part type or from the measured top of the parts
+        if pick_z is None:
+            pick_z = profile.belt_z
 
 
 
@@ -66,18 +186,12 @@ class Pick_parts():
 
 
         '''STEP 5 MOVE BACK A BIT WHILE ROTATING BACK'''
-        #small x offset for narrow parts
-        if part_type != 'Big-BLue' and part_type != 'Holed':    #small parts
-            step_5_x_back = 0/1000            #was 11
-            step_5_z_up = 7/1000   
-        else:                       #big partss
-            step_5_x_back = 0/1000
-            step_5_z_up = 2/1000  
+        step_5_x_back = 0/1000            #was 11
+        step_5_z_up = profile.pick_z_up_mm/1000
 
 
         '''STEP 6 MOVE BACK A BIT MORE'''
-        if part_type != 'Big-Blue' and part_type != 'Holed': step_6_x_back=[12/1000,0,0,0,0,0]   #was 6 #smaal parts
-        else: step_6_x_back=[4/1000,0,0,0,0,0]  #was 2  #big parts
+        step_6_x_back=[profile.pick_x_back_mm/1000,0,0,0,0,0]
         '''END PATH'''
 
 
@@ -96,226 +210,112 @@ class Pick_parts():
 
 
 
-        #get current robot position
-        self.robot.set_tcp(pickup_tcp)
-        speed_acc_blend = [1,1,0.45]
-        start_pos = self.robot.get_tcp_pos()
-        for y in speed_acc_blend:
-            start_pos.append(y)
-
-
-
         '''start moving etc'''
+        #all steps are computed for every part_x, part_y at once: poses are (N, 6) arrays, one row per part position
+        single_part = np.ndim(part_x) == 0 and np.ndim(part_y) == 0 and np.ndim(pick_z) == 0
+        part_x = np.atleast_1d(np.asarray(part_x, dtype=float))
+        part_y = np.atleast_1d(np.asarray(part_y, dtype=float))
+        pick_z = np.atleast_1d(np.asarray(pick_z, dtype=float))
+        part_x, part_y, pick_z = np.broadcast_arrays(part_x, part_y, pick_z)
+        count = len(part_x)
+
         #step 1
         #move to part x and part y, apply a offset on the x so the gripper is a bit before the part. also rotate to start rotation(level and aligned)
-        cur_pos = start_pos.copy()
-        cur_pos[0] = part_x + part_pos_x_offset
-        cur_pos[1] = part_y + part_y_offset
-        cur_pos[2] = belt_z[2] + part_z_offset
-        cur_pos[3] = start_rotation[0]
-        cur_pos[4] = start_rotation[1]
-        cur_pos[5] = start_rotation[2]
-        path_step_1 = cur_pos.copy()
-        path_step_1 = path_step_1[:-3]
-
-        speed_acc_blend = [speed_fast, acc_fast, 0.00]
-        for y in speed_acc_blend:
-            path_step_1 = np.append(path_step_1, y)
+        path_step_1 = np.empty((count, 6))
+        path_step_1[:, 0] = part_x + part_pos_x_offset
+        path_step_1[:, 1] = part_y + part_y_offset
+        path_step_1[:, 2] = pick_z + part_z_offset
+        path_step_1[:, 3:6] = start_rotation
 
         
         #step 2
         #rotate around x axis ~20 degrees
-        pose1 = path_step_1.copy()
-        pose1 = pose1[:-3]
-        pose2 = rotate_x
-        result_pose = self.robot.pose_trans(pose1, pose2)
-        path_step_2 = result_pose.copy()
-
-        speed_acc_blend = [speed_fast, acc_fast, 0.0]
-        for y in speed_acc_blend:
-            path_step_2 = np.append(path_step_2, y)
+        path_step_2 = pose_trans(path_step_1, rotate_x, constant=True)
 
         
         #step 3
         #move to determined z position (belt z) 
-        cur_pos = path_step_2.copy() 
-        cur_pos[2] = belt_z[2] 
-
-        path_step_3 = cur_pos.copy()
-        speed_acc_blend = [speed_fast, acc_fast, 0.00]
-        for y in speed_acc_blend:
-            path_step_3 = np.append(path_step_3, y)
+        path_step_3 = path_step_2.copy()
+        path_step_3[:, 2] = pick_z
 
     
         #step 4
         #perform a relative x movement so parts get picked up
-        cur_pos = path_step_3.copy()
-        cur_pos = cur_pos[:-3]
-        new_linear_move = [cur_pos[i] +  move_x[i] for i in range(6)]
-
-        path_step_4 = new_linear_move.copy()
-        if part_type == 'Big-Blue' or part_type == 'Holed':
-            speed,acc = 2,1.5
-        else:
-            speed,acc = 0.08,0.1
-        speed_acc_blend = [speed, acc, 0.0]
-        for y in speed_acc_blend:
-            path_step_4 = np.append(path_step_4, y)
-
+        path_step_4 = path_step_3 + move_x
+        speed,acc = profile.pickup_speed
 
 
         #step 5
         #rotate back
-        pose1 = path_step_4.copy()
-        pose1 = pose1[:-3]
-        pose2 = rotate_x
-        rotate_x[3] *= -1
-        result_pose = self.robot.pose_trans(pose1, pose2)
-        result_pose[2] += step_5_z_up 
-        result_pose[0] += step_5_x_back
-
-        path_step_5 = result_pose.copy()
-        speed_acc_blend = [speed_middle, acc_middle, 0.0]
-        for y in speed_acc_blend:
-            path_step_5 = np.append(path_step_5, y)
+        rotate_x_back = rotate_x.copy()
+        rotate_x_back[3] *= -1
+        path_step_5 = pose_trans(path_step_4, rotate_x_back, constant=True)
+        path_step_5[:, 2] += step_5_z_up 
+        path_step_5[:, 0] += step_5_x_back
 
 
         #step 6
         #move back relative
-        cur_pos = path_step_5.copy()
-        cur_pos = cur_pos[:-3]
-        new_linear_move = [cur_pos[i] +  step_6_x_back[i] for i in range(6)]
-
-        path_step_6 = new_linear_move.copy()
-        speed_acc_blend = [speed_middle, 0.1, 0.0]
-        for y in speed_acc_blend:
-            path_step_6 = np.append(path_step_6, y)
-
-        
-        self.boxing_machine.wait_if_paused()
-
-
-        '''
-        #move path 1 till 6 with pickup tcp
-        path = [
-            path_step_1,
-            path_step_2,
-            path_step_3,
-            path_step_4,
-            path_step_5,
-            path_step_6,
-        ]
-        self.robot.move_l_path(path=path) '''
-
+        path_step_6 = path_step_5 + step_6_x_back
 
         
-        #move path 1 till 6 with pickup tcp
-        path = [
-            path_step_1,
-            path_step_2,
-            path_step_3,
-            #path_step_4,
-            #path_step_5,
-            #path_step_6,
-        ]
-        self.robot.move_l_path(path=path)
-
-        #self.pause()
-        #move path 1 till 6 with pickup tcp
-        path = [
-            #path_step_1,
-            #path_step_2,
-            #path_step_3,
-            path_step_4,
-            path_step_5,
-            path_step_6,
-        ]
-        self.robot.move_l_path(path=path)
-
-
-
         '''rotate tcp'''
         #step 7
-        #rotate back
-        self.robot.set_tcp(rotate_tcp)
-        pose1 = self.robot.get_tcp_pos()
-        pose2 = step_7_rotate_x_back
-        result_pose = self.robot.pose_trans(pose1, pose2)
-        if part_type == 'Big-Blue': 
-            logging.info('perform step 7')
-            self.robot.move_l(result_pose, speed_slow, acc_slow)
-        else: 
-            logging.info('perform step 7')
-            self.robot.move_l(result_pose, speed_slow, acc_slow)
+        #rotate back. same as reading the position with the rotate tcp after step 6
+        path_step_7 = pose_trans(pose_trans(path_step_6, tcp_change(pickup_tcp, rotate_tcp), constant=True), step_7_rotate_x_back, constant=True)
         '''end rotate tcp'''
 
 
 
         '''start pickup tcp'''
-        self.robot.set_tcp(pickup_tcp)
-        speed_acc_blend = [1,1,0.45]
-        start_pos = self.robot.get_tcp_pos()
-        for y in speed_acc_blend:
-            start_pos.append(y)
+        #position after step 7 with the pickup tcp
+        start_pos = pose_trans(path_step_7, tcp_change(rotate_tcp, pickup_tcp), constant=True)
         
 
         #step 8
         #move up relative.
-        cur_pos = start_pos.copy()
-        cur_pos = cur_pos[:-3]
-        new_linear_move = [cur_pos[i] +  step_8_relative_move_up[i] for i in range(6)]
-
-        path_step_8 = new_linear_move.copy()
-        speed_acc_blend = [speed_slow, acc_slow, 0.05]
-        for y in speed_acc_blend:
-            path_step_8 = np.append(path_step_8, y)
-
+        path_step_8 = start_pos + step_8_relative_move_up
 
 
         #step 9
         #move to safe y
-        cur_pos = path_step_8.copy()
-        cur_pos = cur_pos[:-3]
-        cur_pos[1] =  safe_y 
-
-        path_step_9 = cur_pos.copy()
-        speed_acc_blend = [speed_slow, acc_slow, 0.0]
-        for y in speed_acc_blend:
-            path_step_9 = np.append(path_step_9, y)
-
+        path_step_9 = path_step_8.copy()
+        path_step_9[:, 1] = safe_y 
 
 
         #step 10
         #rotate around x axis and y so parts will stay in place
         relative_move = [0,0,0,math.radians(10),math.radians(-20),math.radians(0)]
-        pose1 = path_step_9.copy()
-        pose1 = pose1[:-3]
-        pose2 = relative_move
-        result_pose = self.robot.pose_trans(pose1, pose2)
-        
-        path_step_10 = result_pose.copy()
-        speed_acc_blend = [speed_fast, acc_fast, 0.0]
-        for y in speed_acc_blend:
-            path_step_10 = np.append(path_step_10, y)
-
-
-        if self.boxing_machine.stop_main_loop:
-            return 
-        self.boxing_machine.wait_if_paused()
-        path = [
-            path_step_8,
-            path_step_9,
-            path_step_10
-        ]
-        self.robot.move_l_path(path=path)
-        '''end pickup tcp'''
+        path_step_10 = pose_trans(path_step_9, relative_move, constant=True)
+
+
+        #speed, acceleration and blend per step
+        speed_acc_blend = np.array([
+            [speed_fast, acc_fast, 0.0],    #step 1
+            [speed_fast, acc_fast, 0.0],    #step 2
+            [speed_fast, acc_fast, 0.0],    #step 3
+            [speed, acc, 0.0],              #step 4
+            [speed_middle, acc_middle, 0.0],#step 5
+            [speed_middle, 0.1, 0.0],       #step 6
+            [speed_slow, acc_slow, 0.0],    #step 7
+            [speed_slow, acc_slow, 0.05],   #step 8
+            [speed_slow, acc_slow, 0.0],    #step 9
+            [speed_fast, acc_fast, 0.0],    #step 10
+        ])
+
+        steps = [path_step_1, path_step_2, path_step_3, path_step_4, path_step_5, path_step_6, path_step_7, path_step_8, path_step_9, path_step_10]
+        path = np.empty((count, 10, 9))
+        path[:, :, :6] = np.stack(steps, axis=1)
+        path[:, :, 6:] = speed_acc_blend
+        if single_part:
+            return path[0]
+        return path
 
     
 
 
     def pause(self):
-        self.boxing_machine.pause()
-        self.boxing_machine.interface.start_button_pressed()
+        self.boxing_machine.pause_for_operator("paused")
         self.boxing_machine.wait_if_paused()
 
 
@@ -0,0 +1,112 @@
+import threading
+import logging
+import time
+from configuration import *
+
+
+##########################
+#pipelined pick cycle. a background vision stage keeps a stable pick candidate ready,
+#so the main loop does not have to wait for vision after every placement.
+#the camera is mounted on the arm, so frames are only used while the arm is parked at the capture position.
+##########################
+class PickPipeline:
+    def __init__(self, camera, boxing_machine):
+        self.camera = camera
+        self.boxing_machine = boxing_machine
+
+        self.capture_ready = threading.Event()      #set while the arm is parked at the capture position
+        self.candidate_ready = threading.Event()    #set when a fresh pick candidate is available
+        self.candidate_lock = threading.Lock()      #protects candidate and generation
+        self.vision_lock = threading.Lock()         #held while the vision stage evaluates a frame
+        self.candidate = None
+        self.generation = 0                         #increases every time the arm leaves the capture position
+
+        self.running = False
+        self.vision_thread = None
+
+
+    #start the background vision stage
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.vision_thread = threading.Thread(target=self.vision_stage, daemon=True)
+        self.vision_thread.start()
+        logging.info("pick pipeline: vision stage started")
+
+
+    #stop the background vision stage
+    def stop(self):
+        self.running = False
+        self.capture_ready.set()    #wake up the vision stage so it can exit
+        if self.vision_thread is not None:
+            self.vision_thread.join(timeout=2)
+        self.vision_thread = None
+        logging.info("pick pipeline: vision stage stopped")
+
+
+    #call when the arm is parked at the capture position. the vision stage starts looking for the next part
+    def arm_at_capture(self):
+        self.capture_ready.set()
+
+
+    #call before the arm leaves the capture position. drops the current candidate because the belt is about to change
+    def arm_busy(self):
+        self.capture_ready.clear()
+        with self.vision_lock:      #wait for a frame that is still being evaluated
+            with self.candidate_lock:
+                self.generation += 1
+                self.candidate = None
+                self.candidate_ready.clear()
+
+
+    #returns the next pick candidate (x, y, label, z). blocks until the vision stage found one, returns (0,0,0,None) when stopped
+    def next_pick(self):
+        while True:
+            self.boxing_machine.wait_if_paused()
+            if self.boxing_machine.stop_main_loop:
+                logging.info("pick pipeline: stop main loop")
+                return (0, 0, 0, None)
+
+            if self.candidate_ready.wait(timeout=0.1):
+                with self.candidate_lock:
+                    candidate = self.candidate
+                    self.candidate = None
+                    self.candidate_ready.clear()
+                if candidate is not None:
+                    return candidate
+
+
+    #background thread. evaluates frames while the arm is at the capture position and keeps the newest stable candidate
+    def vision_stage(self):
+        while self.running:
+            if not self.capture_ready.wait(timeout=0.1):
+                continue
+            if not self.running:
+                break
+
+            #candidate not consumed yet, nothing to do
+            if self.candidate_ready.is_set():
+                time.sleep(0.05)
+                continue
+
+            with self.vision_lock:
+                if not self.capture_ready.is_set():
+                    continue
+                with self.candidate_lock:
+                    generation = self.generation
+
+                try:
+                    pick = self.camera.find_pickable_part()
+                except Exception as e:
+                    logging.error(f"pick pipeline: vision stage error: {e}")
+                    continue
+
+                if pick is None:
+                    continue
+                with self.candidate_lock:
+                    #only keep the candidate if the arm did not move while the frame was evaluated
+                    if generation == self.generation:
+                        self.candidate = pick
+                        self.candidate_ready.set()
+                        logging.info(f"pick pipeline: candidate ready {pick}")
@@ -3,6 +3,9 @@ from math import floor
 import math
 import numpy as np
 from configuration import *
+from pose_math import pose_trans, tcp_change, rotation_angle, interpolate_pose
+from packing_plan import get_packing_plan
+from part_profiles import get_profile
 
 
 #Place parts in boxes check 
@@ -18,6 +21,13 @@ logging.basicConfig(
 logging.info("test 123")
 
 
+#marker in a planned placement: check the placement with the camera before the next move
+CHECK_PLACEMENT = 'check placement'
+
+#marker in a planned placement: joint move of joint 6 to a safe angle, after the 180 degree rotation wound it up
+UNWIND_JOINT_6 = 'unwind joint 6'
+
+
 #class that stores information for the boxes:
 #total boxes, box centers(in x,y) box bottom z, boxsize
 class Box:
@@ -56,6 +66,7 @@ class Pack_Box:
 
         #array with boxes and parts locations
         self.filled_boxes = []
+        self.plan = None
         
         #robot
         self.robot = robot
@@ -66,148 +77,71 @@ class Pack_Box:
         #last layer
         self.last_layer = 0
 
+        #single path mode: the planned moves between checks are sent as one path with the pickup tcp
+        self.single_path = single_path_place
+        self.max_deviation = 0.5/1000   #max distance the folded path may deviate from the original tcp path
+        self.blend_fraction = 0.4       #blend radius of added waypoints as part of the segment length
+
    
-        #get al packing positions in the boxes. These are the center coordinates of the parts, rotations of the parts and the z_height of the parts
+    #get al packing positions in the boxes. These are the center coordinates of the parts, rotations of the parts and the z_height of the parts.
+    #returns a list with the parts per box. the plan is cached, calling this again does not add anything
     def get_pack_pos(self, item_type):
-        # For loop to go through boxes and fill them one by one
-        for box_index in range(self.box.total_boxes):
-            # Get box center
-            box_center = self.box.box_centers[box_index]
-            logging.info(f"Packing in Box {box_index + 1} at center {box_center}")
-
-            # Check total z parts per box
-            total_z_parts = floor(self.box_height / self.part_height)
-            logging.info(f"Total z parts: {total_z_parts}")
-
-            # Set start z_pos at the bottom of the box
-            z_pos = box_center[2]
-
-            # Array for adding part locations for this box
-            part_positions_box = []
-
-            # Part number tracker (resets for each box)
-            part_number = 1
-
-            # Layer number tracker (increments for each z layer)
-            layer_number = 1
-
-            if item_type == 'Big-Blue': place_extra_offset=4/1000
-            else: place_extra_offset = 6/1000
-
-            if item_type == 'Big-Blue':
-                z_pos_offset = -4/1000 #for differen parts, differen offset because box is not level
-            elif item_type == 'Holed':
-                z_pos_offset = -6/1000
-            elif item_type == 'Green' or item_type == 'Small-Blue' or item_type == 'Rubber':
-                z_pos_offset = -1/1000 #for differen parts, differen offset because box is not level
-            else:
-                logging.info("no z pos ofsset defined")
-                z_pos_offset = -1/1000
-
-
-            # For loop to go through total z parts to fill a box
-            for z in range(total_z_parts):
-                # Array to place four parts per layer
-                for i in range(4):  # Only 4 parts per layer
-                    if i == 0:
-                        # First part (top left)
-                        if box_index == 0:
-                            x_pos = box_center[0] - self.box_length / 2 + self.part_length / 2 + 0.010 + place_extra_offset  # x positive for further away from place side was 
-                            y_pos = box_center[1] - self.box_width / 2 + self.part_width / 2 + 0.009  # y positive for further away from box edge
-                            rotation = 0
-                        elif box_index == 1:
-                            x_pos = box_center[0] - self.box_length / 2 + self.part_length / 2 + 0.006 + place_extra_offset  # x positive for further away from place side
-                            y_pos = box_center[1] - self.box_width / 2 + self.part_width / 2 + 0.015  # y positive for further away from box edge
-                            rotation = 0
-                    elif i == 1:
-                        # Second part (top right)
-                        if box_index == 0:
-                            x_pos = box_center[0] + self.box_length / 2 - self.part_width / 2 - 0.013   # x negative for further away from box edge
-                            y_pos = box_center[1] - self.box_width / 2 + self.part_length / 2 + 0.004 + place_extra_offset  # y positive for further away from place side
-                            if item_type == 'Small-Blue': x_pos -= 0.003
-                            rotation = -90
-                        elif box_index == 1:
-                            x_pos = box_center[0] + self.box_length / 2 - self.part_width / 2 - 0.009  # x negative for further away from box edge
-                            y_pos = box_center[1] - self.box_width / 2 + self.part_length / 2 + 0.013 + place_extra_offset  # y positive for further away from place side
-                            if item_type == 'Small-Blue': x_pos -= 0.004
-                            rotation = -90
-                    elif i == 2:
-                        if item_type == 'Big-Blue': z_pos_offset = -4/1000
-                        elif item_type == 'Holed': z_pos_offset = -6/1000
-                        else: z_pos_offset = -5/1000
-                        # Third part (bottom left)
-                        if box_index == 0:
-                            x_pos = box_center[0] - self.box_length / 2 + self.part_width / 2 + 0.013  # x positive for further away from box edge
-                            y_pos = box_center[1] + self.box_width / 2 - self.part_length / 2 - 0.010 - place_extra_offset  # y negative for further away from place side
-                            rotation = 90
-                        elif box_index == 1:
-                            x_pos = box_center[0] - self.box_length / 2 + self.part_width / 2 + 0.006  # x positive for further away from box edge
-                            y_pos = box_center[1] + self.box_width / 2 - self.part_length / 2 - 0.007 - place_extra_offset  # y negative for further away from place side
-                            if item_type == 'Small-Blue': x_pos += 0.009
-                            rotation = 90
-                    elif i == 3:
-                        if item_type == 'Big-Blue': z_pos_offset = -4/1000
-                        elif item_type == 'Holed': z_pos_offset = -6/1000
-                        else: z_pos_offset = -2/1000
-                        # Fourth part (bottom right)
-                        if box_index == 0:
-                            x_pos = box_center[0] + self.box_length / 2 - self.part_length / 2 - 0.013 - place_extra_offset  # x negative for further away from place side
-                            y_pos = box_center[1] + self.box_width / 2 - self.part_width / 2 - 0.015  # y negative for further away from box edge
-                            rotation = 180
-                        elif box_index == 1:
-                            x_pos = box_center[0] + self.box_length / 2 - self.part_length / 2 - 0.008 - place_extra_offset # x negative for further away from place side
-                            y_pos = box_center[1] + self.box_width / 2 - self.part_width / 2 - 0.006  # y negative for further away from box edge
-                            rotation = 180
-
-                    _z_pos = z_pos + z_pos_offset
-
-                    if item_type in ('Big-Blue', 'Holed'):
-                        partcount = part_number * 7
-                    else:
-                        partcount = part_number * 12
-                    # Store the positions with box number, part number, layer number
-                    if layer_number == total_z_parts: top_layer = True
-                    else: top_layer = False
-                    part_positions_box.append({
-                        "box_number": box_index,
-                        "part_number": part_number,
-                        "layer_number": layer_number,
-                        "position": (x_pos, y_pos, _z_pos),
-                        "rotation": rotation,
-                        "partcount": partcount,
-                        "top_layer": top_layer
-                    })
-
-                    # Increment the part number
-                    part_number += 1
-
-                # Layer has been filled, increase z_pos for the next layer
-                z_pos += self.part_height
-                # Increment the layer number
-                layer_number += 1
-
-            # Add filled box to total boxes
-            self.filled_boxes.append(part_positions_box)
-
+        self.plan = self.get_plan(item_type)
+        self.filled_boxes = self.plan.boxes
         return self.filled_boxes
+
+    #packing plan for the current box and part size
+    def get_plan(self, item_type):
+        return get_packing_plan(item_type, self.box.box_centers, self.box.box_size,
+                                (self.part_length, self.part_width, self.part_height))
     
 
 
-    #place parts
+    #place parts. the whole placement is planned up front from the end pose of the pick, so there are no
+    #position reads between the segments and every segment is sent as a blended path
     def place_part(self, part, part_type='Big-Blue',box_rotation='horizontal'):
         logging.info(f"given part type to place part: {part_type}")
+        if part['top_layer']:
+            self.boxing_machine.interface.update_status("last layer!!!")
 
+        #start pose with the pickup tcp. the pick leaves its planned end pose, only read the robot if there is none
+        start_pose = self.boxing_machine.pick_part.end_pose
+        self.boxing_machine.pick_part.end_pose = None
+        if start_pose is None:
+            self.robot.set_tcp(pickup_tcp)
+            start_pose = self.robot.get_tcp_pos()
+
+        moves = self.plan_placement(part, part_type, box_rotation, start_pose)
+        if self.single_path:
+            moves = self.fold_moves(moves, start_pose)
+
+        for move in moves:
+            if move is CHECK_PLACEMENT:
+                self.check_placement()
+                continue
+            if move is UNWIND_JOINT_6:
+                self.unwind_joint_6()
+                continue
+            tcp, path = move
+            self.boxing_machine.wait_if_paused()
+            self.robot.set_tcp(tcp)
+            self.robot.move_l_path(path=path.tolist())
+
+        self.boxing_machine.wait_if_paused()
+
+
+    #plans the complete placement without any robot communication. returns the moves in order: (tcp, path) with
+    #path rows [x, y, z, rx, ry, rz, speed, acc, blend], and CHECK_PLACEMENT where the placement has to be checked
+    def plan_placement(self, part, part_type, box_rotation, start_pose):
         box_index = part['box_number']
         part_position = part['position']
         cur_layer = part['layer_number']
 
+        #tuned values of the part type
+        profile = get_profile(part_type)
+
         #fast and slow speeds and accelerations. fast for general movements, slow for special movements. 
-        if part_type == 'Big-Blue' or part_type == 'Holed':                          
-            speed_slow = 2
-            acc_slow = 1.5
-        else:
-            speed_slow = 0.6
-            acc_slow = 0.6
+        speed_slow, acc_slow = profile.place_speed
 
         box_center = self.box.box_centers[box_index]
 
@@ -229,7 +163,6 @@ class Pack_Box:
         if part['top_layer']: 
             z_offset_step_3=27/1000
             lastlayer = True
-            self.boxing_machine.interface.update_status("last layer!!!")
 
 
         '''STEP 4: rotate parts, no tuning here'''
@@ -242,139 +175,48 @@ class Pack_Box:
 
         '''step 5.1 t/m step 10 in 1 PATH'''
         '''STEP 5.1: rotate a bit before fully going to proper z'''
-        if part_type == 'Big-Blue' or part_type == 'Holed': 
-            rotate_x = -8
-            if lastlayer: rotate_x = -4
-        elif part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': rotate_x = -2
+        rotate_x = profile.place_tilt[1] if lastlayer else profile.place_tilt[0]
         rotate_x_step_5_1 = [0,0,0,math.radians(rotate_x),math.radians(0),math.radians(0)]     #shouold be -5
 
 
         '''STEP 6: move to desired z height'''
-        z_offset_step_6 = 0
+        #the high side of the box is parallel to the belt for horizontal boxes. parts placed from the low side
+        #(rotation 90/-90 horizontal, 0/180 vertical) go a bit lower than parts placed from the angled side
         rotation = part['rotation']
-        if box_rotation == 'horizontal':   #high side parrallel to belt
-            if rotation == 90 or rotation == -90:    #low side. 
-                if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue':
-                    z_offset_step_6 = -3/1000    
-                else: #big parts
-                    z_offset_step_6 = 3/1000
-            else:   #angled side. bit heigher than low side
-                if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue':
-                    z_offset_step_6 = -1/1000    
-                else: #big parts
-                    z_offset_step_6 = 6/1000
-
-        elif box_rotation == 'vertical': #high side not parrallel to belt
-            if rotation == 0 or rotation == 180:
-                if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue':
-                    z_offset_step_6 = -3/1000   
-                else: #big parts
-                    z_offset_step_6 = 3/1000
-            else:   #angled side. bit heigher than low side
-                if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue':
-                    z_offset_step_6 = -1/1000    
-                else: #big parts
-                    z_offset_step_6 = 6/1000
+        if box_rotation == 'horizontal':
+            low_side = rotation == 90 or rotation == -90
+        else:
+            low_side = rotation == 0 or rotation == 180
+        z_offset_step_6 = 0
+        if box_rotation == 'horizontal' or box_rotation == 'vertical':
+            z_offset_step_6 = (profile.place_z_mm[0] if low_side else profile.place_z_mm[1])/1000
 
 
-        offset_step_8_extra = 0
-        
         '''STEP 7: rotate about x so parts can be placed'''
-        if part_type == 'Big-Blue' or part_type == 'Holed': rotate_x = -23
-        elif part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': rotate_x = -18
+        #towards the high side (not the low side) also rotate about y of the tool. this way placing is parallel to
+        #the bottom of the box
+        rotate_x = profile.place_rotate_x
+        upper_layers = part['layer_number'] >= 7
         rotate_y = 0
-        rotation = part['rotation']
-        if part['layer_number'] < 7:
-            if box_rotation == 'horizontal':
-                if rotation == 0 or rotation == 180:
-                    #logging.info("---rotate also around y wile placing!---")
-                    rotate_y = 5    #rotate 5 degrees about y of tool. this way placing is parralle to the bottom of the box
-                    if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-BLue': 
-                        rotate_y = 2
-                        offset_step_8_extra = 5
-            elif box_rotation == 'vertical':
-                if rotation == 90 or rotation == -90:
-                    #logging.info("---rotate also around y wile placing!---")
-                    rotate_y = 5    #rotate 5 degrees about y of tool. this way placing is parralle to the bottom of the box
-                    if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-BLue': 
-                        rotate_y = 2
-                        offset_step_8_extra = 5
-
-        else:
-            if box_rotation == 'horizontal':
-                if rotation == 0 or rotation == 180:
-                    #logging.info("---rotate also around y wile placing!---")
-                    rotate_y = 3    #rotate 5 degrees about y of tool. this way placing is parralle to the bottom of the box
-                    if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-BLue': 
-                        rotate_y = 1
-                        offset_step_8_extra = 5
-            elif box_rotation == 'vertical':
-                if rotation == 90 or rotation == -90:
-                    #logging.info("---rotate also around y wile placing!---")
-                    rotate_y = 3    #rotate 5 degrees about y of tool. this way placing is parralle to the bottom of the box   
-                    if part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-BLue': 
-                        rotate_y = 1 
-                        offset_step_8_extra = 5
-
-
-
+        offset_step_8_extra = 0
+        if (box_rotation == 'horizontal' or box_rotation == 'vertical') and not low_side:
+            rotate_y = profile.place_rotate_y[1] if upper_layers else profile.place_rotate_y[0]
+            offset_step_8_extra = profile.place_side_offset_mm
 
         rotate_x_step_7 = [0,0,0,math.radians(rotate_x),math.radians(rotate_y),math.radians(0)]
 
 
         '''step 8: perform placing movement. because box higher in the middle, move z a bit up'''
-        if part_type == 'Big-Blue' or part_type == 'Holed':
-            offset_step_8=157    
-        else:
-            offset_step_8=157
-        
+        offset_step_8=157
 
+        #move z up if moving to the high side
         z_offset_step_8=0
-        rotation = part['rotation']
-        if part['layer_number'] < 7:
-            if box_rotation == 'horizontal':       #high side parrallel to belt
-                if rotation == 90 or rotation == -90: #move z up if moving to high side
-                    if part_type == 'Big-Blue' or part_type == 'Holed': 
-                        z_offset_step_8 = 5
-                        #logging.info("---while placing move z up!!--")
-                    elif part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': 
-                        z_offset_step_8 = 6
-                        #logging.info("---while placing move z up!!--")
-            
-            elif  box_rotation == 'vertical':    #high side not parrallel to belt
-                if rotation == 0 or rotation == 180:   #move z up if moving to high side
-                    if part_type == 'Big-Blue' or part_type == 'Holed': 
-                        z_offset_step_8 = 5
-                        #logging.info("while placing move z up!!")
-                    elif part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': 
-                        z_offset_step_8 = 6
-                        #logging.info("while placing move z up!!")
-        else:
-            if box_rotation == 'horizontal':       #high side parrallel to belt
-                if rotation == 90 or rotation == -90: #move z up if moving to high side
-                    if part_type == 'Big-Blue' or part_type == 'Holed': 
-                        z_offset_step_8 = 4
-                        #logging.info("---while placing move z up!!--")
-                    elif part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': 
-                        z_offset_step_8 = 6
-                        #logging.info("---while placing move z up!!--")
-            
-            elif  box_rotation == 'vertical':    #high side not parrallel to belt
-                if rotation == 0 or rotation == 180:   #move z up if moving to high side
-                    if part_type == 'Big-Blue' or part_type == 'Holed': 
-                        z_offset_step_8 = 4
-                        #logging.info("while placing move z up!!")
-                    elif part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': 
-                        z_offset_step_8 = 6
-                        #logging.info("while placing move z up!!")
-
-
+        if (box_rotation == 'horizontal' or box_rotation == 'vertical') and low_side:
+            z_offset_step_8 = profile.place_z_up_mm[1] if upper_layers else profile.place_z_up_mm[0]
 
 
         '''STEP 9: rotate more about x for last placing movement'''
-        if part_type == 'Big-Blue' or part_type == 'Holed': rotation = -10
-        elif part_type == 'Green' or part_type == 'Rubber' or part_type == 'Small-Blue': rotation = -15
-        rotate_x_step_9 = [0,0,0,math.radians(rotation),math.radians(0),math.radians(0)]
+        rotate_x_step_9 = [0,0,0,math.radians(profile.place_rotate_last),math.radians(0),math.radians(0)]
 
 
         '''STEP 10: perform last placing movement'''
@@ -386,28 +228,18 @@ class Pack_Box:
 
         '''start placement tcp'''
         '''PREPARTION MOVEMENTES: move to desired x,y. no placing in this part(STEP 1 t/m STEP 5)'''
-        #set tcp and get current position to base movements off
-        self.robot.set_tcp(placement_tcp)
-        speed_acc_blend = [1,1,0.45]
-        start_pos = self.robot.get_tcp_pos()
-        for y in speed_acc_blend:
-            start_pos.append(y)
+        #start position with the placement tcp, computed from where the pick ended
+        start_pos = list(pose_trans(start_pose, tcp_change(pickup_tcp, placement_tcp), constant=True))
 
 
         #step 1: move to proper z height (currently pos: just picked up parts)     
         cur_pos = start_pos.copy()
         cur_pos[2] = z_above_box
-
-        x = 6
-        path_step_1 = cur_pos.copy()
-        speed_acc_blend = [speed_fast, acc_fast, 0.2]
-        for y in speed_acc_blend:
-            path_step_1[x]=y
-            x+=1
+        path_step_1 = cur_pos + [speed_fast, acc_fast, 0.2]
 
 
         # Step 2: Move above the box center 
-        cur_pos = path_step_1.copy()
+        cur_pos = path_step_1[:6]
         cur_pos[0] = box_center[0]     # Align x position with box center
         cur_pos[1] = box_center[1]     # Align y position with box center
         cur_pos[2] = z_above_box               # Set a safe z height above the box
@@ -416,141 +248,62 @@ class Pack_Box:
         if rotation_angle == 0:
             #move x positive
             if lastlayer: cur_pos[0] += 15/1000
-            offset= [offset_step_8/1000,offset_step_8_extra/1000,z_offset_step_8/1000,0,0,0]
         elif rotation_angle == -90:
             if lastlayer:  cur_pos[1] += 15/1000
-            #move y positive
-            offset= [-offset_step_8_extra/1000,offset_step_8/1000,z_offset_step_8/1000,0,0,0]
         elif rotation_angle == 90:
             if lastlayer: cur_pos[1] -= 15/1000
-            #move y negative
-            offset= [offset_step_8_extra/1000,-offset_step_8/1000,z_offset_step_8/1000,0,0,0]  
         elif rotation_angle == 180:
             if lastlayer: cur_pos[0] -= 15/1000
-            #move y negatie
-            offset= [-offset_step_8/1000,-offset_step_8_extra/1000,z_offset_step_8/1000,0,0,0]
 
-        x = 6
-        path_step_2 = cur_pos.copy()
-        speed_acc_blend = [speed_fast, acc_fast, 0.1]       #
-        for y in speed_acc_blend:
-            path_step_2[x]=y
-            x+=1
+        path_step_2 = cur_pos + [speed_fast, acc_fast, 0.1]
         
 
         # Step 3: Move to the desired Z height for placement + 30mm
-        cur_pos = path_step_2.copy()
+        cur_pos = path_step_2[:6]
         cur_pos[2] = part_position[2] + z_offset_step_3 # Set Z height to target position within the box
         cur_pos[3] = start_rotation[0]
         cur_pos[4] = start_rotation[1]
         cur_pos[5] = start_rotation[2]
 
-        x = 6
-        path_step_3 = cur_pos.copy()
-        speed_acc_blend = [speed_fast, acc_fast, 0.0]       
-        for y in speed_acc_blend:
-            path_step_3[x]=y
-            x+=1
-
-
-        # Step 4: Adjust rotation around the Z-axis
-        #when angle=180, first do + 10 then do + 170
-        rotations = 1
-        if rotation_angle == 180: 
-            rotation_angle = 20
-            rotations = 2
-        for rotation in range(rotations):
-            rotate = [0,0,0,math.radians(0),math.radians(0),math.radians(rotation_angle)]
-            pose1 = path_step_3.copy()
-            pose1 = pose1[:-3]
-            pose2 = rotate
-            result_pose = self.robot.pose_trans(pose1, pose2)
-
-            path_step_4 = result_pose.copy()
-            speed_acc_blend = [speed_fast, acc_fast, 0.0]
-            for y in speed_acc_blend:
-                path_step_4 = np.append(path_step_4, y)
-                path_step_3 = path_step_4.copy()
-            if rotations == 2:
-                rotation_angle = 160
-
-        if rotations == 2: rotation_angle = 180
+
+        # Step 4: Adjust rotation around the Z-axis while moving down to step 3. the rotated pose is the step 3
+        #target, the robot rotates on the way down and does not stop above the part first
+        rotate = [0,0,0,math.radians(0),math.radians(0),math.radians(rotation_angle)]
+        pose = list(pose_trans(cur_pos, rotate, constant=True))   #the angles are constant, the transform comes from the cache
+        path_step_3 = pose + [speed_fast, acc_fast, 0.0]
 
 
         # Step 5: Move to the part's target X, Y position
-        cur_pos = path_step_4.copy()
+        cur_pos = pose.copy()
         cur_pos[0] = part_position[0]  # Set X to the part's target position
         cur_pos[1] = part_position[1]  # Set Y to the part's target position
+        path_step_5 = cur_pos + [1, 0.5, 0]
 
-        x = 6
-        path_step_5 = cur_pos.copy()
-        speed_acc_blend = [1, 0.5, 0]
-        for y in speed_acc_blend:
-            path_step_5[x]=y
-            x+=1
-
-        
-        #create path and move robot
-        self.boxing_machine.wait_if_paused()
-        path = [
-            # Positie 1: [X, Y, Z, RX, RY, RZ, snelheid, versnelling, blend]
-            path_step_1,  # step 1: move up
-            path_step_2,  # step 2: move to center box
-            path_step_3,  # step 3: move down
-            path_step_4,  # step 4: rotate around z
-            path_step_5,  #step 5: move to target x and y
-            # Voeg meer posities toe zoals nodig
-        ]
-        self.robot.move_l_path(path=path)
+        placement_path = [path_step_1, path_step_2, path_step_3, path_step_5]
         '''end placement tcp'''
 
 
 
         '''PLACING SECTION: this section contains the path of the placement.'''
         '''start pickup tcp'''
-        #set tcp and get start position with new tcp
-        self.robot.set_tcp(pickup_tcp)
-        cur_pos = self.robot.get_tcp_pos()
-        speed_acc_blend = [speed_slow, acc_slow, 0]
-        for y in speed_acc_blend:
-            cur_pos.append(y)
+        #start position with the pickup tcp, same flange position as step 5
+        cur_pos = list(pose_trans(path_step_5[:6], tcp_change(placement_tcp, pickup_tcp), constant=True))
 
 
         #step 5.1: rotate a bit about x of tcp
-        start_pos = cur_pos.copy()
-        pose1 = start_pos
-        pose1 = pose1[:-3]
-        pose2 = rotate_x_step_5_1
-        result_pose = self.robot.pose_trans(pose1, pose2)
-
-        path_step_5_1 = result_pose.copy()
-        speed_acc_blend = [speed_slow, acc_slow, 0]
-        for y in speed_acc_blend:
-            path_step_5_1 = np.append(path_step_5_1, y)
+        pose = list(pose_trans(cur_pos, rotate_x_step_5_1, constant=True))
+        path_step_5_1 = pose + [speed_slow, acc_slow, 0]
 
        
         # Step 6: Move to the desired Z height for placement
-        cur_pos = path_step_5_1.copy()
+        cur_pos = path_step_5_1[:6]
         cur_pos[2] = part_position[2] + z_offset_step_6   # Set Z height to target position within the box
-
-        x = 6
-        path_step_6 = cur_pos.copy()  
-        speed_acc_blend = [speed_slow, acc_slow, 0]
-        for y in speed_acc_blend:
-            path_step_6[x]=y
-            x+=1
+        path_step_6 = cur_pos + [speed_slow, acc_slow, 0]
 
 
         # Step 7: Slide part into place (rotates about x axis)     
-        pose1 = path_step_6.copy()
-        pose1 = pose1[:-3]
-        pose2 = rotate_x_step_7
-        result_pose = self.robot.pose_trans(pose1, pose2)
-
-        path_step_7 = result_pose.copy()
-        speed_acc_blend = [speed_slow, acc_slow, 0]
-        for y in speed_acc_blend:
-            path_step_7 = np.append(path_step_7, y)
+        pose = list(pose_trans(path_step_6[:6], rotate_x_step_7, constant=True))
+        path_step_7 = pose + [speed_slow, acc_slow, 0]
 
            
         #step 8: depending on rotation, move x or y or a bit of z
@@ -567,54 +320,21 @@ class Pack_Box:
             #move y negatie
             offset= [-offset_step_8/1000,-offset_step_8_extra/1000,z_offset_step_8/1000,0,0,0]
 
-        cur_pos = path_step_7.copy()
-        cur_pos = cur_pos[:-3]
-        new_pos = [cur_pos[i] +  offset[i] for i in range(6)]
-
-        path_step_8 = new_pos.copy()
-        speed_acc_blend = [speed_slow, acc_slow, 0]
-        for y in speed_acc_blend:
-            path_step_8 = np.append(path_step_8, y)
+        new_pos = [path_step_7[i] +  offset[i] for i in range(6)]
+        path_step_8 = new_pos + [speed_slow, acc_slow, 0]
 
 
         #step 9 #rotatate more at last part
-        pose1 = path_step_8.copy()
-        pose1 = pose1[:-3]
-        pose2 = rotate_x_step_9
-        result_pose = self.robot.pose_trans(pose1, pose2)
-
-        path_step_9 = result_pose.copy()
-        speed_acc_blend = [speed_slow, acc_slow, 0]
-        for y in speed_acc_blend:
-            path_step_9 = np.append(path_step_9, y)
+        pose = list(pose_trans(path_step_8[:6], rotate_x_step_9, constant=True))
+        path_step_9 = pose + [speed_slow, acc_slow, 0]
 
 
         #step 10 #move y relative to the axiis to the tool, so last part can be pushed of and there is clearance for other parts already laying in the boxs
-        relative_from_tcp = [0,y_movement_step_10,0,0,math.radians(0),math.radians(0),math.radians(0)]
-        pose1 = path_step_9.copy()
-        pose1 = pose1[:-3]
-        pose2 = relative_from_tcp
-        result_pose = self.robot.pose_trans(pose1, pose2)
+        relative_from_tcp = [0,y_movement_step_10,0,math.radians(0),math.radians(0),math.radians(0)]
+        pose = list(pose_trans(path_step_9[:6], relative_from_tcp, constant=True))
+        path_step_10 = pose + [speed_slow, acc_slow, 0]
 
-        path_step_10 = result_pose.copy()
-        speed_acc_blend = [speed_slow, acc_slow, 0]
-        for y in speed_acc_blend:
-            path_step_10 = np.append(path_step_10, y)
-
-
-        self.boxing_machine.wait_if_paused()
-
-        path = [
-            # Positie 1: [X, Y, Z, RX, RY, RZ, snelheid, versnelling, blend]
-            path_step_5_1,
-            path_step_6,  # step 6: move to correct z height (x and y are already correct)
-            path_step_7,  # step 7: rotate parts
-            path_step_8,  # step 8: move so parts fall off
-            path_step_9,  # step 9: rotate more at end
-            path_step_10,  #step 10: move the rest
-            # Voeg meer posities toe zoals nodig
-        ]
-        self.robot.move_l_path(path=path)
+        placing_path = [path_step_5_1, path_step_6, path_step_7, path_step_8, path_step_9, path_step_10]
         '''end placing movement'''
 
 
@@ -622,76 +342,112 @@ class Pack_Box:
         '''END FASE: parts have been placed. move up, rotate and move to proper x and y and z 
         for checking if parts are properly placed, move to take pic pos at the dn '''
         '''start pickup tcp'''
-        if rotation_angle != 180:
-            '''start pickup tcp'''
-            self.robot.set_tcp(pickup_tcp)
-            cur_pos = self.robot.get_tcp_pos()
-            speed_acc_blend = [speed_slow, acc_slow, 0]
-            for y in speed_acc_blend:
-                cur_pos.append(y)
-
-            # Step 11: Return above the box 
-            cur_pos = cur_pos.copy()
-            cur_pos = cur_pos[:-3]
-            cur_pos[2] = z_above_box   # Return to a safe Z height above the box
-            
-            path_step_11 = cur_pos.copy()
-            speed_acc_blend = [speed_fast, acc_fast, 0.2]   #was 0.2
-            for y in speed_acc_blend:
-                path_step_11 = np.append(path_step_11, y)
-
-            #move to take pic pos
-            target_position = [-0.6639046352765678, -0.08494527187802497, 0.529720350746548, 2.222, 2.248, 0.004]
-            path_step_12 = target_position.copy()
-            speed_acc_blend = [speed_fast, acc_fast, 0.0]
-            for y in speed_acc_blend:
-                path_step_12 = np.append(path_step_12, y)
+        #take pic pos
+        target_position = [-0.6639046352765678, -0.08494527187802497, 0.529720350746548, 2.222, 2.248, 0.004]
 
-            self.boxing_machine.wait_if_paused()
+        # Step 11: Return above the box 
+        cur_pos = path_step_10[:6]
+        cur_pos[2] = z_above_box   # Return to a safe Z height above the box
 
-            #placement tcp 
-            path = [
-                # Positie 1: [X, Y, Z, RX, RY, RZ, snelheid, versnelling, blend]
-                path_step_11,  # step 1: move up
-                path_step_12,   #move to take pic pos
-            ]
-            self.robot.move_l_path(path=path)
-            '''end placement tcp'''
+        moves = [(placement_tcp, np.array(placement_path)), (pickup_tcp, np.array(placing_path))]
 
+        if rotation_angle != 180:
+            path_step_11 = cur_pos + [speed_fast, acc_fast, 0.2]   #was 0.2
+            path_step_12 = target_position + [speed_fast, acc_fast, 0.0]
+            moves.append((pickup_tcp, np.array([path_step_11, path_step_12])))
 
-        #joint rotatation if needed
+        #joint 6 rotation back
         elif rotation_angle == 180:
             #move up first
-            cur_pos = self.robot.get_tcp_pos()
-            cur_pos[2] = z_above_box
-            self.robot.move_l(cur_pos, speed_fast, acc_fast)
+            path_step_11 = cur_pos + [speed_fast, acc_fast, 0.0]
+            moves.append((pickup_tcp, np.array([path_step_11])))
 
             #move joint 6 to safe angle
-            cur_joint_pos = self.robot.get_joint_pos()
-            cur_joint_pos[5] = math.radians(-70)
-            self.robot.move_j(cur_joint_pos, 3, 3)
+            moves.append(UNWIND_JOINT_6)
 
-            if part_type == 'Big-Blue' or part_type == 'Holed':
+            if profile.check_rotated:
                 #rotate more for checking
                 x_offset=-133/1000
                 y_offset=-100/1000
                 z_height=0.6
                 check_placement_pos = [box_center[0]+x_offset, box_center[1] + y_offset, z_height, 2.222,2.248,0.004]
-                self.robot.move_l(check_placement_pos, speed_fast, acc_fast) #slow for testing !!! 
+                moves.append((pickup_tcp, np.array([check_placement_pos + [speed_fast, acc_fast, 0.0]])))
+                moves.append(CHECK_PLACEMENT)
+
+            #move to take pic pos
+            moves.append((pickup_tcp, np.array([target_position + [speed_fast, acc_fast, 0.0]])))
 
-                bad_detected = self.boxing_machine.camera.check_bad_part_placement()
-                if bad_detected:
-                    logging.info("bad placement detected")
-                    self.boxing_machine.pause()
-                    self.boxing_machine.interface.start_button_pressed()
-                    self.boxing_machine.interface.update_status("please fix placement position, then press resume")
-                else:
-                    logging.info("no bad position detected")
+        return moves
 
-                #self.boxing_machine.wait_if_paused()
 
-            #move to take pic pos
-            target_position = [-0.6639046352765678, -0.08494527187802497, 0.529720350746548, 2.222, 2.248, 0.004]
-            self.robot.move_l(target_position, speed_fast, acc_fast)
 
-            self.boxing_machine.wait_if_paused()
\ No newline at end of file
+    #joint 6 to -70 degrees with a joint move, reads the joint positions because the wound up angle is not planned
+    def unwind_joint_6(self):
+        self.boxing_machine.wait_if_paused()
+        cur_joint_pos = self.robot.get_joint_pos()
+        cur_joint_pos[5] = math.radians(-70)
+        self.robot.move_j(cur_joint_pos, 3, 3)
+
+
+    #camera check of the placed parts, pauses the machine if a part is not placed properly
+    def check_placement(self):
+        bad_detected = self.boxing_machine.camera.check_bad_part_placement()
+        if bad_detected:
+            logging.info("bad placement detected")
+            self.boxing_machine.pause_for_operator("please fix placement position, then press resume")
+        else:
+            logging.info("no bad position detected")
+
+
+    #folds the planned moves between checks and joint moves into single paths of the pickup tcp. a row of another tcp is converted
+    #to the same flange pose with the pickup tcp. while the tool rotates, the pickup tcp moves on an arc around the
+    #original tcp, so rotating segments are split until the pickup tcp stays within max_deviation of that path
+    def fold_moves(self, moves, start_pose):
+        folded = []
+        rows = []
+        path_start = list(start_pose[:6])
+        previous = list(start_pose[:6])     #previous waypoint, pickup tcp
+        for move in moves:
+            if move is CHECK_PLACEMENT or move is UNWIND_JOINT_6:
+                if rows:
+                    folded.append((pickup_tcp, self.clamp_blends(np.array(rows), path_start)))
+                folded.append(move)
+                rows = []
+                path_start = previous
+                continue
+
+            tcp, path = move
+            if tcp == pickup_tcp:
+                rows.extend(path.tolist())
+                previous = list(path[-1, :6])
+                continue
+
+            to_pickup = tcp_change(tcp, pickup_tcp)
+            lever = np.linalg.norm(to_pickup[:3])     #distance between the tcps
+            #rotation of every segment of the path in one pass
+            poses = np.vstack([pose_trans(previous, tcp_change(pickup_tcp, tcp), constant=True), path[:, :6]])
+            angles = rotation_angle(poses[:-1], poses[1:])
+            for pose_a, pose_b, angle, row in zip(poses[:-1], poses[1:], angles, path):
+                steps = max(1, math.ceil(angle * math.sqrt(lever / (8 * self.max_deviation))))
+                points = pose_trans(interpolate_pose(pose_a, pose_b, np.arange(1, steps + 1) / steps), to_pickup, constant=True)
+                points = [previous] + points.tolist()
+                chords = np.linalg.norm(np.diff(np.array(points)[:, :3], axis=0), axis=1)
+                for k in range(1, steps):
+                    #added waypoint inside a segment, blend so the robot does not stop there
+                    blend = self.blend_fraction * min(chords[k - 1], chords[k])
+                    rows.append(points[k] + [row[6], row[7], blend if blend >= 1/1000 else 0.0])
+                rows.append(points[-1] + list(row[6:9]))
+                previous = points[-1]
+
+        if rows:
+            folded.append((pickup_tcp, self.clamp_blends(np.array(rows), path_start)))
+        return folded
+
+
+    #blend radii may not be larger than half of the neighbouring segments, the last waypoint always stops
+    def clamp_blends(self, path, start_pose):
+        points = np.vstack([np.asarray(start_pose[:3]), path[:, :3]])
+        lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)       #lengths[k]: into row k
+        path[:-1, 8] = np.minimum(path[:-1, 8], 0.5 * np.minimum(lengths[:-1], lengths[1:]))
+        path[-1, 8] = 0.0
+        return path
@@ -0,0 +1,197 @@
+import math
+from functools import lru_cache
+import numpy as np
+
+
+##########################
+#pose algebra for UR poses [x, y, z, rx, ry, rz] (rx, ry, rz is a rotation vector, same as URScript).
+#every function takes a single pose or a stack of poses with shape (..., 6) and broadcasts like numpy,
+#so a whole path is transformed in one call: pose_trans(path[:, :6], rotate_x) rotates every waypoint.
+#transforms that never change (tcp offsets, fixed relative moves) can use the cached matrix with constant=True
+##########################
+
+
+#below this angle the series expansions are used, sin(theta)/theta can not be computed there
+SMALL_ANGLE = 1e-6
+
+
+#cross product matrices of a stack of vectors, (..., 3) -> (..., 3, 3)
+def skew(v):
+    v = np.asarray(v, dtype=float)
+    zero = np.zeros(v.shape[:-1])
+    return np.stack([
+        np.stack([zero, -v[..., 2], v[..., 1]], axis=-1),
+        np.stack([v[..., 2], zero, -v[..., 0]], axis=-1),
+        np.stack([-v[..., 1], v[..., 0], zero], axis=-1),
+    ], axis=-2)
+
+
+#rotation vectors to rotation matrices (rodrigues), (..., 3) -> (..., 3, 3)
+def rotvec_to_matrix(rotvec):
+    rotvec = np.asarray(rotvec, dtype=float)
+    if rotvec.ndim == 1:
+        return single_rotvec_to_matrix(*rotvec)
+    theta = np.linalg.norm(rotvec, axis=-1)[..., None, None]
+    small = theta < SMALL_ANGLE
+    safe = np.where(small, 1.0, theta)
+    a = np.where(small, 1 - theta ** 2 / 6, np.sin(safe) / safe)              #sin(theta) / theta
+    b = np.where(small, 0.5 - theta ** 2 / 24, (1 - np.cos(safe)) / safe ** 2)   #(1 - cos(theta)) / theta^2
+    K = skew(rotvec)
+    return np.eye(3) + a * K + b * (K @ K)
+
+
+#rotation matrices to rotation vectors, (..., 3, 3) -> (..., 3). the angle comes from atan2, which is accurate over
+#the whole range (acos of the trace is not, near 0 and near 180 degrees). above 90 degrees the axis is taken from
+#the symmetric part of R, that stays accurate up to and including 180 degrees where the antisymmetric part is zero
+def matrix_to_rotvec(R):
+    R = np.asarray(R, dtype=float)
+    if R.ndim == 2:
+        return single_matrix_to_rotvec(R)
+    w = np.stack([R[..., 2, 1] - R[..., 1, 2], R[..., 0, 2] - R[..., 2, 0], R[..., 1, 0] - R[..., 0, 1]], axis=-1)  #2 sin(theta) * axis
+    sin_2 = np.linalg.norm(w, axis=-1)
+    cos_2 = np.trace(R, axis1=-2, axis2=-1) - 1
+    theta = np.arctan2(sin_2, cos_2)
+
+    #up to 90 degrees: axis * theta = w * theta / (2 sin(theta))
+    small = theta < SMALL_ANGLE
+    factor = np.where(small, 0.5 + theta ** 2 / 12, theta / np.where(small, 1.0, sin_2))
+    rotvec = w * factor[..., None]
+
+    #above 90 degrees: (R + R^T) / 2 = cos(theta) I + (1 - cos(theta)) axis axis^T. use the column with the largest
+    #diagonal element and take the sign from w (at exactly 180 degrees both signs are the same rotation)
+    large = cos_2 < 0
+    if np.any(large):
+        cos_theta = np.where(large, cos_2 / 2, -1.0)[..., None, None]
+        outer = ((R + np.swapaxes(R, -1, -2)) / 2 - cos_theta * np.eye(3)) / (1 - cos_theta)
+        diagonal = np.diagonal(outer, axis1=-2, axis2=-1)
+        column = np.argmax(diagonal, axis=-1)
+        axis = np.take_along_axis(outer, column[..., None, None], axis=-1)[..., 0]
+        axis = axis / np.linalg.norm(axis, axis=-1, keepdims=True)
+        sign = np.where(np.sum(axis * w, axis=-1) < 0, -1.0, 1.0)
+        rotvec = np.where(large[..., None], axis * (sign * theta)[..., None], rotvec)
+    return rotvec
+
+
+#single pose versions of the two functions above, plain python math is a lot faster than numpy for one 3x3 matrix.
+#same formulas
+def single_rotvec_to_matrix(rx, ry, rz):
+    theta = math.sqrt(rx * rx + ry * ry + rz * rz)
+    if theta < SMALL_ANGLE:
+        a, b = 1 - theta ** 2 / 6, 0.5 - theta ** 2 / 24
+    else:
+        a, b = math.sin(theta) / theta, (1 - math.cos(theta)) / theta ** 2
+    xx, yy, zz, xy, xz, yz = rx * rx, ry * ry, rz * rz, rx * ry, rx * rz, ry * rz
+    return np.array([
+        [1 - b * (yy + zz), b * xy - a * rz, b * xz + a * ry],
+        [b * xy + a * rz, 1 - b * (xx + zz), b * yz - a * rx],
+        [b * xz - a * ry, b * yz + a * rx, 1 - b * (xx + yy)],
+    ])
+
+
+def single_matrix_to_rotvec(R):
+    (r00, r01, r02), (r10, r11, r12), (r20, r21, r22) = R.tolist()
+    wx, wy, wz = r21 - r12, r02 - r20, r10 - r01
+    sin_2 = math.sqrt(wx * wx + wy * wy + wz * wz)
+    cos_2 = r00 + r11 + r22 - 1
+    theta = math.atan2(sin_2, cos_2)
+    if cos_2 >= 0:
+        factor = 0.5 + theta ** 2 / 12 if theta < SMALL_ANGLE else theta / sin_2
+        return np.array([wx * factor, wy * factor, wz * factor])
+
+    cos_theta = cos_2 / 2
+    symmetric = [[r00 - cos_theta, (r01 + r10) / 2, (r02 + r20) / 2],
+                 [(r01 + r10) / 2, r11 - cos_theta, (r12 + r21) / 2],
+                 [(r02 + r20) / 2, (r12 + r21) / 2, r22 - cos_theta]]
+    column = max(range(3), key=lambda i: symmetric[i][i])
+    x, y, z = symmetric[column]
+    scale = theta / math.sqrt(x * x + y * y + z * z)
+    if x * wx + y * wy + z * wz < 0:
+        scale = -scale
+    return np.array([x * scale, y * scale, z * scale])
+
+
+#poses to 4x4 transformation matrices, (..., 6) -> (..., 4, 4)
+def pose_to_matrix(pose):
+    pose = np.asarray(pose, dtype=float)
+    T = np.zeros(pose.shape[:-1] + (4, 4))
+    T[..., :3, :3] = rotvec_to_matrix(pose[..., 3:6])
+    T[..., :3, 3] = pose[..., :3]
+    T[..., 3, 3] = 1.0
+    return T
+
+
+#4x4 transformation matrices to poses, (..., 4, 4) -> (..., 6)
+def matrix_to_pose(T):
+    T = np.asarray(T, dtype=float)
+    return np.concatenate([T[..., :3, 3], matrix_to_rotvec(T[..., :3, :3])], axis=-1)
+
+
+@lru_cache(maxsize=256)
+def _constant_matrix(pose):
+    T = pose_to_matrix(pose)
+    T.flags.writeable = False
+    return T
+
+
+#matrix of a transform that does not change, from the cache. the returned matrix is read only
+def constant_matrix(pose):
+    return _constant_matrix(tuple(float(value) for value in pose))
+
+
+#same as pose_trans in URScript: pose2 expressed in the frame of pose1. with constant=True pose2 must be a single
+#pose and its matrix comes from the cache
+def pose_trans(pose1, pose2, constant=False):
+    T2 = constant_matrix(pose2) if constant else pose_to_matrix(pose2)
+    pose1 = np.asarray(pose1, dtype=float)
+    if pose1.ndim == 1 and T2.ndim == 2:
+        #single pose, skip the 4x4 matrices
+        R1 = single_rotvec_to_matrix(*pose1[3:6].tolist())
+        position = pose1[:3] + R1 @ T2[:3, 3]
+        return np.concatenate([position, single_matrix_to_rotvec(R1 @ T2[:3, :3])])
+    return matrix_to_pose(pose_to_matrix(pose1) @ T2)
+
+
+#inverse of poses, pose_trans(pose, pose_inv(pose)) is the zero pose
+def pose_inv(pose):
+    T = pose_to_matrix(pose)
+    R_inv = np.swapaxes(T[..., :3, :3], -1, -2)
+    t_inv = -(R_inv @ T[..., :3, 3, None])[..., 0]
+    return np.concatenate([t_inv, matrix_to_rotvec(R_inv)], axis=-1)
+
+
+#pose_b expressed in the frame of pose_a
+def relative_pose(pose_a, pose_b):
+    return matrix_to_pose(np.linalg.inv(pose_to_matrix(pose_a)) @ pose_to_matrix(pose_b))
+
+
+#pose change when switching from one tcp to another at the same flange position:
+#pose_trans(pose_with_from_tcp, tcp_change(from_tcp, to_tcp)) is the pose with to_tcp
+@lru_cache(maxsize=64)
+def _tcp_change(from_tcp, to_tcp):
+    change = relative_pose(from_tcp, to_tcp)
+    change.flags.writeable = False
+    return change
+
+
+def tcp_change(from_tcp, to_tcp):
+    return _tcp_change(tuple(float(value) for value in from_tcp), tuple(float(value) for value in to_tcp))
+
+
+#rotation angle in radians between the orientations of pose_a and pose_b
+def rotation_angle(pose_a, pose_b):
+    R_a = rotvec_to_matrix(np.asarray(pose_a, dtype=float)[..., 3:6])
+    R_b = rotvec_to_matrix(np.asarray(pose_b, dtype=float)[..., 3:6])
+    return np.linalg.norm(matrix_to_rotvec(np.swapaxes(R_a, -1, -2) @ R_b), axis=-1)
+
+
+#poses at fractions t (scalar or array) between pose_a and pose_b, the way moveL moves: position on the straight line,
+#orientation about one fixed axis. returns (len(t), 6) for an array of t
+def interpolate_pose(pose_a, pose_b, t):
+    pose_a = np.asarray(pose_a, dtype=float)[:6]
+    pose_b = np.asarray(pose_b, dtype=float)[:6]
+    t = np.asarray(t, dtype=float)[..., None]
+    R_a = rotvec_to_matrix(pose_a[3:6])
+    rotation = matrix_to_rotvec(R_a.T @ rotvec_to_matrix(pose_b[3:6]))
+    position = (1 - t) * pose_a[:3] + t * pose_b[:3]
+    orientation = matrix_to_rotvec(R_a @ rotvec_to_matrix(t * rotation))
+    return np.concatenate([position, orientation], axis=-1)
@@ -0,0 +1,341 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+import configuration
+
+
+##########################
+#offline replay harness. runs the full BoxingMachine loop on a recorded camera session and a simulated robot,
+#so cycle time changes can be measured without a production cell. prints parts per minute, time per stage
+#and robot idle time.
+#
+#record a session on the line pc:   python replay_harness.py record sessions/belt_01 --frames 300
+#run the benchmark anywhere:        python replay_harness.py run sessions/belt_01 --placements 20
+#test the camera calibration:       python replay_harness.py calibrate
+#compare the yolo backends:         python replay_harness.py backends sessions/belt_01 --backends torch onnx openvino
+##########################
+
+
+#stands in for the UserInterface, the machine only needs these methods
+class HeadlessInterface:
+    def __init__(self):
+        self.stopped = False
+        self.machine = None
+        self.status = ""
+
+    def update_status(self, new_status):
+        if new_status != self.status:
+            logging.info(f"status: {new_status}")
+        self.status = new_status
+
+
+def print_report(report):
+    print(f"run time:          {report['elapsed']:.1f} s")
+    print(f"placements:        {report['placements']}")
+    print(f"parts per minute:  {report['parts_per_minute']:.2f}")
+    if 'motion_time' in report:
+        print(f"robot moving:      {report['motion_time']:.1f} s")
+        print(f"robot idle:        {report['idle_time']:.1f} s")
+    for name, stage in report['stages'].items():
+        print(f"stage {name:<12} total {stage['total']:.1f} s   count {stage['count']}   average {stage['average']:.3f} s")
+
+
+def run(args):
+    #configuration has to be changed before the other modules import it
+    configuration.replay_path = args.session
+    configuration.simulate_robot = True
+    configuration.sim_time_scale = args.time_scale
+    configuration.pipelined_mode = args.pipelined
+    from boxing_machine import BoxingMachine
+    from machine_state import MACHINE_PAUSED
+
+    interface = HeadlessInterface()
+    machine = BoxingMachine("simulated", interface=interface)
+    interface.machine = machine
+
+    events = machine.state.subscribe()
+    machine_thread = threading.Thread(target=machine.start, daemon=True)
+    machine.stats.reset()
+    machine.robot.motion_time = 0.0
+    machine_thread.start()
+
+    start = time.time()
+    while machine_thread.is_alive():
+        #the machine pauses itself after a bad part. nobody can fix it in a replay, so just continue
+        while not events.empty():
+            event, data = events.get()
+            if event == MACHINE_PAUSED:
+                machine.resume()
+        if machine.stats.placements >= args.placements or time.time() - start > args.duration:
+            machine.stop_run()
+            break
+        time.sleep(0.1)
+    machine_thread.join(timeout=60)
+
+    report = machine.stats.report(motion_time=machine.robot.motion_time)
+    machine.stop()
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+#stands in for the BoxingMachine when only the pick or place motion is simulated
+class MotionOnlyMachine:
+    stop_main_loop = False
+
+    def __init__(self):
+        self.interface = HeadlessInterface()
+        self.camera = None
+        self.pick_part = None
+
+    def wait_if_paused(self):
+        pass
+
+    def pause_for_operator(self, status):
+        pass
+
+
+#camera stand in for the placement check
+class NoBadParts:
+    def check_bad_part_placement(self):
+        return False
+
+
+#simulated motion time of one pick, segmented moves against the single blended path
+def compare_pick_paths(args):
+    from UR5E_control import URControl
+    from pick_parts import Pick_parts
+    from fake_rtde import FakeRobot
+
+    for part_type in args.part_types:
+        times = {}
+        for single_path in (False, True):
+            fake = FakeRobot(time_scale=0)
+            robot = URControl("simulated")
+            robot.attach(fake.control, fake.receive, fake.io)
+            pick = Pick_parts(robot=robot, boxing_machine=MotionOnlyMachine())
+            pick.single_path = single_path
+            pick.pick_parts(args.x, args.y, part_type=part_type)
+            times[single_path] = (fake.state.motion_time, fake.state.moves)
+        (segmented, segmented_moves), (single, single_moves) = times[False], times[True]
+        print(f"{part_type:<12} segmented {segmented:.3f} s ({segmented_moves} moves)   "
+              f"single path {single:.3f} s ({single_moves} moves)   saved {segmented - single:.3f} s")
+
+
+#simulated motion time of one placement per rotation, segmented moves against the single blended path
+def compare_place_paths(args):
+    from UR5E_control import URControl
+    from pick_parts import Pick_parts
+    from place_parts import Box, Part, Pack_Box
+    from fake_rtde import FakeRobot
+
+    for part_type in args.part_types:
+        for part_index in range(4):     #one part of every rotation
+            times = {}
+            for single_path in (False, True):
+                fake = FakeRobot(time_scale=0)
+                robot = URControl("simulated")
+                robot.attach(fake.control, fake.receive, fake.io)
+                machine = MotionOnlyMachine()
+                machine.camera = NoBadParts()
+                machine.pick_part = Pick_parts(robot=robot, boxing_machine=machine)
+                #same boxes as the BoxingMachine
+                box = Box(total_boxes=2, box_pos=[(-215/1000, 533.8/1000, 0), [220/1000,525.8/1000, 0]], box_size=(0.365, 0.365, 0.180))
+                pack_box = Pack_Box(box=box, part=Part((0.184, 0.170, 0.01260)), robot=robot, boxing_machine=machine)
+                pack_box.single_path = single_path
+                part = pack_box.get_pack_pos(part_type)[0][part_index]
+
+                machine.pick_part.pick_parts(args.x, args.y, part_type=part_type)
+                start_time, start_moves = fake.state.motion_time, fake.state.moves
+                pack_box.place_part(part, part_type=part_type, box_rotation=args.box_rotation)
+                times[single_path] = (fake.state.motion_time - start_time, fake.state.moves - start_moves)
+            (segmented, segmented_moves), (single, single_moves) = times[False], times[True]
+            print(f"{part_type:<12} rotation {part['rotation']:>4}   segmented {segmented:.3f} s ({segmented_moves} moves)   "
+                  f"single path {single:.3f} s ({single_moves} moves)   saved {segmented - single:.3f} s")
+
+
+#runs the calibration with the simulated robot and a rendered target, and compares the result with the true camera pose
+def calibrate(args):
+    import numpy as np
+    from UR5E_control import URControl
+    from fake_rtde import FakeRobot
+    from frame_grabber import FrameGrabber
+    from calibration import Calibrator, SimulatedTargetSource, calibration_grid, save_calibration
+
+    fake = FakeRobot(time_scale=0)
+    robot = URControl("simulated")
+    robot.attach(fake.control, fake.receive, fake.io)
+    grabber = FrameGrabber(SimulatedTargetSource(fake.state, args.target, args.extrinsic))
+    grabber.start()
+
+    calibrator = Calibrator(robot, grabber, args.target, settle_time=0.05)
+    calibration = calibrator.run(calibration_grid(configuration.capture_pose, args.spacing, args.columns, args.rows))
+    grabber.stop()
+
+    for name, result in calibration['residuals'].items():
+        print(f"{name:<18} rms {result['rms_mm']:.3f} mm   max {result['max_mm']:.3f} mm   samples {result['samples']}")
+    if calibration['camera_extrinsic'] is not None:
+        error = np.abs(np.array(calibration['camera_extrinsic']) - np.array(args.extrinsic))
+        print(f"camera extrinsic   position error {np.max(error[:3]) * 1000:.3f} mm   rotation error {np.degrees(np.max(error[3:])):.3f} deg")
+    if args.output:
+        save_calibration(args.output, calibration)
+
+
+#greedy match of detections against the reference detections of the same frame: same class and iou >= min_iou.
+#returns (reference index, index, iou) per match
+def match_detections(reference, detections, min_iou=0.5):
+    import numpy as np
+    if len(reference) == 0 or len(detections) == 0:
+        return []
+    a = reference.boxes.astype(float)[:, None]
+    b = detections.boxes.astype(float)[None]
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = width * height
+    union = reference.area[:, None] + detections.area[None] - inter
+    iou = inter / np.maximum(union, 1)
+    iou[reference.classes[:, None] != detections.classes[None]] = 0
+
+    matches = []
+    used_reference, used = set(), set()
+    for k in np.argsort(-iou, axis=None):
+        i, j = divmod(int(k), iou.shape[1])
+        if iou[i, j] < min_iou:
+            break
+        if i not in used_reference and j not in used:
+            used_reference.add(i)
+            used.add(j)
+            matches.append((i, j, float(iou[i, j])))
+    return matches
+
+
+#latency and detections of the yolo backends on recorded frames. the first backend is the reference for the accuracy
+def benchmark_backends(args):
+    import numpy as np
+    from frame_grabber import ReplaySource
+    from detections import Detections
+    from model_backend import load_model
+    from inference_engine import InferenceEngine
+
+    files = ReplaySource(args.session).color_files[:args.frames]
+    frames = [ReplaySource.load(file) for file in files]
+    reference = None
+    report = {}
+    for backend in args.backends:
+        start = time.time()
+        model, device = load_model(args.weights, backend, args.int8 and backend == 'openvino', args.int8_data)
+        engine = InferenceEngine(model, device)
+        engine.warmup(frames[0].shape, args.imgsz)
+        load_time = time.time() - start
+
+        results, latencies = [], []
+        for frame in frames:
+            start = time.perf_counter()
+            result = engine.predict([frame], args.imgsz)[0]
+            latencies.append(time.perf_counter() - start)
+            results.append(Detections.from_result(result))
+        latencies = np.array(latencies) * 1000
+
+        name = backend + (' int8' if args.int8 and backend == 'openvino' else '')
+        entry = {'device': device, 'load_time': load_time, 'latency_ms': float(np.mean(latencies)),
+                 'latency_p95_ms': float(np.percentile(latencies, 95)), 'detections': sum(len(d) for d in results)}
+        if reference is None:
+            reference = results
+        else:
+            matches = [match_detections(ref, detections) for ref, detections in zip(reference, results)]
+            matched = sum(len(m) for m in matches)
+            ious = [iou for m in matches for _, _, iou in m]
+            confidence = [abs(ref.confidences[i] - detections.confidences[j])
+                          for ref, detections, m in zip(reference, results, matches) for i, j, _ in m]
+            entry.update(matched=matched, missed=sum(len(d) for d in reference) - matched,
+                         extra=entry['detections'] - matched, mean_iou=float(np.mean(ious)) if ious else 0.0,
+                         confidence_diff=float(np.mean(confidence)) if confidence else 0.0)
+        report[name] = entry
+
+        print(f"{name:<14} {device:<5} load {load_time:6.1f} s   latency {entry['latency_ms']:7.1f} ms   "
+              f"p95 {entry['latency_p95_ms']:7.1f} ms   detections {entry['detections']}")
+        if 'matched' in entry:
+            print(f"{'':<14} against {args.backends[0]}: matched {entry['matched']}   missed {entry['missed']}   "
+                  f"extra {entry['extra']}   mean iou {entry['mean_iou']:.3f}   confidence diff {entry['confidence_diff']:.3f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({'frames': len(frames), 'backends': report}, f, indent=2)
+
+
+def record(args):
+    from camera_position import CameraPosition
+    from frame_grabber import FrameGrabber, RealSenseSource, record_session
+
+    #only the camera connection is needed, no model or robot
+    camera = CameraPosition.__new__(CameraPosition)
+    camera.connect_camera()
+    grabber = FrameGrabber(RealSenseSource(camera))
+    grabber.start()
+    record_session(grabber, args.session, args.frames)
+    grabber.stop()
+    camera.pipeline.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="offline replay harness and cycle time benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the boxing machine on a recorded session with a simulated robot")
+    run_parser.add_argument("session", help="recorded directory or .bag file")
+    run_parser.add_argument("--placements", type=int, default=20, help="stop after this many placements")
+    run_parser.add_argument("--duration", type=float, default=600, help="stop after this many seconds")
+    run_parser.add_argument("--time-scale", type=float, default=1.0, help="simulated motion time multiplier, 0 = no sleeping. reported times are wall clock, use 1 for benchmarks")
+    run_parser.add_argument("--pipelined", action="store_true", help="run in pipelined mode")
+    run_parser.add_argument("--json", help="write the report to this file")
+
+    pick_parser = commands.add_parser("pick-time", help="compare simulated pick motion time, segmented against single path")
+    pick_parser.add_argument("--x", type=float, default=-0.6)
+    pick_parser.add_argument("--y", type=float, default=0.0)
+    pick_parser.add_argument("--part-types", nargs="+", default=['Big-Blue', 'Green', 'Holed', 'Rubber', 'Small-Blue'])
+
+    place_parser = commands.add_parser("place-time", help="compare simulated placement motion time, segmented against single path")
+    place_parser.add_argument("--x", type=float, default=-0.6, help="pick position the placement starts from")
+    place_parser.add_argument("--y", type=float, default=0.0)
+    place_parser.add_argument("--box-rotation", default='horizontal', choices=['horizontal', 'vertical'])
+    place_parser.add_argument("--part-types", nargs="+", default=['Big-Blue', 'Green', 'Holed', 'Rubber', 'Small-Blue'])
+
+    calibrate_parser = commands.add_parser("calibrate", help="run the camera calibration with a simulated robot and camera")
+    calibrate_parser.add_argument("--target", type=float, nargs=3, default=[-0.66, -0.09, -0.12], help="robot x y z of the target")
+    calibrate_parser.add_argument("--extrinsic", type=float, nargs=6, default=[0.004, -0.006, 0.01, 0.01, -0.02, 0.03], help="true camera pose in the capture tcp frame")
+    calibrate_parser.add_argument("--spacing", type=float, default=0.08)
+    calibrate_parser.add_argument("--columns", type=int, default=4)
+    calibrate_parser.add_argument("--rows", type=int, default=3)
+    calibrate_parser.add_argument("--output", help="write the calibration to this file")
+
+    record_parser = commands.add_parser("record", help="record a session from the camera")
+    record_parser.add_argument("session", help="output directory")
+    record_parser.add_argument("--frames", type=int, default=300)
+
+    backends_parser = commands.add_parser("backends", help="compare latency and detections of the yolo backends on recorded frames")
+    backends_parser.add_argument("session", help="recorded directory")
+    backends_parser.add_argument("--backends", nargs="+", default=['torch', 'onnx', 'openvino'], help="the first one is the reference")
+    backends_parser.add_argument("--frames", type=int, default=100)
+    backends_parser.add_argument("--weights", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "best.pt"))
+    backends_parser.add_argument("--imgsz", type=int, help="yolo input size, default = model default")
+    backends_parser.add_argument("--int8", action="store_true", help="quantize the openvino export")
+    backends_parser.add_argument("--int8-data", help="dataset yaml with the calibration images for --int8")
+    backends_parser.add_argument("--json", help="write the report to this file")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "pick-time":
+        compare_pick_paths(args)
+    elif args.command == "place-time":
+        compare_place_paths(args)
+    elif args.command == "calibrate":
+        calibrate(args)
+    elif args.command == "backends":
+        benchmark_backends(args)
+    else:
+        record(args)
@@ -0,0 +1,302 @@
+import rtde_control # For controlling the robot
+import rtde_receive # For receiving data from the robot
+import rtde_io # For robot IO
+
+import threading
+import time
+import logging
+
+
+##########################
+#connection to the robot: the ur_rtde control, receive and io interfaces. the three interfaces are opened at the same
+#time, each in its own thread. a daemon thread watches the connection through the receive interface only: its
+#timestamp (the robot sends a new one every cycle), the protective stop and the robot status bits. when the timestamp
+#stops advancing or the interface reports it is disconnected, the interfaces are opened again in the background with a
+#retry delay that doubles up to retry_max. the control interface is not thread safe: every control call goes through
+#call() and holds command_lock. after a protective stop the monitor only notes that the control script stopped, the
+#next control call uploads it again once the stop is released, no restart of the service needed.
+#robot commands get the interfaces with interfaces(), that waits for the connection and raises a RobotError
+#instead of returning None
+##########################
+
+#index of the interfaces in the tuple of interfaces()
+CONTROL = 0
+RECEIVE = 1
+IO = 2
+
+#bit of getRobotStatus() that is set while a program (the control script) runs
+PROGRAM_RUNNING_BIT = 2
+
+
+class RobotError(Exception):
+    pass
+
+#no connection to the robot, or it was lost during the command
+class RobotConnectionError(RobotError):
+    pass
+
+#the robot is connected but did not carry out the command (protective stop, control script not running, bad pose)
+class RobotCommandError(RobotError):
+    pass
+
+
+def rtde_openers(robot_ip):
+    return (lambda: rtde_control.RTDEControlInterface(robot_ip),
+            lambda: rtde_receive.RTDEReceiveInterface(robot_ip),
+            lambda: rtde_io.RTDEIOInterface(robot_ip))
+
+
+class RobotConnection:
+    def __init__(self, robot_ip, openers=None, health_interval=0.05, health_timeout=0.5, retry_delay=0.05, retry_max=1.0, wait_timeout=5.0):
+        self.robot_ip = robot_ip
+        self.openers = openers if openers is not None else rtde_openers(robot_ip)   #one function per interface
+        self.health_interval = health_interval  #seconds between health checks
+        self.health_timeout = health_timeout    #seconds without a new receive timestamp before the connection is lost
+        self.retry_delay = retry_delay          #first retry delay, doubles after every failed attempt
+        self.retry_max = retry_max
+        self.wait_timeout = wait_timeout        #seconds a command waits for the connection
+
+        self.lock = threading.Lock()
+        self.command_lock = threading.RLock()   #held during every call of the control interface
+        self.current = None                     #(control, receive, io) while connected
+        self.connected = threading.Event()
+        self.running = False
+        self.monitor_thread = None
+
+        self.last_timestamp = None              #last receive timestamp and when it changed
+        self.last_progress = 0.0
+        self.protective_stop = False
+        self.upload_needed = False              #set by the monitor when the control script stopped, the next control call uploads it
+        self.next_upload = 0.0                  #earliest time for the next upload of the control script
+        self.upload_delay = retry_delay
+
+
+    #opens the three interfaces at the same time. raises RobotConnectionError if one of them fails
+    def open_interfaces(self):
+        results = [None] * len(self.openers)
+        errors = [None] * len(self.openers)
+
+        def open_one(k):
+            try:
+                results[k] = self.openers[k]()
+            except Exception as e:
+                errors[k] = e
+
+        threads = [threading.Thread(target=open_one, args=(k,), daemon=True) for k in range(len(self.openers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        failed = [e for e in errors if e is not None]
+        if failed:
+            self.close_interfaces(results)
+            raise RobotConnectionError(f"can not connect to robot {self.robot_ip}: {failed[0]}") from failed[0]
+        return tuple(results)
+
+
+    #disconnect, errors are ignored (the connection is usually already gone)
+    def close_interfaces(self, interfaces):
+        for interface in interfaces:
+            try:
+                if interface is not None and hasattr(interface, 'disconnect'):
+                    interface.disconnect()
+            except Exception:
+                pass
+
+
+    #first connection, retries until timeout. starts the health monitor
+    def connect(self, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        delay = self.retry_delay
+        attempt = 1
+        while True:
+            try:
+                self.set_interfaces(self.open_interfaces())
+                logging.info(f"Connected to robot: {self.robot_ip} on attempt {attempt}")
+                break
+            except RobotConnectionError as e:
+                logging.error(f"Attempt {attempt} failed: {e}")
+                if time.monotonic() + delay > deadline:
+                    logging.error("Unable to connect to the robot.")
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+                attempt += 1
+        self.start_monitor()
+
+
+    #use interfaces that are already open, without health monitor (simulated robot in the replay harness)
+    def attach(self, control, receive, io):
+        self.set_interfaces((control, receive, io))
+
+
+    def set_interfaces(self, interfaces):
+        with self.lock:
+            self.current = interfaces
+            self.last_timestamp = None
+            self.last_progress = time.monotonic()
+            self.protective_stop = False
+            self.upload_needed = False
+            self.connected.set()
+
+
+    def start_monitor(self):
+        if self.running:
+            return
+        self.running = True
+        self.monitor_thread = threading.Thread(target=self.monitor, daemon=True)
+        self.monitor_thread.start()
+
+
+    #stops the monitor and the control script and closes the interfaces
+    def close(self):
+        self.running = False
+        if self.monitor_thread is not None:
+            self.monitor_thread.join(timeout=2)
+            self.monitor_thread = None
+        with self.lock:
+            interfaces = self.current
+            self.current = None
+            self.connected.clear()
+        if interfaces is None:
+            return
+        try:
+            with self.command_lock:
+                interfaces[CONTROL].stopScript()
+        except Exception as e:
+            logging.error(f"error stopping control script: {e}")
+        self.close_interfaces(interfaces)
+
+
+    #(control, receive, io). waits up to wait_timeout for the connection to come back
+    def interfaces(self):
+        if not self.connected.wait(self.wait_timeout):
+            raise RobotConnectionError(f"no connection to robot {self.robot_ip}")
+        interfaces = self.current
+        if interfaces is None:
+            raise RobotConnectionError(f"no connection to robot {self.robot_ip}")
+        return interfaces
+
+
+    #calls a method of one of the interfaces. exceptions become a RobotConnectionError if the connection is gone,
+    #otherwise a RobotCommandError. control calls hold command_lock and upload the control script first if it stopped
+    def call(self, index, method, *args):
+        interfaces = self.interfaces()
+        if index != CONTROL:
+            return self.send(interfaces, index, method, *args)
+        with self.command_lock:
+            if self.upload_needed:
+                self.upload_script(interfaces)
+            return self.send(interfaces, index, method, *args)
+
+
+    def send(self, interfaces, index, method, *args):
+        try:
+            return getattr(interfaces[index], method)(*args)
+        except Exception as e:
+            if self.is_alive(interfaces, control=index == CONTROL):
+                raise RobotCommandError(f"{method} failed: {e}") from e
+            self.lost(interfaces, f"{method} failed: {e}")
+            raise RobotConnectionError(f"connection lost during {method}: {e}") from e
+
+
+    #the control interface is only asked with command_lock held
+    def is_alive(self, interfaces, control=False):
+        try:
+            if control and not interfaces[CONTROL].isConnected():
+                return False
+            return interfaces[RECEIVE].isConnected()
+        except Exception:
+            return False
+
+
+    #the controller stops the control script on a protective stop. uploads it again, call with command_lock held.
+    #raises RobotCommandError while the stop is not released or the upload fails
+    def upload_script(self, interfaces):
+        now = time.monotonic()
+        if self.protective_stop:
+            raise RobotCommandError("control script is not running (protective stop)")
+        if now < self.next_upload:
+            raise RobotCommandError("control script is not running")
+        try:
+            uploaded = interfaces[CONTROL].reuploadScript()
+        except Exception as e:
+            uploaded = False
+            logging.error(f"can not upload control script: {e}")
+        if not uploaded:
+            logging.error(f"control script upload refused, next attempt in {self.upload_delay:.2f} s")
+            self.next_upload = now + self.upload_delay
+            self.upload_delay = min(self.upload_delay * 2, self.retry_max)
+            raise RobotCommandError("control script is not running, upload failed")
+        logging.info("control script uploaded again")
+        self.upload_needed = False
+        self.upload_delay = self.retry_delay
+        self.next_upload = now + self.health_timeout    #the status bits can still show the stopped script for a moment
+
+
+    #marks the connection as lost, the monitor opens it again
+    def lost(self, interfaces, reason):
+        with self.lock:
+            if self.current is not interfaces:
+                return      #already lost or replaced
+            self.current = None
+            self.connected.clear()
+        logging.error(f"lost connection to robot {self.robot_ip}: {reason}")
+        self.close_interfaces(interfaces)
+
+
+    def monitor(self):
+        delay = self.retry_delay
+        while self.running:
+            if not self.connected.is_set():
+                try:
+                    self.set_interfaces(self.open_interfaces())
+                    logging.info(f"reconnected to robot {self.robot_ip}")
+                    delay = self.retry_delay
+                except RobotConnectionError as e:
+                    logging.error(f"{e}, next attempt in {delay:.2f} s")
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.retry_max)
+                continue
+            self.check_health()
+            time.sleep(self.health_interval)
+
+
+    #only reads the receive interface, the control interface belongs to the thread that holds command_lock
+    def check_health(self):
+        interfaces = self.current
+        if interfaces is None:
+            return
+        receive = interfaces[RECEIVE]
+        try:
+            timestamp = receive.getTimestamp()
+            alive = self.is_alive(interfaces)
+            protective_stop = receive.isProtectiveStopped()
+            program_running = bool(int(receive.getRobotStatus()) & PROGRAM_RUNNING_BIT)
+        except Exception as e:
+            self.lost(interfaces, f"health check failed: {e}")
+            return
+
+        now = time.monotonic()
+        if timestamp != self.last_timestamp:
+            self.last_timestamp = timestamp
+            self.last_progress = now
+        if not alive:
+            self.lost(interfaces, "interface disconnected")
+            return
+        if now - self.last_progress > self.health_timeout:
+            self.lost(interfaces, f"no robot data for {now - self.last_progress:.2f} s")
+            return
+
+        if protective_stop != self.protective_stop:
+            if protective_stop:
+                logging.error("protective stop")
+            else:
+                logging.info("protective stop released")
+            self.protective_stop = protective_stop
+
+        #the next control call uploads the script again
+        if not program_running and not self.upload_needed and now >= self.next_upload:
+            logging.info("control script is not running")
+            self.upload_needed = True
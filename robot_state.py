@@ -0,0 +1,182 @@
+import threading
+import logging
+import time
+import numpy as np
+from pose_math import rotation_angle
+from robot_connection import RECEIVE
+
+
+##########################
+#robot state samples in a ring buffer, one record per sample: tcp pose, joint positions, tcp and joint speeds
+#and the digital outputs. one writer, readers never block. every record carries its seq, a reader checks it after
+#copying, so a record that got overwritten while reading is detected (same idea as the FrameRing).
+#the records of the last seconds are the motion telemetry of the robot.
+##########################
+STATE_DTYPE = np.dtype([
+    ('seq', np.int64),              #increases with every sample, 0 = empty slot
+    ('time', np.float64),           #time.time() when the sample was read
+    ('robot_time', np.float64),     #timestamp of the robot controller, seconds
+    ('tcp_pose', np.float64, 6),    #actual tcp pose with the tcp that was set at that moment
+    ('q', np.float64, 6),           #actual joint positions, radians
+    ('tcp_speed', np.float64, 6),
+    ('qd', np.float64, 6),          #joint speeds, radians per second
+    ('digital_out', np.uint32),     #bits of the standard digital outputs
+])
+
+
+class StateRing:
+    def __init__(self, slots=1000):
+        self.slots = slots
+        self.records = np.zeros(slots, dtype=STATE_DTYPE)
+        self.seq = 0                #seq of the newest record, 0 = nothing published yet
+
+    def publish(self, robot_time, tcp_pose, q, tcp_speed, qd, digital_out):
+        seq = self.seq + 1
+        self.records[seq % self.slots] = (seq, time.time(), robot_time, tcp_pose, q, tcp_speed, qd, digital_out)
+        self.seq = seq
+        return seq
+
+    #newest record (a copy) or None
+    def latest(self):
+        while True:
+            seq = self.seq
+            if seq == 0:
+                return None
+            record = self.records[seq % self.slots].copy()
+            if record['seq'] == seq:
+                return record
+
+    #copies of the records of the last seconds, oldest first
+    def history(self, seconds=None):
+        seq = self.seq
+        count = min(seq, self.slots - 1)    #the oldest slot can be written while copying
+        seqs = np.arange(seq - count + 1, seq + 1)
+        records = self.records[seqs % self.slots]
+        records = records[records['seq'] == seqs]
+        if seconds is not None and len(records):
+            records = records[records['time'] >= records['time'][-1] - seconds]
+        return records
+
+
+##########################
+#samples the receive interface of the robot connection into a StateRing, in a daemon thread. every sample is six
+#calls into rtde_receive that need the gil, so the rate is what the readers need (125 Hz, every 8 ms), not the 500 Hz
+#of the controller. a record is only added when the robot timestamp changed. the ring is the motion history for
+#wait_for_pose and wait_until_still and the telemetry, reads right after a command go to the receive interface.
+##########################
+class RobotStateCache:
+    def __init__(self, connection, rate=125, history=2.0):
+        self.connection = connection        #RobotConnection
+        self.period = 1.0 / rate            #seconds between polls of the receive interface
+        self.ring = StateRing(max(int(rate * history), 2))
+        self.new_sample = threading.Condition()
+        self.running = False
+        self.sample_thread = None
+
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.sample_thread = threading.Thread(target=self.sample_loop, daemon=True)
+        self.sample_thread.start()
+        logging.info("robot state cache started")
+
+
+    def stop(self):
+        self.running = False
+        if self.sample_thread is not None:
+            self.sample_thread.join(timeout=2)
+        self.sample_thread = None
+
+
+    def sample_loop(self):
+        last_robot_time = None
+        failed = False
+        while self.running:
+            if not self.connection.connected.wait(0.1):
+                continue
+            interfaces = self.connection.current
+            if interfaces is None:
+                continue
+            receive = interfaces[RECEIVE]
+            try:
+                robot_time = receive.getTimestamp()
+                if robot_time != last_robot_time:
+                    self.ring.publish(robot_time, receive.getActualTCPPose(), receive.getActualQ(), receive.getActualTCPSpeed(),
+                                      receive.getActualQd(), receive.getActualDigitalOutputBits())
+                    last_robot_time = robot_time
+                    with self.new_sample:
+                        self.new_sample.notify_all()
+                failed = False
+            except Exception as e:
+                #the connection watches its own health, just log once and keep trying
+                if not failed:
+                    logging.error(f"error reading robot state: {e}")
+                failed = True
+            time.sleep(self.period)
+
+
+    #seq of the newest record
+    def latest_seq(self):
+        return self.ring.seq
+
+
+    #newest record or None, never blocks. None if the record is older than max_age seconds
+    def latest(self, max_age=None):
+        record = self.ring.latest()
+        if record is None or (max_age is not None and time.time() - record['time'] > max_age):
+            return None
+        return record
+
+
+    #returns a record with seq >= min_seq. only waits if the ring has no such record yet. None on timeout
+    def wait_for_sample(self, min_seq=1, timeout=0.1):
+        if self.ring.seq < min_seq:
+            with self.new_sample:
+                if not self.new_sample.wait_for(lambda: self.ring.seq >= min_seq, timeout):
+                    return None
+        return self.ring.latest()
+
+
+    #waits until the tcp is within tolerance (meters) and rotation_tolerance (radians) of pose.
+    #returns the record that reached the pose, None on timeout
+    def wait_for_pose(self, pose, tolerance=0.001, rotation_tolerance=0.01, timeout=5.0):
+        pose = np.asarray(pose[:6], dtype=float)
+        deadline = time.time() + timeout
+        seq = 1
+        while True:
+            record = self.wait_for_sample(seq, max(deadline - time.time(), 0))
+            if record is None:
+                return None
+            tcp_pose = record['tcp_pose']
+            if np.linalg.norm(tcp_pose[:3] - pose[:3]) <= tolerance and rotation_angle(tcp_pose, pose) <= rotation_tolerance:
+                return record
+            if time.time() >= deadline:
+                return None
+            seq = record['seq'] + 1
+
+
+    #waits until the tcp speed stays below max_speed (m/s) for settle_time seconds. returns the last record, None on timeout
+    def wait_until_still(self, max_speed=0.001, settle_time=0.05, timeout=5.0):
+        deadline = time.time() + timeout
+        still_since = None
+        seq = 1
+        while True:
+            record = self.wait_for_sample(seq, max(deadline - time.time(), 0))
+            if record is None:
+                return None
+            if np.linalg.norm(record['tcp_speed'][:3]) <= max_speed:
+                still_since = record['time'] if still_since is None else still_since
+                if record['time'] - still_since >= settle_time:
+                    return record
+            else:
+                still_since = None
+            if time.time() >= deadline:
+                return None
+            seq = record['seq'] + 1
+
+
+    #the records of the last seconds, oldest first: motion telemetry
+    def history(self, seconds=None):
+        return self.ring.history(seconds)